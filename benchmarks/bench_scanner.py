@@ -0,0 +1,116 @@
+"""Compare the single-pass Scanner against the original character loop.
+
+Run from the repository root with `python -m benchmarks.bench_scanner`.
+"""
+from __future__ import annotations
+from typing import List
+
+import argparse
+import glob
+import os
+import re
+import tempfile
+import time
+
+from jack_token import Token
+from scanner import Scanner
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sampleFiles', 'Pong')
+
+def legacy_tokenize(fileName: str) -> List[Token]:
+    """The line based, char-by-char tokenizer Scanner used before."""
+
+    with open(fileName, 'r') as infile:
+        lines = infile.readlines()
+
+    comment_pattern = re.compile(r'^(.*?)((/\*\*?|//).*)?$')
+    asterisk_comment_pattern = re.compile(r'/\*\*?.*')
+
+    cleaned_lines = []
+    line_index = 0
+    while line_index < len(lines):
+        line = lines[line_index]
+        if comment_pattern.match(line.strip()):
+            necessary_tokens = comment_pattern.match(line.strip()).group(1)
+            if necessary_tokens != '': cleaned_lines.append(necessary_tokens)
+
+        if asterisk_comment_pattern.search(line.strip()):
+            while not lines[line_index].strip().endswith('*/'):
+                line_index += 1
+
+        line_index += 1
+
+    all_tokens = []
+    empty_pattern = re.compile(r'\s')
+    for line in cleaned_lines:
+        current_token = ''
+        string_processing = False
+        for char in line:
+            if char == '"':
+                if string_processing:
+                    all_tokens.append(Token(current_token + '"'))
+                    current_token = ''
+                else:
+                    current_token += char
+                string_processing = not string_processing
+
+            elif (char in Token.symbols or empty_pattern.match(char)) and not string_processing:
+                if current_token != '': all_tokens.append(Token(current_token))
+                if char in Token.symbols: all_tokens.append(Token(char))
+                current_token = ''
+
+            else:
+                current_token += char
+
+    return all_tokens
+
+def scanner_tokens(fileName: str) -> List[Token]:
+    scanner = Scanner(fileName)
+    tokens = [scanner.current_token()]
+    while scanner.has_more_tokens():
+        scanner.advance()
+        tokens.append(scanner.current_token())
+    return tokens
+
+def best_time(function, argument, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def compare(label: str, files: List[str], repeat: int) -> None:
+
+    for fileName in files:
+        old = [(token.token_type, token.value) for token in legacy_tokenize(fileName)]
+        new = [(token.token_type, token.value) for token in scanner_tokens(fileName)]
+        if old != new:
+            raise AssertionError(f'Token streams differ for {fileName}')
+
+    legacy = sum(best_time(legacy_tokenize, fileName, repeat) for fileName in files)
+    current = sum(best_time(Scanner, fileName, repeat) for fileName in files)
+    print(f'{label:<24} legacy {legacy*1000:9.2f} ms   scanner {current*1000:9.2f} ms   speedup {legacy/current:5.1f}x')
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    arg_parser.add_argument('--copies', type=int, default=200, help='Pong sources concatenated into the synthetic input')
+    args = arg_parser.parse_args()
+
+    pong_files = sorted(glob.glob(os.path.join(SAMPLE_DIR, '*.jack')))
+    compare('sampleFiles/Pong', pong_files, args.repeat)
+
+    source = ''
+    for fileName in pong_files:
+        with open(fileName, 'r') as infile:
+            source += infile.read()
+
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic = os.path.join(directory, 'Synthetic.jack')
+        with open(synthetic, 'w') as outfile:
+            outfile.write(source * args.copies)
+        compare(f'synthetic x{args.copies}', [synthetic], args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Run the sample programs in the VM emulator to measure what the compiler
+options save and to catch miscompilations.
+
+Run from the repository root with `python -m benchmarks.emulate`. Every
+program is compiled once without options and once with `--options`, both
+builds run headless with the same scripted input, and the optimized build
+must return and draw and print exactly what the plain build does. The exit
+status is 1 on any difference.
+"""
+from __future__ import annotations
+from typing import List
+
+import argparse
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from exceptions import VMRuntimeError
+from vm_emulator import RunResult, VMEmulator
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(ROOT_DIR, 'sampleFiles')
+
+# scripted Keyboard input of every program
+PROGRAMS = {
+    'pong': dict(directory='Pong', keys=[0] * 200 + [130] * 50 + [0] * 100 + [132] * 80),
+    'average': dict(directory='Average', inputs=['5', '12', '-7', '30000', '41', '9']),
+}
+
+DEFAULT_OPTIONS = '--peephole --fold-constants --strength-reduce --branch-conditions --inline --eliminate-dead-code'
+
+def build(program: str, output_dir: str, options: List[str]) -> str:
+    """Compile a copy of a sample program with options and return its directory."""
+
+    directory = os.path.join(output_dir, program)
+    shutil.copytree(os.path.join(SAMPLE_DIR, PROGRAMS[program]['directory']), directory,
+                    ignore=shutil.ignore_patterns('*.vm'))
+    subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'main.py'), directory] + options,
+                   check=True, stdout=subprocess.DEVNULL)
+    return directory
+
+def run(directory: str, program: str, max_instructions: int) -> RunResult:
+    script = PROGRAMS[program]
+    return VMEmulator.from_directory(directory).run(max_instructions, script.get('keys', ()), script.get('inputs', ()))
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--options', default=DEFAULT_OPTIONS,
+            help=f'compiler options of the optimized build (default "{DEFAULT_OPTIONS}")')
+    arg_parser.add_argument('--programs', nargs='*', default=list(PROGRAMS), choices=list(PROGRAMS))
+    arg_parser.add_argument('--max-instructions', type=int, default=100_000_000)
+    arg_parser.add_argument('-o', '--output', help='write the counters of both builds to this JSON file')
+    args = arg_parser.parse_args()
+
+    results = {}
+    mismatches = []
+    with tempfile.TemporaryDirectory() as directory:
+        for program in args.programs:
+            try:
+                plain = run(build(program, os.path.join(directory, 'plain'), []), program, args.max_instructions)
+                optimized = run(build(program, os.path.join(directory, 'optimized'), shlex.split(args.options)),
+                                program, args.max_instructions)
+            except VMRuntimeError as error:
+                mismatches.append(f'{program}: {error}')
+                continue
+
+            results[program] = {'plain': plain.to_dict(), 'optimized': optimized.to_dict()}
+            print(f'{program:<10} instructions {plain.instructions:>10} -> {optimized.instructions:<10} '
+                  f'({(optimized.instructions / plain.instructions - 1) * 100:+6.1f}%)  '
+                  f'cycles {plain.cycles:>11} -> {optimized.cycles:<11} ({(optimized.cycles / plain.cycles - 1) * 100:+6.1f}%)  '
+                  f'peak stack {plain.peak_stack} -> {optimized.peak_stack}')
+            if not plain.same_behavior(optimized):
+                mismatches.append(f'{program}: the optimized build returns, draws or prints something else')
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'options': args.options, 'results': results}, outfile, indent=2)
+
+    for mismatch in mismatches:
+        print(f'MISMATCH {mismatch}')
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Generate synthetic but valid Jack classes for benchmarking the compiler.
+
+Run from the repository root, e.g.
+`python -m benchmarks.generator out/ --classes 4 --subroutines 200`.
+"""
+from __future__ import annotations
+from typing import List
+
+import argparse
+import os
+import random
+
+OPERATORS = ['+', '-', '*', '/', '&', '|', '<', '>', '=']
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel']
+
+class ClassGenerator:
+
+    def __init__(self, subroutines: int = 50, variables: int = 8, fields: int = 8,
+                 depth: int = 4, string_length: int = 40, seed: int = 0):
+        self.subroutines = subroutines
+        self.variables = max(variables, 1)
+        self.fields = max(fields, 1)
+        self.depth = depth
+        self.string_length = string_length
+        self.__random = random.Random(seed)
+
+    def generate(self, class_name: str) -> str:
+
+        lines = [f'/** Synthetic benchmark class {class_name}. */', f'class {class_name} {{']
+        lines.append(f'    field int {self.__names("f", self.fields)};')
+        lines.append(f'    static int {self.__names("s", self.fields)};')
+        lines.append('')
+        lines += self.__constructor(class_name)
+
+        for index in range(self.subroutines):
+            lines.append('')
+            lines += self.__subroutine(class_name, index)
+
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def __names(self, prefix: str, count: int) -> str:
+        return ', '.join(f'{prefix}{index}' for index in range(count))
+
+    def __constructor(self, class_name: str) -> List[str]:
+        lines = [f'    constructor {class_name} new() {{']
+        lines += [f'        let f{index} = {index};' for index in range(self.fields)]
+        lines += ['        return this;', '    }']
+        return lines
+
+    def __subroutine(self, class_name: str, index: int) -> List[str]:
+
+        kind = 'method' if index % 2 else 'function'
+        operands = ['a0', 'a1'] + [f'v{number}' for number in range(self.variables)] \
+                + [f's{number}' for number in range(self.fields)]
+        if kind == 'method':
+            operands += [f'f{number}' for number in range(self.fields)]
+
+        lines = [f'    // subroutine {index}',
+                 f'    {kind} int sub{index}(int a0, int a1) {{',
+                 f'        var int {self.__names("v", self.variables)};',
+                 '        var String text;',
+                 '        var Array buffer;']
+
+        for variable in range(self.variables):
+            lines.append(f'        let v{variable} = {self.__expression(operands, self.depth)};')
+
+        lines.append(f'        let text = "{self.__string()}";')
+        lines.append('        let buffer = Array.new(4);')
+        lines.append(f'        let buffer[v0 & 3] = {self.__expression(operands, 2)};')
+        lines.append(f'        if ({self.__expression(operands, 2)} < a1) {{')
+        lines.append(f'            let v0 = buffer[1] + {self.__expression(operands, 2)};')
+        lines.append('        } else {')
+        lines.append('            let v0 = -v0;')
+        lines.append('        }')
+        lines.append('        while (~(v1 < 0)) {')
+        lines.append('            let v1 = v1 - 1;')
+        lines.append('        }')
+        if index > 0:
+            # even numbered subroutines are functions, call the closest earlier one
+            lines.append(f'        do {class_name}.sub{(index - 1) // 2 * 2}(v0, v1);')
+        lines.append('        do Output.printString(text);')
+        lines.append('        do text.dispose();')
+        lines.append('        do buffer.dispose();')
+        lines.append('        return v0;')
+        lines.append('    }')
+        return lines
+
+    def __expression(self, operands: List[str], depth: int) -> str:
+
+        if depth <= 0:
+            return self.__term(operands)
+
+        parts = [self.__term(operands) if self.__random.random() < 0.5 else f'({self.__expression(operands, depth - 1)})']
+        for _ in range(self.__random.randint(1, 3)):
+            parts.append(self.__random.choice(OPERATORS))
+            parts.append(f'({self.__expression(operands, depth - 1)})' if self.__random.random() < 0.4 else self.__term(operands))
+        return ' '.join(parts)
+
+    def __term(self, operands: List[str]) -> str:
+        choice = self.__random.random()
+        if choice < 0.3:
+            return str(self.__random.randint(0, 32767))
+        elif choice < 0.4:
+            return f'-{self.__random.choice(operands)}'
+        elif choice < 0.45:
+            return self.__random.choice(['true', 'false', 'null'])
+        return self.__random.choice(operands)
+
+    def __string(self) -> str:
+        words = []
+        while len(' '.join(words)) < self.string_length:
+            words.append(self.__random.choice(WORDS))
+        return ' '.join(words)[:self.string_length]
+
+def generate_files(directory: str, classes: int, generator: ClassGenerator) -> List[str]:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(classes):
+        path = os.path.join(directory, f'Synth{index}.jack')
+        with open(path, 'w') as outfile:
+            outfile.write(generator.generate(f'Synth{index}'))
+        paths.append(path)
+    return paths
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('directory')
+    arg_parser.add_argument('--classes', type=int, default=1)
+    arg_parser.add_argument('--subroutines', type=int, default=50)
+    arg_parser.add_argument('--variables', type=int, default=8)
+    arg_parser.add_argument('--fields', type=int, default=8)
+    arg_parser.add_argument('--depth', type=int, default=4)
+    arg_parser.add_argument('--string-length', type=int, default=40)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    generator = ClassGenerator(args.subroutines, args.variables, args.fields, args.depth, args.string_length, args.seed)
+    for path in generate_files(args.directory, args.classes, generator):
+        print(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""Time the compiler phases and save the results as JSON.
+
+Run from the repository root with `python -m benchmarks.harness -o results.json`.
+Compare against an earlier run with `--compare old.json`; the exit status is 1
+when a phase got slower than the allowed threshold.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Dict, List
+
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.generator import ClassGenerator, generate_files
+from parser import Parser
+from scanner import Scanner
+from vm_writer import MemorySink, VM_writer, write_file_atomically
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sampleFiles')
+
+PHASES = ['scan', 'parse', 'emit']
+
+# VM_writer methods that produce VM code
+EMIT_METHODS = ['write_push', 'write_pop', 'write_arithmetic', 'write_label', 'write_goto', 'write_if',
+                'write_function', 'write_call', 'write_return', 'write_captured', 'close']
+
+SIZES = {
+    'small': dict(subroutines=20, depth=3),
+    'medium': dict(subroutines=200, depth=4),
+    'large': dict(subroutines=1000, depth=5, variables=16, fields=16, string_length=200),
+}
+
+def count_tokens(path: str) -> int:
+    scanner = Scanner(path)
+    count = 1
+    while scanner.has_more_tokens():
+        scanner.advance()
+        count += 1
+    return count
+
+@contextmanager
+def timed_emitting(totals: Dict[str, float]):
+    """Add the seconds spent in the VM_writer methods that produce VM code to
+    totals['emit']. A method called from another one is not counted twice."""
+
+    originals = {name: getattr(VM_writer, name) for name in EMIT_METHODS}
+    depth = [0]
+
+    def timed(method):
+        def wrapper(self, *args, **kwargs):
+            if depth[0]:
+                return method(self, *args, **kwargs)
+            depth[0] += 1
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                totals['emit'] += time.perf_counter() - start
+                depth[0] -= 1
+        return wrapper
+
+    for name, method in originals.items():
+        setattr(VM_writer, name, timed(method))
+    try:
+        yield
+    finally:
+        for name, method in originals.items():
+            setattr(VM_writer, name, method)
+
+def compile_phases(path: str, output_dir: str) -> Dict[str, float]:
+    """Compile one file and return the seconds spent in each phase. emit is
+    the time inside the VM_writer calls that generate VM code plus writing
+    the .vm file, parse is the rest of the compile."""
+
+    class_name = os.path.splitext(os.path.basename(path))[0]
+
+    start = time.perf_counter()
+    scanner = Scanner(path)
+    scanned = time.perf_counter()
+
+    phases = {'emit': 0.0}
+    sink = MemorySink()
+    with timed_emitting(phases):
+        Parser(scanner, class_name, path, sink).compileClass()
+    compiled = time.perf_counter()
+
+    write_file_atomically(os.path.join(output_dir, f'{class_name}.vm'), sink.getvalue())
+    written = time.perf_counter()
+
+    return {'scan': scanned - start, 'parse': compiled - scanned - phases['emit'],
+            'emit': phases['emit'] + written - compiled}
+
+def peak_memory(paths: List[str], output_dir: str) -> int:
+    tracemalloc.start()
+    try:
+        for path in paths:
+            compile_phases(path, output_dir)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def token_memory(paths: List[str], compact: bool) -> int:
+    """Bytes the scanners of all paths keep allocated for their tokens, as
+    Token objects or, with compact, in TokenBuffers."""
+
+    tracemalloc.start()
+    try:
+        # the scanners stay referenced until the memory is read
+        scanners = [Scanner(path, compact=compact) for path in paths]
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+def benchmark(paths: List[str], output_dir: str, repeat: int) -> Dict[str, object]:
+
+    best = {phase: float('inf') for phase in PHASES}
+    for _ in range(repeat):
+        totals = {phase: 0.0 for phase in PHASES}
+        for path in paths:
+            for phase, seconds in compile_phases(path, output_dir).items():
+                totals[phase] += seconds
+        best = {phase: min(best[phase], totals[phase]) for phase in PHASES}
+
+    tokens = sum(count_tokens(path) for path in paths)
+    lines = 0
+    for path in paths:
+        with open(path, 'r') as infile:
+            lines += sum(1 for _ in infile)
+
+    total = sum(best.values())
+    return {
+        'files': len(paths),
+        'tokens': tokens,
+        'lines': lines,
+        'seconds': {**best, 'total': total},
+        'tokens_per_second': tokens / total,
+        'lines_per_second': lines / total,
+        'peak_memory_bytes': peak_memory(paths, output_dir),
+        'token_memory_bytes': token_memory(paths, compact=False),
+        'compact_token_memory_bytes': token_memory(paths, compact=True),
+    }
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float, min_delta: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for phase in PHASES + ['total']:
+            old = baseline[name]['seconds'][phase]
+            new = result['seconds'][phase]
+            # tiny inputs are mostly timer noise, ignore slowdowns below min_delta seconds
+            if old > 0 and new > old * (1 + threshold) and new - old > min_delta:
+                regressions.append(f'{name}/{phase}: {old*1000:.2f} ms -> {new*1000:.2f} ms (+{(new/old - 1)*100:.0f}%)')
+    return regressions
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    arg_parser.add_argument('--compare', help='JSON results of an earlier run to check for regressions')
+    arg_parser.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown per phase (0.10 = 10%%)')
+    arg_parser.add_argument('--min-delta', type=float, default=1.0, help='ignore slowdowns smaller than this many milliseconds')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    arg_parser.add_argument('--sizes', nargs='*', default=list(SIZES), choices=list(SIZES))
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = {
+            'pong': sorted(glob.glob(os.path.join(SAMPLE_DIR, 'Pong', '*.jack'))),
+            'average': [os.path.join(SAMPLE_DIR, 'Average', 'Main.jack')],
+        }
+        for size in args.sizes:
+            generator = ClassGenerator(seed=args.seed, **SIZES[size])
+            inputs[f'synthetic-{size}'] = generate_files(os.path.join(directory, size), 1, generator)
+
+        output_dir = os.path.join(directory, 'out')
+        os.makedirs(output_dir)
+        for name, paths in inputs.items():
+            result = benchmark(paths, output_dir, args.repeat)
+            results[name] = result
+            seconds = result['seconds']
+            print(f'{name:<18} scan {seconds["scan"]*1000:9.2f} ms  parse {seconds["parse"]*1000:9.2f} ms  '
+                  f'emit {seconds["emit"]*1000:7.2f} ms  {result["tokens_per_second"]:11,.0f} tokens/s  '
+                  f'{result["lines_per_second"]:10,.0f} lines/s  peak {result["peak_memory_bytes"]/2**20:7.2f} MiB  '
+                  f'tokens {result["token_memory_bytes"]/2**20:6.2f} MiB, '
+                  f'compact {result["compact_token_memory_bytes"]/2**20:6.2f} MiB')
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as infile:
+            baseline = json.load(infile)['results']
+        regressions = compare(results, baseline, args.threshold, args.min_delta / 1000)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
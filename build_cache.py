@@ -0,0 +1,83 @@
+from __future__ import annotations
+from typing import Dict, List
+
+import glob
+import hashlib
+import json
+import os
+
+from vm_writer import write_file_atomically
+
+__version__ = '1.1.0'
+
+def compiler_version() -> str:
+    """Release version plus a fingerprint of the compiler sources, so editing the
+    compiler in a checkout invalidates outputs built by the previous code."""
+
+    digest = hashlib.sha256()
+    compiler_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in sorted(glob.glob(os.path.join(compiler_dir, '*.py'))):
+        with open(module, 'rb') as infile:
+            digest.update(infile.read())
+    return f'{__version__}+{digest.hexdigest()[:12]}'
+
+class BuildCache:
+
+    MANIFEST_NAME = '.jack_build_manifest.json'
+
+    def __init__(self, directory: str, options: Dict[str, object]):
+        self.__manifest_path = os.path.join(directory, self.MANIFEST_NAME)
+        self.__version = compiler_version()
+        self.__options = options
+        self.__digests = {}
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            with open(self.__manifest_path, 'r') as infile:
+                self.__entries = json.load(infile)['files']
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            # a missing or unreadable manifest simply means everything is rebuilt
+            self.__entries = {}
+
+    def is_fresh(self, jack_path: str) -> bool:
+
+        with open(jack_path, 'rb') as infile:
+            digest = hashlib.sha256(infile.read()).hexdigest()
+        self.__digests[jack_path] = digest
+
+        entry = self.__entries.get(os.path.basename(jack_path))
+        fresh = entry is not None \
+                and entry.get('sha256') == digest \
+                and entry.get('version') == self.__version \
+                and entry.get('options') == self.__options \
+                and all(os.path.exists(path) for path in self.__output_paths(jack_path))
+
+        if fresh: self.hits += 1
+        else: self.misses += 1
+        return fresh
+
+    def record(self, jack_path: str, pooled_strings: List[str] = ()) -> None:
+        self.__entries[os.path.basename(jack_path)] = {
+                'sha256': self.__digests[jack_path],
+                'version': self.__version,
+                'options': self.__options,
+                'pooled_strings': list(pooled_strings),
+        }
+
+    def pooled_strings(self, jack_path: str) -> List[str]:
+        """String literals a cached file needs from the program wide string pool."""
+        return self.__entries.get(os.path.basename(jack_path), {}).get('pooled_strings', [])
+
+    def save(self) -> None:
+
+        directory = os.path.dirname(self.__manifest_path)
+        entries = {name: entry for name, entry in self.__entries.items()
+                   if os.path.exists(os.path.join(directory, name))}
+
+        write_file_atomically(self.__manifest_path, json.dumps({'files': entries}, indent=1, sort_keys=True))
+
+    def __output_paths(self, jack_path: str) -> List[str]:
+        """Every file the options make the compiler write for jack_path."""
+        vm_path = f'{os.path.splitext(jack_path)[0]}.vm'
+        return [vm_path, f'{vm_path}.map'] if self.__options.get('source_map') else [vm_path]
@@ -0,0 +1,213 @@
+"""Common subexpression elimination on the VM code of one class.
+
+Every basic block (the code between labels and jumps) is run symbolically:
+each value on the stack gets a key describing how it was computed from
+constants, locals, arguments, fields, statics, array elements and the pure OS
+arithmetic Math.multiply and Math.divide. Variables carry a version that a
+`pop` to them bumps, memory (fields, statics and arrays) carries one version
+that any store bumps, and any other call bumps every version. Two values with
+the same key therefore always hold the same number, e.g. both `x + dx` in
+`(x + dx) * (x + dx)` when nothing writes x or dx in between.
+
+The first computation of a repeated expression is kept and its value is
+copied into a scratch temp, the later computations become a push of that
+temp. The scratch slots are temps 3 to 7, which nothing else uses, and a slot
+is never live across a call, so inlining can still use every temp at a call
+site. An expression is only replaced when the estimated cycles go down.
+"""
+from __future__ import annotations
+from collections import Counter
+from typing import List, Tuple
+
+from cost_model import POP_COSTS, PUSH_COSTS, command_cost, os_cycles
+from optimizer import Instruction, VMOptimizer
+
+SCRATCH_TEMPS = range(3, 8)
+
+BINARY_OPERATIONS = {'add', 'sub', 'and', 'or', 'eq', 'gt', 'lt'}
+UNARY_OPERATIONS = {'neg', 'not'}
+# OS functions that only compute a value from their arguments
+PURE_CALLS = {('Math.multiply', '2'), ('Math.divide', '2')}
+VARIABLE_SEGMENTS = {'local', 'argument'}
+MEMORY_SEGMENTS = {'this', 'static'}
+# the first computation pays a `pop temp; push temp` round trip
+CACHE_COST = POP_COSTS['temp'] + PUSH_COSTS['temp']
+
+class CommonSubexpressionEliminator(VMOptimizer):
+    """Computes a repeated expression once per function and reuses it from a temp."""
+
+    def __init__(self):
+        self.stats = Counter()
+
+    def optimize_with_positions(self, lines: List[str], positions: List) -> Tuple[List[str], List]:
+        """Optimize lines and carry along one source position per line. A
+        replaced expression passes its position to the push of its temp."""
+
+        instructions = [tuple(line.split()) for line in lines]
+        output, output_positions = [], []
+        start = 0
+        for end in range(len(instructions) + 1):
+            if end == len(instructions) or instructions[end][0] in ('label', 'function'):
+                self.__rewrite_block(instructions, positions, start, end, output, output_positions)
+                start = end
+            elif instructions[end][0] in ('goto', 'if-goto', 'return'):
+                self.__rewrite_block(instructions, positions, start, end + 1, output, output_positions)
+                start = end + 1
+        return [' '.join(instruction) for instruction in output], output_positions
+
+    def __rewrite_block(self, instructions: List[Instruction], positions: List, start: int, end: int,
+                        output: List[Instruction], output_positions: List) -> None:
+
+        cached, replaced = {}, {}
+        for slot, ranges in self.__choose(instructions, start, end):
+            first_end = ranges[0][1]
+            cached[first_end] = slot
+            for range_start, range_end in ranges[1:]:
+                replaced[range_start] = (range_end, slot)
+            self.stats['cse_expressions'] += len(ranges) - 1
+            self.stats['cse_cycles_saved'] += _savings(instructions, ranges)
+
+        index = start
+        while index < end:
+            if index in replaced:
+                range_end, slot = replaced[index]
+                output.append(('push', 'temp', str(slot)))
+                output_positions.append(positions[index])
+                index = range_end + 1
+                continue
+            output.append(instructions[index])
+            output_positions.append(positions[index])
+            if index in cached:
+                slot = str(cached[index])
+                output += [('pop', 'temp', slot), ('push', 'temp', slot)]
+                output_positions += [positions[index]] * 2
+            index += 1
+
+    @staticmethod
+    def __choose(instructions: List[Instruction], start: int, end: int) -> List[Tuple[int, List[Tuple[int, int]]]]:
+        """Pick the repeated expressions of a block that are worth a scratch
+        temp, as (slot, occurrence ranges) with the kept computation first."""
+
+        occurrences = _expression_ranges(instructions, start, end)
+        candidates = [ranges for ranges in occurrences.values() if len(ranges) > 1]
+        candidates.sort(key=lambda ranges: (-_savings(instructions, ranges), ranges[0]))
+
+        claimed, slots, chosen = [], {slot: [] for slot in SCRATCH_TEMPS}, []
+        for ranges in candidates:
+            ranges = [(first, last) for first, last in ranges
+                      if not any(first <= other_last and other_first <= last for other_first, other_last in claimed)]
+            # a replaced array read no longer sets pointer 1
+            ranges = ranges[:1] + [(first, last) for first, last in ranges[1:]
+                                   if not _pointer_needed_after(instructions, first, last, end)]
+            if len(ranges) < 2 or _savings(instructions, ranges) <= 0:
+                continue
+            live = (ranges[0][1], ranges[-1][0])
+            if any(instruction[0] == 'call' for instruction in instructions[live[0] + 1:live[1]]):
+                continue
+            slot = next((slot for slot, intervals in slots.items()
+                         if not any(live[0] <= other[1] and other[0] <= live[1] for other in intervals)), None)
+            if slot is None:
+                continue
+            slots[slot].append(live)
+            claimed += ranges
+            chosen.append((slot, ranges))
+        return chosen
+
+def _expression_ranges(instructions: List[Instruction], start: int, end: int) -> dict:
+    """Map the key of every pure computed value of a block to the instruction
+    ranges (first, last) that compute it, in order."""
+
+    stack = []
+    versions = Counter()
+    memory = epoch = 0
+    pointer = None
+    occurrences = {}
+
+    def pop():
+        return stack.pop() if stack else (None, -1)
+
+    for index in range(start, end):
+        instruction = instructions[index]
+        command = instruction[0]
+        key, first = None, index
+
+        if command == 'push':
+            segment, value = instruction[1], instruction[2]
+            if segment == 'constant':
+                key = ('constant', value, epoch)
+            elif segment in VARIABLE_SEGMENTS:
+                key = (segment, value, versions[segment, value], epoch)
+            elif segment in MEMORY_SEGMENTS:
+                key = (segment, value, memory, epoch)
+            elif segment == 'that' and pointer is not None and pointer[1] == index - 1:
+                # an array read `base + index; pop pointer 1; push that c`
+                (pointer_key, first), pointer = pointer[0], None
+                key = ('that', pointer_key, value, memory) if pointer_key is not None and first >= 0 else None
+                if key is not None:
+                    occurrences.setdefault(key, []).append((first, index))
+            stack.append((key, first))
+            continue
+
+        if command == 'pop':
+            segment, value = instruction[1], instruction[2]
+            popped = pop()
+            if segment in VARIABLE_SEGMENTS:
+                versions[segment, value] += 1
+            elif segment in MEMORY_SEGMENTS or segment == 'that':
+                memory += 1
+            elif segment == 'pointer' and value == '1':
+                pointer = (popped, index)
+                continue
+            elif segment == 'pointer':
+                epoch += 1
+            continue
+
+        if command in BINARY_OPERATIONS or (command == 'call' and instruction[1:] in PURE_CALLS):
+            (right, _), (left, first) = pop(), pop()
+            if left is not None and right is not None and first >= 0:
+                key = (instruction, left, right)
+        elif command in UNARY_OPERATIONS:
+            operand, first = pop()
+            if operand is not None and first >= 0:
+                key = (command, operand)
+        elif command == 'call':
+            for _ in range(int(instruction[2])):
+                pop()
+            epoch += 1
+            pointer = None
+            stack.append((None, index))
+            continue
+        else:
+            # labels and jumps only end the block
+            continue
+
+        if key is not None:
+            occurrences.setdefault(key, []).append((first, index))
+        stack.append((key, first))
+    return occurrences
+
+def _pointer_needed_after(instructions: List[Instruction], first: int, last: int, end: int) -> bool:
+    """True when a range sets pointer 1 and code after it reads or writes
+    `that` before setting pointer 1 again."""
+
+    if ('pop', 'pointer', '1') not in instructions[first:last + 1]:
+        return False
+    for instruction in instructions[last + 1:end]:
+        if instruction == ('pop', 'pointer', '1'):
+            return False
+        if instruction[1:2] == ('that',):
+            return True
+    return False
+
+def _savings(instructions: List[Instruction], ranges: List[Tuple[int, int]]) -> int:
+    """Estimated cycles saved by computing the first range once and pushing a
+    temp instead of every later range."""
+
+    first, last = ranges[0]
+    cost = sum(command_cost(instruction) + (os_cycles(instruction[1]) if instruction[0] == 'call' else 0)
+               for instruction in instructions[first:last + 1])
+    return (len(ranges) - 1) * (cost - PUSH_COSTS['temp']) - CACHE_COST
+
+def report(stats: Counter) -> str:
+    return (f'Common subexpressions: replaced {stats["cse_expressions"]} repeated expressions with a temp, '
+            f'saving about {stats["cse_cycles_saved"]} cycles per execution')
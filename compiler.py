@@ -0,0 +1,130 @@
+"""In memory compiler API.
+
+    from compiler import compile_source
+
+    result = compile_source('class Main { function void main() { return; } }')
+    if result.ok:
+        print(result.vm)
+    for diagnostic in result.diagnostics:
+        print(diagnostic)
+
+compile_source never reads or writes files and keeps no state between calls:
+every call builds its own scanner, symbol table, parser and optimizer, so
+calls from several threads or asyncio tasks can run at the same time.
+"""
+from __future__ import annotations
+from collections import Counter
+from typing import List, Union
+
+from exceptions import OutOfTokens, UnterminatedStringException, KeywordExpectedException, SymbolExpectedException, \
+        IdentifierExpectedException, SpecificKeywordExpectedException, SpecificSymbolExpectedException, \
+        UndefinedVariableException
+from jack_token import TokenType
+from optimizer import create_optimizer
+from parser import Parser
+from scanner import Scanner
+from source_map import SourceMap
+from vm_writer import MemorySink
+
+COMPILE_ERRORS = (KeywordExpectedException, SymbolExpectedException, IdentifierExpectedException,
+                  SpecificKeywordExpectedException, SpecificSymbolExpectedException, UndefinedVariableException)
+
+class Diagnostic:
+
+    def __init__(self, severity: str, message: str, filename: str, line: Union[int, None] = None,
+                 column: Union[int, None] = None):
+        self.severity = severity
+        self.message = message
+        self.filename = filename
+        self.line = line
+        self.column = column
+
+    def __str__(self) -> str:
+        location = self.filename if self.line is None else f'{self.filename}:{self.line}:{self.column}'
+        return f'{location}: {self.severity}: {self.message}'
+
+    def __repr__(self) -> str:
+        return f'Diagnostic({self.severity!r}, {self.message!r}, line={self.line}, column={self.column})'
+
+class CompileResult:
+
+    def __init__(self, class_name: Union[str, None], vm: str, diagnostics: List[Diagnostic],
+                 stats: Counter, pooled_strings: List[str], source_map: Union[SourceMap, None]):
+        self.class_name = class_name
+        self.vm = vm
+        self.diagnostics = diagnostics
+        self.stats = stats
+        self.pooled_strings = pooled_strings
+        self.source_map = source_map
+
+    @property
+    def ok(self) -> bool:
+        return not any(diagnostic.severity == 'error' for diagnostic in self.diagnostics)
+
+def compile_source(source: Union[str, bytes], class_name: Union[str, None] = None,
+                   options: Union[dict, None] = None, filename: Union[str, None] = None) -> CompileResult:
+    """Compile the text of one Jack class to VM code.
+
+    options takes the same keys as the command line (peephole, fold_constants,
+    strength_reduce, pool_strings, branch_conditions, array_access, cse,
+    hoist_invariants, source_map). class_name defaults to the declared class name, filename is
+    only used in diagnostics and source maps.
+    With pool_strings='program' the caller writes the string pool from
+    pooled_strings.
+    """
+    options = options or {}
+    diagnostics = []
+
+    if isinstance(source, bytes):
+        try:
+            source = source.decode('utf-8')
+        except UnicodeDecodeError as error:
+            return _failed(class_name, Diagnostic('error', f'Source is not valid UTF-8: {error}', filename or '<source>'))
+
+    try:
+        scanner = Scanner(None, positions=True, source=source)
+    except UnterminatedStringException as error:
+        return _failed(class_name, Diagnostic('error', str(error), filename or '<source>'))
+    if scanner.token_count() == 0:
+        return _failed(class_name, Diagnostic('error', 'No class declaration found', filename or '<source>'))
+
+    declared_name = _declared_class_name(scanner)
+    if class_name is None:
+        class_name = declared_name or 'Main'
+    elif declared_name is not None and declared_name != class_name:
+        diagnostics.append(Diagnostic('warning', f'Class {declared_name} is compiled as {class_name}',
+                                      filename or f'{class_name}.jack', *scanner.current_position()))
+    filename = filename or f'{class_name}.jack'
+
+    sink = MemorySink()
+    optimizer = create_optimizer(options)
+    parser = Parser(scanner, class_name, filename, sink=sink, optimizer=optimizer, options=options)
+    try:
+        parser.compileClass()
+    except OutOfTokens:
+        diagnostics.append(Diagnostic('error', 'Unexpected end of input', filename, *scanner.current_position()))
+        return _failed(class_name, *diagnostics)
+    except Exception as error:
+        # the parser stops at the token it could not compile
+        message = str(error) if isinstance(error, COMPILE_ERRORS) else f'{type(error).__name__}: {error}'
+        diagnostics.append(Diagnostic('error', message, filename, *scanner.current_position()))
+        return _failed(class_name, *diagnostics)
+
+    if scanner.has_more_tokens():
+        scanner.advance()
+        diagnostics.append(Diagnostic('warning', f'Ignored input after the end of class {class_name}',
+                                      filename, *scanner.current_position()))
+
+    stats = parser.stats + optimizer.stats if optimizer is not None else parser.stats
+    return CompileResult(class_name, sink.getvalue(), diagnostics, stats, sorted(parser.pooled_strings), parser.source_map)
+
+def _declared_class_name(scanner: Scanner) -> Union[str, None]:
+    try:
+        if scanner.current_token().value == 'class' and scanner.next_token().token_type is TokenType.IDENTIFIER:
+            return scanner.next_token().value
+    except (IndexError, OutOfTokens):
+        pass
+    return None
+
+def _failed(class_name: Union[str, None], *diagnostics: Diagnostic) -> CompileResult:
+    return CompileResult(class_name, '', list(diagnostics), Counter(), [], None)
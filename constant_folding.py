@@ -0,0 +1,47 @@
+from __future__ import annotations
+from typing import Union
+
+# Jack integers are 16 bit two's complement words
+WORD_MASK = 0xFFFF
+MAX_CONSTANT = 32767
+
+TRUE = -1
+FALSE = 0
+
+def to_word(value: int) -> int:
+    """Wrap an integer to a signed 16 bit value."""
+    value &= WORD_MASK
+    return value - 0x10000 if value & 0x8000 else value
+
+def fold_unary(operator: str, value: int) -> int:
+    if operator == '-':
+        return to_word(-value)
+    return to_word(~value)
+
+def fold_binary(operator: str, left: int, right: int) -> Union[int, None]:
+    """Evaluate `left operator right` like the VM and OS would. Returns None
+    when the result is only known at runtime (division by zero raises a
+    Sys.error there)."""
+
+    if operator == '+':
+        return to_word(left + right)
+    elif operator == '-':
+        return to_word(left - right)
+    elif operator == '*':
+        return to_word(left * right)
+    elif operator == '/':
+        if right == 0:
+            return None
+        # Math.divide truncates towards zero
+        quotient = abs(left) // abs(right)
+        return to_word(quotient if (left < 0) == (right < 0) else -quotient)
+    elif operator == '&':
+        return to_word(left & right)
+    elif operator == '|':
+        return to_word(left | right)
+    elif operator == '<':
+        return TRUE if left < right else FALSE
+    elif operator == '>':
+        return TRUE if left > right else FALSE
+    elif operator == '=':
+        return TRUE if left == right else FALSE
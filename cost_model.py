@@ -0,0 +1,193 @@
+"""Static Hack cost estimates for VM code.
+
+Costs are Hack instructions per VM command for a straightforward VM translator
+like the one built in the course. The Hack CPU executes one instruction per
+cycle, so the same table gives the ROM size of a command and the cycles it
+takes when it runs once.
+
+estimate_function_costs() walks the VM code of a class and estimates, for every
+function, its ROM size and the cycles of one invocation. Calls cost their
+frame setup; calls into the OS also add an estimate of the OS routine, calls
+to compiled functions do not since those have their own row. Code inside a
+loop (a backward goto, which is what compileWhile emits) is weighted by
+LOOP_ITERATIONS per nesting level.
+"""
+from __future__ import annotations
+from typing import Dict, List, Tuple
+
+import json
+
+from optimizer import Instruction
+from vm_writer import write_file_atomically
+
+PUSH_COSTS = {
+    'constant': 7,
+    'temp': 7, 'static': 7, 'pointer': 7,
+    'local': 10, 'argument': 10, 'this': 10, 'that': 10,
+}
+
+POP_COSTS = {
+    'temp': 5, 'static': 5, 'pointer': 5,
+    'local': 12, 'argument': 12, 'this': 12, 'that': 12,
+}
+
+ARITHMETIC_COSTS = {
+    'add': 5, 'sub': 5, 'and': 5, 'or': 5,
+    'neg': 3, 'not': 3,
+    'eq': 14, 'gt': 14, 'lt': 14,
+}
+
+LABEL_COST = 0
+GOTO_COST = 2
+IF_GOTO_COST = 5
+# push the return address and the caller's frame, reposition ARG and LCL, jump
+CALL_COST = 45
+# restore the caller's frame, copy the return value, jump back
+RETURN_COST = 40
+# zeroing one local in the function prologue
+LOCAL_INIT_COST = 5
+
+# rough cycles of one call into the OS routines, including their return
+OS_CYCLES = {
+    'Math.multiply': 16 * 30,
+    'Math.divide': 2500,
+    'Math.sqrt': 4000,
+    'Math.abs': 60,
+    'Math.min': 60,
+    'Math.max': 60,
+    'Memory.alloc': 200,
+    'Memory.deAlloc': 60,
+    'Memory.peek': 50,
+    'Memory.poke': 50,
+    'Array.new': 250,
+    'Array.dispose': 100,
+    'String.new': 300,
+    'String.appendChar': 70,
+    'String.charAt': 60,
+    'String.length': 50,
+    'String.dispose': 100,
+    'Output.printChar': 700,
+    'Output.printString': 7000,
+    'Output.printInt': 3000,
+    'Output.println': 200,
+    'Output.moveCursor': 100,
+    'Screen.drawPixel': 400,
+    'Screen.drawLine': 8000,
+    'Screen.drawRectangle': 20000,
+    'Screen.drawCircle': 40000,
+    'Screen.setColor': 50,
+    'Screen.clearScreen': 60000,
+    'Keyboard.keyPressed': 50,
+}
+OS_CLASSES = {'Math', 'Memory', 'Array', 'String', 'Output', 'Screen', 'Keyboard', 'Sys'}
+DEFAULT_OS_CYCLES = 200
+
+# assumed iterations of every loop
+LOOP_ITERATIONS = 10
+
+def command_cost(instruction: Instruction) -> int:
+    """Hack instructions of one VM command."""
+
+    command = instruction[0]
+    if command == 'push':
+        return PUSH_COSTS[instruction[1]]
+    elif command == 'pop':
+        return POP_COSTS[instruction[1]]
+    elif command == 'label':
+        return LABEL_COST
+    elif command == 'goto':
+        return GOTO_COST
+    elif command == 'if-goto':
+        return IF_GOTO_COST
+    elif command == 'call':
+        return CALL_COST
+    elif command == 'return':
+        return RETURN_COST
+    elif command == 'function':
+        return LOCAL_INIT_COST * int(instruction[2])
+    return ARITHMETIC_COSTS[command]
+
+def os_cycles(function_name: str) -> int:
+    """Estimated cycles spent inside a called function, 0 for compiled ones."""
+    if function_name.split('.')[0] not in OS_CLASSES:
+        return 0
+    return OS_CYCLES.get(function_name, DEFAULT_OS_CYCLES)
+
+def find_loops(function: List[Instruction]) -> Dict[str, Tuple[int, int]]:
+    """Map every loop head label to the (start, end) indices of its loop. A
+    loop runs from a label to the last backward goto or if-goto to it."""
+
+    label_indices = {}
+    loops = {}
+    for index, instruction in enumerate(function):
+        if instruction[0] == 'label':
+            label_indices[instruction[1]] = index
+        elif instruction[0] in ('goto', 'if-goto') and instruction[1] in label_indices:
+            loops[instruction[1]] = (label_indices[instruction[1]], index)
+    return loops
+
+def loop_depths(function: List[Instruction], loops: Dict[str, Tuple[int, int]]) -> List[int]:
+    """Number of loops around every instruction."""
+
+    depth_changes = [0] * (len(function) + 1)
+    for start, end in loops.values():
+        depth_changes[start] += 1
+        depth_changes[end + 1] -= 1
+
+    depths, depth = [], 0
+    for change in depth_changes[:-1]:
+        depth += change
+        depths.append(depth)
+    return depths
+
+def split_functions(lines: List[str]) -> Dict[str, List[str]]:
+    """Map every function name to its lines, in file order. Lines before the
+    first function are kept under the empty name."""
+    functions = {'': []}
+    name = ''
+    for line in lines:
+        if line.startswith('function '):
+            name = line.split()[1]
+            functions[name] = []
+        functions[name].append(line)
+    return functions
+
+def estimate_function_costs(lines: List[str]) -> List[Dict[str, object]]:
+
+    costs = []
+    for name, function_lines in split_functions(lines).items():
+        if not name:
+            continue
+        function = [tuple(line.split()) for line in function_lines if line.strip()]
+        loops = find_loops(function)
+        depths = loop_depths(function, loops)
+        size = cycles = calls = os_calls = 0
+        for instruction, depth in zip(function, depths):
+            cost = command_cost(instruction)
+            size += cost
+            if instruction[0] == 'call':
+                calls += 1
+                callee_cycles = os_cycles(instruction[1])
+                os_calls += callee_cycles > 0
+                cost += callee_cycles
+            cycles += cost * LOOP_ITERATIONS ** depth
+
+        costs.append({'function': function[0][1], 'vm_instructions': len(function), 'hack_instructions': size,
+                      'cycles': cycles, 'loops': len(loops), 'calls': calls, 'os_calls': os_calls})
+    return costs
+
+def format_table(costs: List[Dict[str, object]]) -> str:
+    rows = sorted(costs, key=lambda cost: (-cost['cycles'], cost['function']))
+    width = max([len('Function')] + [len(cost['function']) for cost in rows])
+    lines = [f'{"Function":<{width}}  {"VM":>6}  {"Hack":>7}  {"Cycles":>10}  {"Loops":>5}  {"Calls":>5}']
+    for cost in rows:
+        lines.append(f'{cost["function"]:<{width}}  {cost["vm_instructions"]:>6}  {cost["hack_instructions"]:>7}  '
+                     f'{cost["cycles"]:>10}  {cost["loops"]:>5}  {cost["calls"]:>5}')
+    total_size = sum(cost['hack_instructions'] for cost in rows)
+    lines.append(f'{"Total ROM":<{width}}  {sum(cost["vm_instructions"] for cost in rows):>6}  {total_size:>7}')
+    return '\n'.join(lines)
+
+def write_cost_json(path: str, costs: List[Dict[str, object]]) -> None:
+    rows = sorted(costs, key=lambda cost: (-cost['cycles'], cost['function']))
+    model = {'loop_iterations': LOOP_ITERATIONS, 'call_cost': CALL_COST, 'return_cost': RETURN_COST}
+    write_file_atomically(path, json.dumps({'model': model, 'functions': rows}, indent=1))
@@ -0,0 +1,248 @@
+"""Long running compile server.
+
+The daemon keeps the compiler loaded, polls the watched directories for changed
+.jack files and answers compile requests on a Unix socket. Requests and
+responses are single lines of JSON:
+
+    {"paths": ["Game/Ball.jack", "Game/Bat.jack"]}  -> {"ok": true, "results": [...]}
+    {"command": "ping"} / {"command": "status"} / {"command": "shutdown"}
+
+All compiling happens on one worker thread. Requests that arrive while a
+batch is compiling are merged into the next batch, so a file requested by
+several clients is compiled once. Every request gets an answer: paths that
+are not .jack files, a batch the worker fails on and requests still queued
+at shutdown are reported as errors.
+
+Send requests from the command line with `python daemon.py path/to/File.jack`.
+"""
+from __future__ import annotations
+from typing import Callable, Dict, List, Tuple
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+DEFAULT_SOCKET = '/tmp/jack-compiler.sock'
+
+class CompileRequest:
+
+    def __init__(self, paths: List[str]):
+        self.paths = paths
+        self.results = []
+        self.done = threading.Event()
+
+class CompileDaemon:
+
+    def __init__(self, directories: List[str], compile_file: Callable[[str], Tuple],
+                 socket_path: str = DEFAULT_SOCKET, poll_interval: float = 0.02):
+        self.__directories = [os.path.abspath(directory) for directory in directories]
+        self.__compile_file = compile_file
+        self.__socket_path = socket_path
+        self.__poll_interval = poll_interval
+        self.__requests = queue.Queue()
+        self.__modification_times = {}
+        self.__stopping = threading.Event()
+        # held while queueing a request and while stopping, so no request is queued after the last drain
+        self.__queue_lock = threading.Lock()
+        self.__server = None
+        self.compiled = 0
+        self.batches = 0
+
+    ## WATCHING ##
+
+    def __scan(self) -> Dict[str, Tuple[int, int]]:
+        sources = {}
+        for directory in self.__directories:
+            try:
+                entries = os.scandir(directory)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name.endswith('.jack') and entry.is_file():
+                        status = entry.stat()
+                        sources[entry.path] = (status.st_mtime_ns, status.st_size)
+        return sources
+
+    def __changed_sources(self) -> List[str]:
+        sources = self.__scan()
+        changed = [path for path, signature in sources.items() if self.__modification_times.get(path) != signature]
+        self.__modification_times = sources
+        return sorted(changed)
+
+    def __out_of_date_sources(self) -> List[str]:
+        """Sources without a .vm file or with a .vm older than the source."""
+        self.__modification_times = self.__scan()
+        out_of_date = []
+        for path, (modification_time, _) in self.__modification_times.items():
+            vm_path = f'{os.path.splitext(path)[0]}.vm'
+            if not os.path.exists(vm_path) or os.stat(vm_path).st_mtime_ns < modification_time:
+                out_of_date.append(path)
+        return sorted(out_of_date)
+
+    ## COMPILING ##
+
+    def __compile(self, paths: List[str]) -> Dict[str, dict]:
+        results = {}
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                if not path.endswith('.jack'):
+                    raise ValueError('not a .jack file')
+                self.__compile_file(path)
+                results[path] = {'path': path, 'ok': True}
+            except Exception as error:
+                results[path] = {'path': path, 'ok': False, 'error': f'{type(error).__name__}: {error}'}
+            results[path]['ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self.compiled += 1
+        return results
+
+    def __log(self, results: Dict[str, dict]) -> None:
+        for result in results.values():
+            status = 'compiled' if result['ok'] else f'failed ({result["error"]})'
+            print(f'{result["path"]}: {status} in {result["ms"]} ms', file=sys.stderr, flush=True)
+
+    @staticmethod
+    def __fail(request: CompileRequest, error: str) -> None:
+        request.results = [{'path': path, 'ok': False, 'error': error} for path in request.paths]
+        request.done.set()
+
+    def __worker(self) -> None:
+
+        try:
+            self.__log(self.__compile(self.__out_of_date_sources()))
+        except Exception as error:
+            print(f'Initial build failed: {type(error).__name__}: {error}', file=sys.stderr, flush=True)
+
+        logged_failure = None
+        while not self.__stopping.is_set():
+            batch = []
+            failure = 'The compile daemon stopped before compiling the request'
+            try:
+                try:
+                    batch.append(self.__requests.get(timeout=self.__poll_interval))
+                    while True:
+                        batch.append(self.__requests.get_nowait())
+                except queue.Empty:
+                    pass
+
+                changed = self.__changed_sources()
+                requested = [path for request in batch for path in request.paths]
+                if not changed and not requested:
+                    continue
+
+                self.batches += 1
+                # a path that is both requested and changed on disk is compiled once
+                results = self.__compile(sorted(set(changed) | set(requested)))
+                self.__log({path: results[path] for path in changed})
+
+                for request in batch:
+                    request.results = [results[path] for path in request.paths]
+                    request.done.set()
+            except Exception as error:
+                failure = f'{type(error).__name__}: {error}'
+                # a lasting problem, like a removed directory, is logged once and not on every poll
+                if failure != logged_failure:
+                    print(f'Batch failed: {failure}', file=sys.stderr, flush=True)
+                    logged_failure = failure
+            finally:
+                # a client never waits for a request the worker gave up on
+                for request in batch:
+                    if not request.done.is_set():
+                        self.__fail(request, failure)
+
+    ## SOCKET API ##
+
+    def submit(self, paths: List[str]) -> List[dict]:
+        """Queue paths for the worker thread and wait for their results."""
+        request = CompileRequest([os.path.abspath(path) for path in paths])
+        with self.__queue_lock:
+            if self.__stopping.is_set():
+                self.__fail(request, 'The compile daemon is shutting down')
+            else:
+                self.__requests.put(request)
+        request.done.wait()
+        return request.results
+
+    def handle_message(self, message: dict) -> dict:
+        command = message.get('command', 'compile')
+
+        if command == 'ping':
+            return {'ok': True}
+        elif command == 'status':
+            return {'ok': True, 'directories': self.__directories, 'compiled': self.compiled, 'batches': self.batches}
+        elif command == 'shutdown':
+            threading.Thread(target=self.shutdown).start()
+            return {'ok': True}
+        elif command == 'compile':
+            results = self.submit(message.get('paths', []))
+            return {'ok': all(result['ok'] for result in results), 'results': results}
+        return {'ok': False, 'error': f'Unknown command {command}'}
+
+    def serve_forever(self) -> None:
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = daemon.handle_message(json.loads(line))
+                    except ValueError as error:
+                        response = {'ok': False, 'error': f'Invalid request: {error}'}
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(self.__socket_path):
+            os.unlink(self.__socket_path)
+
+        worker = threading.Thread(target=self.__worker, daemon=True)
+        worker.start()
+
+        with Server(self.__socket_path, Handler) as self.__server:
+            print(f'Watching {", ".join(self.__directories)}, listening on {self.__socket_path}', file=sys.stderr, flush=True)
+            try:
+                self.__server.serve_forever()
+            finally:
+                with self.__queue_lock:
+                    self.__stopping.set()
+                worker.join()
+                # requests still queued when the worker stopped are answered with an error
+                while not self.__requests.empty():
+                    self.__fail(self.__requests.get_nowait(), 'The compile daemon shut down before compiling the request')
+                os.unlink(self.__socket_path)
+
+    def shutdown(self) -> None:
+        if self.__server is not None:
+            self.__server.shutdown()
+
+def send(message: dict, socket_path: str = DEFAULT_SOCKET) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(message).encode() + b'\n')
+        response = b''
+        while not response.endswith(b'\n'):
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    return json.loads(response)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('paths', nargs='*', help='.jack files to compile')
+    arg_parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    arg_parser.add_argument('--command', choices=['compile', 'ping', 'status', 'shutdown'], default='compile')
+    args = arg_parser.parse_args()
+
+    response = send({'command': args.command, 'paths': args.paths}, args.socket)
+    print(json.dumps(response, indent=2))
+    sys.exit(0 if response.get('ok') else 1)
@@ -0,0 +1,85 @@
+"""Whole program dead subroutine elimination.
+
+After a directory is compiled, the `call` instructions of all its .vm files
+form the program's call graph. Every function that cannot be reached from the
+roots (Sys.init when the program has its own OS, Main.main and any extra roots
+given on the command line) is removed from its .vm file, and source maps
+written next to the files are updated to the new line numbers.
+
+Jack has no function pointers, so a function that no reachable function calls
+can never run.
+"""
+from __future__ import annotations
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Union
+
+from cost_model import command_cost, split_functions
+from source_map import remap_source_map
+from vm_writer import write_file_atomically
+
+# a program with its own Sys.jack boots from Sys.init, like the --asm bootstrap,
+# roots the program does not define are ignored
+DEFAULT_ROOTS = ['Sys.init', 'Main.main']
+
+def call_graph(functions: Dict[str, List[str]]) -> Dict[str, Set[str]]:
+    return {name: {line.split()[1] for line in lines if line.startswith('call ')}
+            for name, lines in functions.items()}
+
+def reachable_functions(graph: Dict[str, Set[str]], roots: Iterable[str]) -> Set[str]:
+    reached = set()
+    pending = [root for root in roots if root in graph]
+    while pending:
+        name = pending.pop()
+        if name in reached:
+            continue
+        reached.add(name)
+        # calls into the OS or other programs are not part of the graph
+        pending.extend(callee for callee in graph[name] if callee in graph and callee not in reached)
+    return reached
+
+def eliminate_dead_functions(vm_paths: List[str], roots: Iterable[str], stats: Counter) -> Union[List[str], None]:
+    """Remove the functions unreachable from roots from the .vm files of one
+    program and return their names. Returns None without removing anything
+    when none of the roots is defined in the program."""
+
+    files = {}
+    for vm_path in vm_paths:
+        with open(vm_path, 'r') as infile:
+            files[vm_path] = split_functions(infile.read().splitlines())
+
+    graph = {}
+    for functions in files.values():
+        graph.update(call_graph({name: lines for name, lines in functions.items() if name}))
+
+    live = reachable_functions(graph, roots)
+    if not live:
+        return None
+
+    dead = []
+    for vm_path, functions in files.items():
+        dead_in_file = [name for name in functions if name and name not in live]
+        stats['live_functions'] += len(functions) - 1 - len(dead_in_file)
+        if not dead_in_file:
+            continue
+
+        kept_lines, kept_line_numbers, vm_line = [], [], 0
+        for name, lines in functions.items():
+            if name in dead_in_file:
+                stats['dead_vm_instructions'] += len(lines)
+                stats['dead_hack_instructions'] += sum(command_cost(tuple(line.split())) for line in lines)
+            else:
+                kept_lines += lines
+                kept_line_numbers += range(vm_line + 1, vm_line + len(lines) + 1)
+            vm_line += len(lines)
+
+        write_file_atomically(vm_path, ''.join(f'{line}\n' for line in kept_lines))
+        remap_source_map(f'{vm_path}.map', kept_lines, kept_line_numbers)
+        stats['dead_functions'] += len(dead_in_file)
+        dead += dead_in_file
+
+    return sorted(dead)
+
+def report(stats: Counter) -> str:
+    total_functions = stats['live_functions'] + stats['dead_functions']
+    return f'Dead code: removed {stats["dead_functions"]} of {total_functions} functions, ' \
+           f'{stats["dead_vm_instructions"]} VM instructions (about {stats["dead_hack_instructions"]} Hack instructions of ROM)'
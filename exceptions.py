@@ -15,3 +15,12 @@ class SpecificSymbolExpectedException(Exception):
 
 class IdentifierExpectedException(Exception):
     pass
+
+class UnterminatedStringException(Exception):
+    pass
+
+class UndefinedVariableException(Exception):
+    pass
+
+class VMRuntimeError(Exception):
+    pass
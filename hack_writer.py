@@ -0,0 +1,311 @@
+"""Hack assembly backend.
+
+Translates the VM code of a program straight to one `.asm` file, so the VM
+code does not have to be written to disk and read back by a separate VM
+translator. AsmSink takes the place of the .vm file behind VM_writer and
+translates its class on close, AsmProgram links the classes:
+
+    bootstrap      SP = 256, call Sys.init (or Main.main without the OS), halt
+    shared code    $CALL, $RETURN and the $EQ/$GT/$LT comparisons
+    classes        one block per class, in class name order
+
+Calls, returns and comparisons jump to the shared routines instead of being
+expanded at every site, which keeps the ROM small. Since the translator sees
+whole instruction sequences, a few common ones are fused: a push followed by
+add/sub/and/or, a push followed by a pop into temp/static/pointer, and a
+comparison (optionally negated) followed by if-goto, which jumps on the
+difference instead of building a boolean first.
+
+x - y overflows in 16 bits when x and y have different signs and differ by
+more than 32767, e.g. 32767 - (-1), so gt and lt test the signs first: when
+they differ the sign of x decides, only operands of the same sign are
+subtracted.
+
+Statics are named `Class.i`, labels `function$label` and return addresses
+`function$ret.n` as in the course's VM translator, so OS .vm files from the
+course can be linked in.
+"""
+from __future__ import annotations
+from typing import Iterable, List, Set, Union
+
+from vm_writer import OutputSink, write_file_atomically
+
+SEGMENT_POINTERS = {'local': 'LCL', 'argument': 'ARG', 'this': 'THIS', 'that': 'THAT'}
+BINARY_OPERATIONS = {'add': 'M=D+M', 'sub': 'M=M-D', 'and': 'M=D&M', 'or': 'M=D|M'}
+UNARY_OPERATIONS = {'neg': 'M=-M', 'not': 'M=!M'}
+COMPARISONS = {'eq': 'JEQ', 'gt': 'JGT', 'lt': 'JLT'}
+NEGATED_JUMPS = {'JEQ': 'JNE', 'JGT': 'JLE', 'JLT': 'JGE'}
+# local i up to this index is addressed by incrementing A instead of adding i
+MAX_INCREMENTED_INDEX = 3
+
+PUSH_D = ['@SP', 'AM=M+1', 'A=A-1', 'M=D']
+POP_D = ['@SP', 'AM=M-1', 'D=M']
+
+def _push_frame_pointer(pointer: str) -> List[str]:
+    return [f'@{pointer}', 'D=M', '@SP', 'AM=M+1', 'M=D']
+
+# D holds the return address, R14 the number of arguments and R15 the callee
+CALL_ROUTINE = ['($CALL)', '@SP', 'A=M', 'M=D'] \
+        + _push_frame_pointer('LCL') + _push_frame_pointer('ARG') \
+        + _push_frame_pointer('THIS') + _push_frame_pointer('THAT') \
+        + ['@SP', 'MD=M+1', '@LCL', 'M=D', '@R14', 'D=D-M', '@5', 'D=D-A', '@ARG', 'M=D', '@R15', 'A=M', '0;JMP']
+
+def _restore_frame_pointer(pointer: str) -> List[str]:
+    return ['@LCL', 'AM=M-1', 'D=M', f'@{pointer}', 'M=D']
+
+# the return address is read first, with no arguments *ARG is the slot that holds it
+RETURN_ROUTINE = ['($RETURN)', '@5', 'D=A', '@LCL', 'A=M-D', 'D=M', '@R14', 'M=D'] \
+        + POP_D + ['@ARG', 'A=M', 'M=D', '@ARG', 'D=M+1', '@SP', 'M=D'] \
+        + _restore_frame_pointer('THAT') + _restore_frame_pointer('THIS') + _restore_frame_pointer('ARG') \
+        + ['@LCL', 'A=M-1', 'D=M', '@LCL', 'M=D', '@R14', 'A=M', '0;JMP']
+
+LOAD_TOP = ['@SP', 'A=M-1', 'D=M']
+
+def _signed_difference(label: str, load_x: List[str], reload_x: List[str], only_x_negative: str,
+                       only_y_negative: str) -> List[str]:
+    """Compare x with y in D. Jumps to only_x_negative or only_y_negative
+    when the signs differ, otherwise leaves x - y in D, which cannot overflow."""
+    return ['@R14', 'M=D'] + load_x + [f'@{label}.x_negative', 'D;JLT', '@R14', 'D=M', f'@{only_y_negative}', 'D;JLT',
+                                       f'@{label}.same', '0;JMP', f'({label}.x_negative)', '@R14', 'D=M',
+                                       f'@{only_x_negative}', 'D;JGE', f'({label}.same)'] + reload_x + ['@R14', 'D=D-M']
+
+def _comparison_routine(command: str, jump: str) -> List[str]:
+    name = f'${command.upper()}'
+    if command == 'eq':
+        # x - y is 0 exactly when x == y, overflow or not
+        difference = LOAD_TOP[:-1] + ['D=M-D']
+    else:
+        difference = _signed_difference(name, LOAD_TOP, LOAD_TOP, '$TRUE' if command == 'lt' else '$FALSE',
+                                        '$FALSE' if command == 'lt' else '$TRUE')
+    return [f'({name})'] + difference + ['@$TRUE', f'D;{jump}', '@$FALSE', '0;JMP']
+
+# D holds y, R13 the return address, x is still the top of the stack
+COMPARISON_ROUTINES = [line for command, jump in COMPARISONS.items() for line in _comparison_routine(command, jump)] \
+        + ['($TRUE)', '@SP', 'A=M-1', 'M=-1', '@R13', 'A=M', '0;JMP',
+           '($FALSE)', '@SP', 'A=M-1', 'M=0', '@R13', 'A=M', '0;JMP']
+
+class HackClass:
+    """Hack assembly of one class with the functions it defines and calls."""
+
+    def __init__(self, class_name: str, lines: List[str], functions: List[str], calls: Set[str]):
+        self.class_name = class_name
+        self.lines = lines
+        self.functions = functions
+        self.calls = calls
+
+class HackTranslator:
+
+    def __init__(self, class_name: str):
+        self.__class_name = class_name
+        self.__function = class_name
+        self.__return_labels = 0
+        self.__comparison_labels = 0
+        self.__output = []
+        self.__functions = []
+        self.__calls = set()
+
+    def translate(self, lines: Iterable[str]) -> HackClass:
+
+        instructions = [line.split() for line in lines]
+        instructions = [instruction for instruction in instructions if instruction and not instruction[0].startswith('//')]
+        index = 0
+        while index < len(instructions):
+            index += self.__translate_at(instructions, index)
+        return HackClass(self.__class_name, self.__output, self.__functions, self.__calls)
+
+    def __translate_at(self, instructions: List[List[str]], index: int) -> int:
+        """Translate the instruction at index, possibly fused with the
+        following ones, and return how many instructions were consumed."""
+
+        instruction = instructions[index]
+        following = [next_instruction[0] for next_instruction in instructions[index + 1:index + 4]]
+        command = instruction[0]
+
+        if command == 'push':
+            if following[:1] and following[0] in BINARY_OPERATIONS:
+                self.__emit(self.__load(instruction[1], int(instruction[2])))
+                self.__emit(['@SP', 'A=M-1', BINARY_OPERATIONS[following[0]]])
+                return 2
+            if following[:1] and following[0] in COMPARISONS:
+                consumed = self.__compare(instructions, index + 1, instruction)
+                return consumed + 1
+            if following[:1] == ['pop'] and self.__direct_address(*instructions[index + 1][1:]) is not None:
+                self.__emit(self.__load(instruction[1], int(instruction[2])))
+                self.__emit([f'@{self.__direct_address(*instructions[index + 1][1:])}', 'M=D'])
+                return 2
+            self.__push(instruction[1], int(instruction[2]))
+        elif command == 'pop':
+            self.__pop(instruction[1], int(instruction[2]))
+        elif command in BINARY_OPERATIONS:
+            self.__emit(POP_D + ['A=A-1', BINARY_OPERATIONS[command]])
+        elif command in UNARY_OPERATIONS:
+            self.__emit(['@SP', 'A=M-1', UNARY_OPERATIONS[command]])
+        elif command in COMPARISONS:
+            return self.__compare(instructions, index, None)
+        elif command == 'label':
+            self.__emit([f'({self.__function}${instruction[1]})'])
+        elif command == 'goto':
+            self.__emit([f'@{self.__function}${instruction[1]}', '0;JMP'])
+        elif command == 'if-goto':
+            self.__emit(POP_D + [f'@{self.__function}${instruction[1]}', 'D;JNE'])
+        elif command == 'function':
+            self.__function_header(instruction[1], int(instruction[2]))
+        elif command == 'call':
+            self.__call(instruction[1], int(instruction[2]))
+        elif command == 'return':
+            self.__emit(['@$RETURN', '0;JMP'])
+        else:
+            raise ValueError(f'Unknown VM command in {self.__class_name}: {" ".join(instruction)}')
+        return 1
+
+    def __compare(self, instructions: List[List[str]], index: int, pushed: Union[List[str], None]) -> int:
+        """Translate the comparison at index. pushed is the push before it,
+        whose operand is loaded into D instead of being pushed."""
+
+        command = instructions[index][0]
+        jump = COMPARISONS[command]
+        following = instructions[index + 1:index + 3]
+        # y goes into D, x stays on the stack
+        load_y = self.__load(pushed[1], int(pushed[2])) if pushed is not None else POP_D
+
+        negated = following[:1] == [['not']]
+        if negated:
+            following = following[1:]
+            jump = NEGATED_JUMPS[jump]
+        if following[:1] and following[0][0] == 'if-goto':
+            # both operands are consumed, the jump tests x - y instead of a boolean
+            target = f'{self.__function}${following[0][1]}'
+            if command == 'eq' or pushed == ['push', 'constant', '0']:
+                difference = ['@SP', 'AM=M-1', 'D=M-D']
+                end = []
+            else:
+                self.__comparison_labels += 1
+                label = f'{self.__function}$cmp.{self.__comparison_labels}'
+                # with different signs x > y holds exactly when y is the negative one
+                jumps_when_y_negative = (command == 'gt') != negated
+                difference = _signed_difference(label, ['@SP', 'AM=M-1', 'D=M'], ['@SP', 'A=M', 'D=M'],
+                                                f'{label}.end' if jumps_when_y_negative else target,
+                                                target if jumps_when_y_negative else f'{label}.end')
+                end = [f'({label}.end)']
+            self.__emit(load_y + difference + [f'@{target}', f'D;{jump}'] + end)
+            return 3 if negated else 2
+
+        return_label = self.__return_label()
+        self.__emit([f'@{return_label}', 'D=A', '@R13', 'M=D'] + load_y
+                    + [f'@${command.upper()}', '0;JMP', f'({return_label})'])
+        return 1
+
+    def __function_header(self, name: str, nlocals: int) -> None:
+        self.__function = name
+        self.__return_labels = 0
+        self.__comparison_labels = 0
+        self.__functions.append(name)
+        self.__emit([f'({name})'])
+        if nlocals:
+            self.__emit(['@SP', 'A=M', 'M=0'] + ['A=A+1', 'M=0'] * (nlocals - 1) + ['D=A+1', '@SP', 'M=D'])
+
+    def __call(self, name: str, nargs: int) -> None:
+        self.__calls.add(name)
+        return_label = self.__return_label()
+        self.__emit([f'@{nargs}', 'D=A', '@R14', 'M=D', f'@{name}', 'D=A', '@R15', 'M=D',
+                     f'@{return_label}', 'D=A', '@$CALL', '0;JMP', f'({return_label})'])
+
+    def __return_label(self) -> str:
+        self.__return_labels += 1
+        return f'{self.__function}$ret.{self.__return_labels}'
+
+    def __direct_address(self, segment: str, index: str) -> Union[str, None]:
+        """Symbol of a segment entry that needs no address arithmetic."""
+        if segment == 'temp':
+            return f'R{5 + int(index)}'
+        elif segment == 'pointer':
+            return 'THIS' if index == '0' else 'THAT'
+        elif segment == 'static':
+            return f'{self.__class_name}.{index}'
+        return None
+
+    def __load(self, segment: str, index: int) -> List[str]:
+        """Instructions that put the value of segment index into D."""
+
+        if segment == 'constant':
+            return ['D=0'] if index == 0 else ['D=1'] if index == 1 else [f'@{index}', 'D=A']
+        address = self.__direct_address(segment, str(index))
+        if address is not None:
+            return [f'@{address}', 'D=M']
+        return self.__address(segment, index) + ['D=M']
+
+    def __address(self, segment: str, index: int) -> List[str]:
+        pointer = SEGMENT_POINTERS[segment]
+        if index <= MAX_INCREMENTED_INDEX:
+            return [f'@{pointer}', 'A=M+1' if index else 'A=M'] + ['A=A+1'] * (index - 1)
+        return [f'@{index}', 'D=A', f'@{pointer}', 'A=D+M']
+
+    def __push(self, segment: str, index: int) -> None:
+        if segment == 'constant' and index in (0, 1):
+            self.__emit(['@SP', 'AM=M+1', 'A=A-1', f'M={index}'])
+        else:
+            self.__emit(self.__load(segment, index) + PUSH_D)
+
+    def __pop(self, segment: str, index: int) -> None:
+        address = self.__direct_address(segment, str(index))
+        if address is not None:
+            self.__emit(POP_D + [f'@{address}', 'M=D'])
+        elif index <= MAX_INCREMENTED_INDEX:
+            self.__emit(POP_D + self.__address(segment, index) + ['M=D'])
+        else:
+            self.__emit(self.__address(segment, index)[:-1] + ['D=D+M', '@R13', 'M=D']
+                        + POP_D + ['@R13', 'A=M', 'M=D'])
+
+    def __emit(self, lines: List[str]) -> None:
+        self.__output += lines
+
+def translate_class(class_name: str, vm_text: str) -> HackClass:
+    return HackTranslator(class_name).translate(vm_text.splitlines())
+
+class AsmSink(OutputSink):
+    """Takes the VM code of one class and translates it on close. The result
+    is left in `hack_class` for the AsmProgram of the class's program."""
+
+    def __init__(self, class_name: str):
+        self.__class_name = class_name
+        self.__chunks = []
+        self.write = self.__chunks.append
+        self.hack_class = None
+
+    def close(self) -> None:
+        self.hack_class = translate_class(self.__class_name, ''.join(self.__chunks))
+
+class AsmProgram:
+
+    def __init__(self):
+        self.__classes = {}
+
+    def add(self, hack_class: HackClass) -> None:
+        self.__classes[hack_class.class_name] = hack_class
+
+    def entry_point(self) -> str:
+        defined = self.defined_functions()
+        return 'Sys.init' if 'Sys.init' in defined else 'Main.main'
+
+    def defined_functions(self) -> Set[str]:
+        return {function for hack_class in self.__classes.values() for function in hack_class.functions}
+
+    def undefined_functions(self) -> List[str]:
+        """Functions that are called but not part of the program, such as the
+        OS when its .vm files were not linked in."""
+        defined = self.defined_functions()
+        called = {call for hack_class in self.__classes.values() for call in hack_class.calls}
+        called.add(self.entry_point())
+        return sorted(called - defined)
+
+    def to_asm(self) -> str:
+        bootstrap = ['@256', 'D=A', '@SP', 'M=D', '@R14', 'M=0', f'@{self.entry_point()}', 'D=A',
+                     '@R15', 'M=D', '@$HALT', 'D=A', '@$CALL', '0;JMP', '($HALT)', '@$HALT', '0;JMP']
+        lines = ['// bootstrap'] + bootstrap + ['// shared routines'] + CALL_ROUTINE + RETURN_ROUTINE + COMPARISON_ROUTINES
+        for class_name in sorted(self.__classes):
+            lines.append(f'// class {class_name}')
+            lines += self.__classes[class_name].lines
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        write_file_atomically(path, self.to_asm())
@@ -0,0 +1,190 @@
+"""Whole program inlining of small leaf subroutines.
+
+After a directory is compiled, every function that makes no calls and has at
+most `threshold` VM instructions is a candidate, typically getters such as
+Ball.getLeft and setters such as Bat.setWidth. A `call` to a candidate is
+replaced by its body when the estimated cycles of the body are lower than the
+call with its frame setup and return.
+
+The inlined body finds its arguments on the stack. They are popped into temp
+slots, locals and the callee's own temps get the following slots, so a
+callee fits when all of them fit in the 8 temp registers. The compiler never
+keeps a temp or pointer 1 live across a call, so both are free at every call
+site. A method's `this` segment is reached through pointer 1 and `that`
+instead of changing the caller's pointer 0. Labels get a unique suffix and
+every return but a final one jumps to the end of the inlined body.
+"""
+from __future__ import annotations
+from collections import Counter
+from typing import List, Tuple, Union
+
+from cost_model import CALL_COST, command_cost, split_functions
+from optimizer import Instruction
+from source_map import remap_source_map
+from vm_writer import write_file_atomically
+
+DEFAULT_THRESHOLD = 10
+TEMP_SLOTS = 8
+
+class InlineCandidate:
+    """Body of a leaf function with its arguments, locals and temps remapped to
+    temp slots, ready to be copied to a call site."""
+
+    def __init__(self, name: str, body: List[Instruction], arguments: int, call_cost: int, uses_statics: bool):
+        self.name = name
+        self.class_name = name.split('.')[0]
+        self.body = body
+        self.arguments = arguments
+        self.call_cost = call_cost
+        self.uses_statics = uses_statics
+
+    def fits(self, caller_class: str, nargs: int) -> bool:
+        # static i belongs to the class of its .vm file, it only keeps its meaning within the class
+        if self.uses_statics and caller_class != self.class_name:
+            return False
+        # unused arguments are popped into the first free slot
+        return nargs <= self.arguments or self.arguments < TEMP_SLOTS
+
+    def expand(self, nargs: int, label_suffix: str) -> List[Instruction]:
+
+        sequence = [('pop', 'temp', str(min(slot, self.arguments))) for slot in reversed(range(nargs))]
+        end_label = f'RETURN{label_suffix}'
+        jumps_to_end = False
+        for index, instruction in enumerate(self.body):
+            if instruction[0] == 'return':
+                if index < len(self.body) - 1:
+                    sequence.append(('goto', end_label))
+                    jumps_to_end = True
+            elif instruction[0] in ('label', 'goto', 'if-goto'):
+                sequence.append((instruction[0], f'{instruction[1]}{label_suffix}'))
+            else:
+                sequence.append(instruction)
+        if jumps_to_end:
+            sequence.append(('label', end_label))
+
+        # argument 0 is popped last and often pushed straight back
+        if nargs and sequence[nargs:nargs + 1] == [('push', 'temp', '0')] \
+                and sum(instruction[1:] == ('temp', '0') for instruction in sequence) == 2:
+            del sequence[nargs - 1:nargs + 1]
+        return sequence
+
+    def cost(self, nargs: int) -> int:
+        return sum(command_cost(instruction) for instruction in self.expand(nargs, ''))
+
+def inline_candidate(name: str, lines: List[str], threshold: int) -> Union[InlineCandidate, None]:
+    """Return the inlinable body of a function, or None when it does not qualify."""
+
+    instructions = [tuple(line.split()) for line in lines]
+    nlocals = int(instructions[0][2])
+    body = instructions[1:]
+    if len(body) > threshold or not body or body[-1] != ('return',):
+        return None
+
+    method = body[:2] == [('push', 'argument', '0'), ('pop', 'pointer', '0')]
+    if method:
+        body = body[2:]
+
+    arguments = max([int(instruction[2]) + 1 for instruction in body if instruction[1:2] == ('argument',)]
+                    + [1 if method else 0])
+    temps = max([int(instruction[2]) + 1 for instruction in body if instruction[1:2] == ('temp',)] + [0])
+    locals_base, temps_base = arguments, arguments + nlocals
+    if temps_base + temps > TEMP_SLOTS:
+        return None
+
+    uses_this = any(instruction[1:2] == ('this',) for instruction in body)
+    remapped = []
+    for index in range(nlocals):
+        remapped += [('push', 'constant', '0'), ('pop', 'temp', str(locals_base + index))]
+
+    for instruction in body:
+        command = instruction[0]
+        segment = instruction[1] if len(instruction) > 1 else None
+
+        if command in ('call', 'function'):
+            return None
+        elif segment == 'argument':
+            remapped.append((command, 'temp', instruction[2]))
+        elif segment == 'local':
+            remapped.append((command, 'temp', str(locals_base + int(instruction[2]))))
+        elif segment == 'temp':
+            remapped.append((command, 'temp', str(temps_base + int(instruction[2]))))
+        elif segment == 'this':
+            if not method:
+                return None
+            remapped += [('push', 'temp', '0'), ('pop', 'pointer', '1'), (command, 'that', instruction[2])]
+        elif segment == 'pointer':
+            if instruction == ('push', 'pointer', '0') and method:
+                remapped.append(('push', 'temp', '0'))
+            elif instruction[2] == '1' and not uses_this:
+                remapped.append(instruction)
+            else:
+                return None
+        elif segment == 'that' and uses_this:
+            # pointer 1 is busy holding this
+            return None
+        else:
+            remapped.append(instruction)
+
+    call_cost = CALL_COST + sum(command_cost(instruction) for instruction in instructions)
+    uses_statics = any(instruction[1:2] == ('static',) for instruction in body)
+    return InlineCandidate(name, remapped, arguments, call_cost, uses_statics)
+
+def inline_calls(vm_paths: List[str], threshold: int, stats: Counter) -> List[Tuple[str, str]]:
+    """Inline small leaf functions into their callers across the .vm files of
+    one program. Returns the (caller, callee) pair of every inlined call site."""
+
+    files = {}
+    for vm_path in vm_paths:
+        with open(vm_path, 'r') as infile:
+            files[vm_path] = split_functions(infile.read().splitlines())
+
+    candidates = {}
+    for functions in files.values():
+        for name, lines in functions.items():
+            candidate = inline_candidate(name, lines, threshold) if name else None
+            if candidate is not None:
+                candidates[name] = candidate
+
+    sites = []
+    for vm_path, functions in files.items():
+        new_lines, old_line_numbers, vm_line = [], [], 0
+        changed = False
+
+        for name, lines in functions.items():
+            caller_class = name.split('.')[0]
+            inlined_in_function = 0
+            for line in lines:
+                vm_line += 1
+                instruction = line.split()
+                candidate = candidates.get(instruction[1]) if instruction[0] == 'call' else None
+                nargs = int(instruction[2]) if candidate is not None else 0
+
+                if candidate is None or not candidate.fits(caller_class, nargs) \
+                        or candidate.cost(nargs) >= candidate.call_cost:
+                    new_lines.append(line)
+                    old_line_numbers.append(vm_line)
+                    continue
+
+                for inlined in candidate.expand(nargs, f'_INLINE{inlined_in_function}'):
+                    new_lines.append(' '.join(inlined))
+                    old_line_numbers.append(vm_line)
+                inlined_in_function += 1
+
+                sites.append((name, candidate.name))
+                stats['inlined_calls'] += 1
+                stats['inline_cycles_saved'] += candidate.call_cost - candidate.cost(nargs)
+                changed = True
+
+        if changed:
+            write_file_atomically(vm_path, ''.join(f'{line}\n' for line in new_lines))
+            remap_source_map(f'{vm_path}.map', new_lines, old_line_numbers)
+
+    stats['inlined_functions'] += len({callee for _, callee in sites})
+    return sites
+
+def report(sites: List[Tuple[str, str]], stats: Counter) -> str:
+    lines = [f'Inlining: inlined {stats["inlined_calls"]} call sites of {stats["inlined_functions"]} functions, '
+             f'saving about {stats["inline_cycles_saved"]} cycles per execution of every site']
+    for (caller, callee), count in sorted(Counter(sites).items()):
+        lines.append(f'  {caller}: {callee}{f" x{count}" if count > 1 else ""}')
+    return '\n'.join(lines)
@@ -1,80 +1,124 @@
 from __future__ import annotations
+from array import array
 from enum import Enum
+from operator import itemgetter
+from typing import Iterator, Tuple
 
-import re
+import sys
 
-class Token:
+class TokenType(Enum):
+
+    KEYWORD = 1
+    SYMBOL = 2
+    INTEGER_CONSTANT = 3
+    STRING_CONSTANT = 4
+    IDENTIFIER = 5
+
+class Token(tuple):
+    """Immutable (token_type, value) pair.
+
+    Keyword and symbol tokens are interned: Token('class') always returns the same
+    shared instance, so only constants and identifiers allocate a new object.
+    """
 
-    ## PRIVATE CLASS ATTRIBUTES ##
+    __slots__ = ()
 
-    __SYMBOLS = ['{','}','(',')','[',']','.',',',';','+','-',\
-            '*','/','&','|','<','>','=','~']
-    __KEYWORDS = ['class', 'constructor', 'function', 'method', 'field',\
+    ## PUBLIC CLASS ATTRIBUTES ##
+
+    symbols = frozenset(['{','}','(',')','[',']','.',',',';','+','-',\
+            '*','/','&','|','<','>','=','~'])
+    keywords = frozenset(['class', 'constructor', 'function', 'method', 'field',\
                 'static', 'var', 'int', 'char', 'boolean', 'void', 'true', 'false',\
-                'null', 'this','let', 'do', 'if', 'else', 'while', 'return']
-    
+                'null', 'this','let', 'do', 'if', 'else', 'while', 'return'])
+
     ## Constructor ##
 
-    def __init__(self, raw_code: str):
+    def __new__(cls, raw_code: str) -> Token:
 
-        if raw_code in self.__KEYWORDS:
-            self.__token_type = TokenType.KEYWORD
-            self.__value = raw_code
+        interned = _INTERNED_TOKENS.get(raw_code)
+        if interned is not None:
+            return interned
 
-        elif raw_code in self.__SYMBOLS:
-            self.__token_type = TokenType.SYMBOL
-            self.__value = raw_code
+        return tuple.__new__(cls, classify(raw_code))
 
-        elif self.token_is_integer_constant(raw_code):
-            self.__token_type = TokenType.INTEGER_CONSTANT
-            self.__value = raw_code
+    @classmethod
+    def make(cls, token_type: TokenType, value: str) -> Token:
+        """Build a token from an already classified value."""
+        if token_type is TokenType.KEYWORD or token_type is TokenType.SYMBOL:
+            return _INTERNED_TOKENS[value]
+        return tuple.__new__(cls, (token_type, value))
 
-        elif self.token_is_string_constant(raw_code):
-            self.__token_type = TokenType.STRING_CONSTANT
-            self.__value = raw_code[1:-1]
+    @staticmethod
+    def token_is_string_constant(raw_value: str) -> bool:
+        return len(raw_value) > 1 and raw_value[0] == raw_value[-1] and raw_value[0] in '"\'' \
+                and '\n' not in raw_value
 
-        else:
-            self.__token_type = TokenType.IDENTIFIER
-            self.__value = raw_code
+    @staticmethod
+    def token_is_integer_constant(raw_value: str) -> bool:
+        return raw_value.isascii() and raw_value.isdigit()
 
-    def token_is_string_constant(self, raw_value: str) -> bool:
-        pattern1 = re.compile(r'^".*?"$')
-        pattern2 = re.compile(r"^'.*?'$")
-        return True if pattern1.match(raw_value) or pattern2.match(raw_value) else False
+    ## INSTANCE GETTERS ##
 
-    def token_is_integer_constant(self, raw_value: str) -> bool:
-        try:
-            int(raw_value)
-            return True
-        except:
-            return False
+    token_type = property(itemgetter(0))
+    value = property(itemgetter(1))
 
-    ## CLASS PUBLIC GETTERS ##
+    def __repr__(self) -> str:
+        return f'Token({self[0].name}, {self[1]!r})'
 
-    @classmethod
-    @property
-    def keywords(cls):
-        return cls.__KEYWORDS
+def classify(raw_code: str) -> Tuple[TokenType, str]:
+    """Return the (token_type, value) pair for a raw lexeme."""
 
-    @classmethod
-    @property
-    def symbols(cls):
-        return cls.__SYMBOLS
+    if raw_code in Token.keywords:
+        return TokenType.KEYWORD, raw_code
 
-    ## INSTANCE GETTERS ## 
+    elif raw_code in Token.symbols:
+        return TokenType.SYMBOL, raw_code
 
-    @property
-    def token_type(self) -> TokenType:
-        return self.__token_type
+    elif Token.token_is_integer_constant(raw_code):
+        return TokenType.INTEGER_CONSTANT, raw_code
 
-    @property
-    def value(self) -> str:
-        return self.__value
+    elif Token.token_is_string_constant(raw_code):
+        return TokenType.STRING_CONSTANT, raw_code[1:-1]
 
-class TokenType(Enum):
-     
-    KEYWORD = 1
-    SYMBOL = 2
-    INTEGER_CONSTANT = 3
-    STRING_CONSTANT = 4
-    IDENTIFIER = 5
+    else:
+        return TokenType.IDENTIFIER, raw_code
+
+_INTERNED_TOKENS = {raw_code: tuple.__new__(Token, classify(raw_code))
+                    for raw_code in Token.keywords | Token.symbols}
+
+_TOKEN_TYPES = {token_type.value: token_type for token_type in TokenType}
+
+class TokenBuffer:
+    """Array backed token storage.
+
+    Token types live in a byte array and values in a list of interned strings,
+    so a file with a million tokens costs two flat containers instead of a
+    million token objects. Indexing materializes a Token on demand.
+    """
+
+    __slots__ = ('__types', '__values')
+
+    def __init__(self):
+        self.__types = array('B')
+        self.__values = []
+
+    def append(self, raw_code: str) -> None:
+        interned = _INTERNED_TOKENS.get(raw_code)
+        if interned is not None:
+            token_type, value = interned
+        else:
+            token_type, value = classify(raw_code)
+            value = sys.intern(value) if token_type is TokenType.IDENTIFIER else value
+
+        self.__types.append(token_type.value)
+        self.__values.append(value)
+
+    def __getitem__(self, index: int) -> Token:
+        return Token.make(_TOKEN_TYPES[self.__types[index]], self.__values[index])
+
+    def __len__(self) -> int:
+        return len(self.__types)
+
+    def __iter__(self) -> Iterator[Token]:
+        for index in range(len(self.__types)):
+            yield self[index]
@@ -0,0 +1,172 @@
+"""Loop invariant code motion for the while loops of one class.
+
+A loop runs from its head label to the last backward jump to it, which
+covers both the layout of compileWhile and the rotated one of
+--branch-conditions. The pass collects the locals and arguments the loop
+writes and whether it can write memory: a store to a field, static or array
+element, or any call other than the pure OS arithmetic. An expression whose
+operands all stay the same in the loop, like `width * 2` or `size - 1`, is
+computed once in a pre-header, in front of `label WHILE_EXPn` or of the
+`goto WHILE_EXPn` that enters a rotated loop, and popped into a new local of
+the function. The loop then pushes that local instead.
+
+The slots are locals because the loop may call functions, which are free to
+use every temp. Loops are handled outermost first, so an expression leaves
+every loop it is invariant in and inner pre-headers only get what changes
+with the enclosing loops, like `i * 3` in a loop over j. Array elements are
+never hoisted, and Math.divide only by a non-zero constant, since the
+pre-header also runs when the loop body does not.
+"""
+from __future__ import annotations
+from collections import Counter
+from typing import List, Set, Tuple
+
+from common_subexpressions import BINARY_OPERATIONS, MEMORY_SEGMENTS, PURE_CALLS, UNARY_OPERATIONS, \
+        VARIABLE_SEGMENTS
+from cost_model import LOCAL_INIT_COST, LOOP_ITERATIONS, POP_COSTS, PUSH_COSTS, command_cost, find_loops, \
+        os_cycles
+from optimizer import Instruction, VMOptimizer
+
+class LoopInvariantHoister(VMOptimizer):
+    """Moves expressions that do not change inside a loop in front of the loop."""
+
+    def __init__(self):
+        self.stats = Counter()
+
+    def optimize_with_positions(self, lines: List[str], positions: List) -> Tuple[List[str], List]:
+        """Optimize lines and carry along one source position per line. Hoisted
+        instructions keep their positions."""
+
+        instructions = [tuple(line.split()) for line in lines]
+        output, output_positions = [], []
+        start = 0
+        for end in range(1, len(instructions) + 1):
+            if end == len(instructions) or instructions[end][0] == 'function':
+                function, function_positions = self.__hoist_function(instructions[start:end], positions[start:end])
+                output += function
+                output_positions += function_positions
+                start = end
+        return [' '.join(instruction) for instruction in output], output_positions
+
+    def __hoist_function(self, function: List[Instruction], positions: List) -> Tuple[List[Instruction], List]:
+
+        done = set()
+        while function and function[0][0] == 'function':
+            loops = [(end - start, label, start, end) for label, (start, end) in find_loops(function).items()
+                     if label not in done]
+            if not loops:
+                break
+            _, label, start, end = max(loops)
+            done.add(label)
+            function, positions = self.__hoist_loop(function, positions, start, end)
+        return function, positions
+
+    def __hoist_loop(self, function: List[Instruction], positions: List, start: int, end: int) \
+            -> Tuple[List[Instruction], List]:
+
+        loop = function[start:end + 1]
+        written = {tuple(instruction[1:]) for instruction in loop
+                   if instruction[0] == 'pop' and instruction[1] in VARIABLE_SEGMENTS}
+        writes_memory = any((instruction[0] == 'pop' and instruction[1] in MEMORY_SEGMENTS | {'that'})
+                            or instruction == ('pop', 'pointer', '0')
+                            or (instruction[0] == 'call' and instruction[1:] not in PURE_CALLS)
+                            for instruction in loop)
+
+        slots, replaced = {}, {}
+        for first, last in _invariant_ranges(function, start, end, written, writes_memory):
+            expression = tuple(function[first:last + 1])
+            if expression not in slots:
+                cost = _cost(expression)
+                if (cost - PUSH_COSTS['local']) * LOOP_ITERATIONS <= cost + POP_COSTS['local'] + LOCAL_INIT_COST:
+                    continue
+                slots[expression] = (int(function[0][2]) + len(slots), first)
+            replaced[first] = (last, slots[expression][0])
+        if not slots:
+            return function, positions
+
+        # a rotated loop is entered by a goto to its test, the pre-header goes in front of it
+        entry = start - 1 if function[start - 1][0] == 'goto' \
+                and ('label', function[start - 1][1]) in loop else start
+        pre_header, pre_header_positions = [], []
+        for expression, (slot, first) in slots.items():
+            pre_header += list(expression) + [('pop', 'local', str(slot))]
+            pre_header_positions += positions[first:first + len(expression)] + [positions[first + len(expression) - 1]]
+
+        output = function[:entry] + pre_header
+        output_positions = positions[:entry] + pre_header_positions
+        index = entry
+        while index < len(function):
+            if index in replaced:
+                last, slot = replaced[index]
+                output.append(('push', 'local', str(slot)))
+                output_positions.append(positions[index])
+                index = last + 1
+                continue
+            output.append(function[index])
+            output_positions.append(positions[index])
+            index += 1
+
+        output[0] = ('function', function[0][1], str(int(function[0][2]) + len(slots)))
+        self.stats['hoisted_loops'] += 1
+        self.stats['hoisted_expressions'] += len(slots)
+        self.stats['hoist_cycles_saved'] += sum(_cost(expression) - PUSH_COSTS['local'] for expression in slots)
+        return output, output_positions
+
+def _invariant_ranges(function: List[Instruction], start: int, end: int, written: Set[Tuple[str, str]],
+                      writes_memory: bool) -> List[Tuple[int, int]]:
+    """The instruction ranges (first, last) of the largest computations in a
+    loop whose operands the loop does not change, in order."""
+
+    ranges = []
+    stack = []
+
+    def pop():
+        return stack.pop() if stack else (False, -1)
+
+    for index in range(start, end + 1):
+        instruction = function[index]
+        command = instruction[0]
+
+        if command == 'push':
+            segment, value = instruction[1], instruction[2]
+            invariant = segment == 'constant' or (segment in VARIABLE_SEGMENTS and (segment, value) not in written) \
+                    or (segment in MEMORY_SEGMENTS and not writes_memory)
+            stack.append((invariant, index))
+            continue
+        elif command == 'pop':
+            pop()
+            continue
+        elif command in BINARY_OPERATIONS or (command == 'call' and instruction[1:] in PURE_CALLS):
+            (right, _), (left, first) = pop(), pop()
+            invariant = left and right and first >= 0
+            if instruction[1:2] == ('Math.divide',):
+                divisor = function[index - 1]
+                invariant = invariant and divisor[:2] == ('push', 'constant') and divisor[2] != '0'
+        elif command in UNARY_OPERATIONS:
+            invariant, first = pop()
+            invariant = invariant and first >= 0
+        elif command == 'call':
+            for _ in range(int(instruction[2])):
+                pop()
+            stack.append((False, index))
+            continue
+        else:
+            # labels and jumps start a new basic block
+            stack = []
+            continue
+
+        if invariant and not any(other[0] == 'pop' for other in function[first:index]):
+            # a larger invariant computation replaces the ones inside it
+            while ranges and ranges[-1][0] >= first:
+                ranges.pop()
+            ranges.append((first, index))
+        stack.append((invariant, first))
+    return ranges
+
+def _cost(expression: Tuple[Instruction, ...]) -> int:
+    return sum(command_cost(instruction) + (os_cycles(instruction[1]) if instruction[0] == 'call' else 0)
+               for instruction in expression)
+
+def report(stats: Counter) -> str:
+    return (f'Loop invariants: hoisted {stats["hoisted_expressions"]} expressions out of {stats["hoisted_loops"]} '
+            f'loops, saving about {stats["hoist_cycles_saved"]} cycles per iteration')
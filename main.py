@@ -1,47 +1,422 @@
 from __future__ import annotations
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
 
 import argparse
+import functools
 import re
 import os
+import sys
+import time
+from optimizer import create_optimizer, report
 from parser import Parser
-from scanner import Scanner
-from symbol_table import SymbolTable
+from scanner import Scanner, StreamingScanner
+from vm_writer import FileSink, OutputSink
 
-def generate_vm_file(full_path: str, outFileName: str) -> None:
+# the optional passes and backends are imported by the flags that use them, a plain compile never loads them
+if TYPE_CHECKING:
+    from hack_writer import HackClass
 
-    myParser = Parser(Scanner(full_path), outFileName, full_path)
+jack_file_pattern = re.compile(r'^(.*?)([^/]+)\.jack$')
+
+def generate_vm_file(full_path: str, outFileName: str, options: dict) \
+        -> Tuple[Counter, List[str], Union[dict, None], Union[HackClass, None]]:
+
+    optimizer = create_optimizer(options)
+
+    start = time.perf_counter()
+    if options.get('asm') and not options.get('keep_vm'):
+        from hack_writer import AsmSink
+
+        # the class is translated to Hack assembly in memory, no .vm file is written
+        scanner = (StreamingScanner if options.get('stream') else Scanner)(full_path, positions=options.get('source_map', False))
+        sink = AsmSink(outFileName)
+    elif options.get('stream'):
+        # lex lazily from a memory map and stream the VM code straight to disk
+        scanner, sink = StreamingScanner(full_path, options.get('source_map', False)), FileSink(os.path.join(os.path.dirname(full_path), f'{outFileName}.vm'))
+    else:
+        scanner, sink = Scanner(full_path, positions=options.get('source_map', False)), None
+    scanned = time.perf_counter()
+    myParser = Parser(scanner, outFileName, full_path, sink=sink, optimizer=optimizer, options=options)
     myParser.compileClass()
-    SymbolTable.reset_class_table()
 
-def main(full_path: str)-> None:
+    profile = myParser.profile
+    if profile is not None:
+        # a streaming scanner lexes while parsing, so its scan phase only covers opening the file
+        profile.phases['scan'] = scanned - start
+        profile.phases['parse'] = time.perf_counter() - scanned - profile.phases['emit']
+        profile = profile.to_dict()
+
+    stats = myParser.stats + optimizer.stats if optimizer is not None else myParser.stats
+    hack_class = getattr(sink, 'hack_class', None)
+    return stats, sorted(myParser.pooled_strings), profile, hack_class
+
+def main(full_path: str, options: Union[dict, None] = None) \
+        -> Tuple[float, Counter, List[str], Union[dict, None], Union[HackClass, None]]:
+    start = time.perf_counter()
+    stats, pooled_strings, profile, hack_class = Counter(), [], None, None
     match = jack_file_pattern.match(full_path)
     if match:
-        generate_vm_file(full_path, match.group(2))
+        stats, pooled_strings, profile, hack_class = generate_vm_file(full_path, match.group(2), options or {})
+    return time.perf_counter() - start, stats, pooled_strings, profile, hack_class
+
+def output_options(args: argparse.Namespace) -> dict:
+    """Command line options that change the emitted VM code. They are stored in
+    the incremental build manifest, so changing one forces a rebuild."""
+    if args.eliminate_dead_code:
+        from dead_code import DEFAULT_ROOTS
+
+    return {'peephole': args.peephole, 'fold_constants': args.fold_constants, 'pool_strings': args.pool_strings,
+            'strength_reduce': args.strength_reduce, 'source_map': args.source_map,
+            'branch_conditions': args.branch_conditions, 'array_access': args.array_access, 'cse': args.cse,
+            'hoist_invariants': args.hoist_invariants,
+            'eliminate_dead_code': DEFAULT_ROOTS + sorted(args.root) if args.eliminate_dead_code else None,
+            'inline': args.inline_threshold if args.inline else None}
+
+def finish_string_pool(directory: str, pooled_strings: Dict[str, List[str]], stats: Counter,
+                       sink: Union[OutputSink, None] = None) -> None:
+    """Write StringPool.vm with every literal used by the program."""
+    from string_pool import write_string_pool
+
+    literals = set()
+    for file_literals in pooled_strings.values():
+        literals.update(file_literals)
+    write_string_pool(directory, literals, sink)
+    stats['pooled_string_literals'] += len(literals)
+
+def link_program(directory: str, paths: List[str], hack_classes: Dict[str, HackClass],
+                 string_pool: Union[HackClass, None] = None) -> str:
+    """Write the Hack assembly of one directory to <Directory>.asm and return
+    its path. Classes not translated in memory are read from their .vm files,
+    other .vm files in the directory, such as the OS, are linked in as well."""
+    from hack_writer import AsmProgram, translate_class
+    from string_pool import POOL_CLASS
+
+    program = AsmProgram()
+    compiled = set()
+    for file_path in paths:
+        class_name = jack_file_pattern.match(file_path).group(2)
+        compiled.add(class_name)
+        if file_path in hack_classes:
+            program.add(hack_classes[file_path])
+        else:
+            with open(os.path.join(directory, f'{class_name}.vm'), 'r') as infile:
+                program.add(translate_class(class_name, infile.read()))
+
+    with os.scandir(directory) as entries:
+        vm_names = sorted(entry.name for entry in entries if entry.is_file() and entry.name.endswith('.vm'))
+    if string_pool is not None:
+        compiled.add(POOL_CLASS)
+        program.add(string_pool)
+    for vm_name in vm_names:
+        class_name = vm_name[:-len('.vm')]
+        if class_name not in compiled:
+            with open(os.path.join(directory, vm_name), 'r') as infile:
+                program.add(translate_class(class_name, infile.read()))
+
+    undefined = program.undefined_functions()
+    if undefined:
+        print(f'Hack assembly: {directory} calls functions it does not define, copy the OS .vm files next to the '
+              f'sources to link them: {", ".join(undefined)}', file=sys.stderr)
+
+    asm_path = os.path.join(directory, f'{os.path.basename(directory)}.asm')
+    program.write(asm_path)
+    return asm_path
+
+def print_reports(stats: Counter, options: dict) -> None:
+
+    if options.get('fold_constants') or options.get('strength_reduce'):
+        print(f'Constant folding: folded {stats["folded_operations"]} operations, '
+              f'removed {stats["folded_multiply_divide"]} Math.multiply/Math.divide calls')
+    if options.get('strength_reduce'):
+        print(f'Strength reduction: inlined {stats["strength_reduced_multiply"]} Math.multiply and '
+              f'{stats["strength_reduced_divide"]} Math.divide calls')
+    if options.get('branch_conditions'):
+        print(f'Branch conditions: {stats["branch_single_jumps"]} ifs with a single jump '
+              f'({stats["branch_conditions_inverted"]} with an inverted comparison), '
+              f'{stats["branch_loops_rotated"]} loops tested at the bottom, {stats["branch_tests_removed"]} constant tests removed')
+    if options.get('array_access'):
+        print(f'Array access: {stats["constant_array_indices"]} constant indices, {stats["reused_array_bases"]} reused '
+              f'array pointers, {stats["array_stores_without_temp"]} stores without the temp 0 round trip')
+    if options.get('hoist_invariants'):
+        from loop_invariants import report as hoist_report
+        print(hoist_report(stats))
+    if options.get('cse'):
+        from common_subexpressions import report as cse_report
+        print(cse_report(stats))
+    if options.get('peephole'):
+        print(report(stats))
+    if options.get('eliminate_dead_code'):
+        from dead_code import report as dead_code_report
+        print(dead_code_report(stats))
+    if options.get('pool_strings'):
+        # a site that finds its string already built runs push/if-goto/push, plus call/return through StringPool
+        pooled_cost = 3 if options['pool_strings'] == 'class' else 5
+        print(f'String pooling ({options["pool_strings"]}): {stats["pooled_string_sites"]} literal sites share '
+              f'{stats["pooled_string_literals"]} strings. Repeated executions of every site run '
+              f'{stats["pooled_string_sites"] * pooled_cost} VM instructions instead of {stats["string_instructions_unpooled"]} '
+              f'and allocate no String objects instead of {stats["pooled_string_sites"]}')
+
+def estimate_costs(all_paths: List[str]) -> List[dict]:
+    """Static Hack cost estimate of every function in the written .vm files."""
+    from cost_model import estimate_function_costs
+
+    costs = []
+    for file_path in all_paths:
+        with open(f'{os.path.splitext(file_path)[0]}.vm', 'r') as infile:
+            costs += estimate_function_costs(infile.read().splitlines())
+    return costs
+
+def collect_paths(arguments: List[str], recursive: bool) -> List[str]:
+    """Expand the command line into .jack paths. An argument is a .jack file,
+    a directory, `@argfile` with one argument per line or `-` for arguments
+    read from stdin."""
+
+    all_paths = []
+    for argument in arguments:
+
+        if argument == '-' or argument.startswith('@'):
+            if argument == '-':
+                lines = sys.stdin.read().splitlines()
+            else:
+                with open(argument[1:], 'r') as argfile:
+                    lines = argfile.read().splitlines()
+            all_paths += collect_paths([line.strip() for line in lines
+                                        if line.strip() and not line.strip().startswith('#')], recursive)
+
+        elif jack_file_pattern.match(argument):
+            all_paths.append(argument)
+
+        else:
+            # assume it is a directory and handle all the jack files in the directory
+            try:
+                all_paths += scan_directory(os.path.join(os.getcwd(), argument), recursive)
+            except FileNotFoundError:
+
+                raise FileNotFoundError(
+                        "No such directory exists!: Provide a valid directory with .jack files to compile or a single .jack file"
+                        )
+
+    # the same file reached through two arguments is compiled once
+    return list(dict.fromkeys(all_paths))
+
+def scan_directory(directory: str, recursive: bool) -> List[str]:
+    with os.scandir(directory) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+
+    all_paths = []
+    for entry in entries:
+        if entry.is_file() and entry.name.endswith('.jack'):
+            all_paths.append(entry.path)
+        elif recursive and entry.is_dir():
+            all_paths += scan_directory(entry.path, recursive)
+    return all_paths
+
+def compile_all(all_paths: List[str], jobs: int, options: dict) \
+        -> Tuple[Counter, Dict[str, List[str]], Dict[str, float], List[dict], Dict[str, HackClass]]:
+    """Compile every path and return the summed statistics, the string
+    literals each file left for the program wide string pool, the seconds
+    each file took, the --profile records and the Hack assembly of every
+    file translated in memory by --asm."""
+
+    if not all_paths:
+        return Counter(), {}, {}, [], {}
+
+    start = time.perf_counter()
+    compile_file = functools.partial(main, options=options)
+    if jobs == 1:
+        results = [compile_file(file_path) for file_path in all_paths]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # every file gets its own Parser with its own symbol table
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(compile_file, all_paths))
+    elapsed = time.perf_counter() - start
+    file_timings = [file_timing for file_timing, _, _, _, _ in results]
+
+    if jobs != 1:
+        # not a serial run: the workers' per-file times, without process start-up and pickling
+        serial_time = sum(file_timings)
+        print(f'Compiled {len(all_paths)} files with {jobs} jobs in {elapsed:.3f}s '
+              f'(estimated -j1 time {serial_time:.3f}s from the per-file times, '
+              f'estimated speedup {serial_time/elapsed:.2f}x)')
+
+    stats = sum((file_stats for _, file_stats, _, _, _ in results), Counter())
+    return stats, {file_path: pooled for file_path, (_, _, pooled, _, _) in zip(all_paths, results)}, \
+            dict(zip(all_paths, file_timings)), [profile for _, _, _, profile, _ in results if profile is not None], \
+            {file_path: hack_class for file_path, (_, _, _, _, hack_class) in zip(all_paths, results) if hack_class is not None}
 
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument('fileOrDirectory')
+    arg_parser.add_argument('fileOrDirectory', nargs='+',
+            help='.jack files, directories, @argfiles listing more of them, or - to read them from stdin')
+    arg_parser.add_argument('-r', '--recursive', action='store_true',
+            help='also compile .jack files in subdirectories of the given directories')
+    arg_parser.add_argument('--timings', action='store_true', help='print the compile time of every file')
+    arg_parser.add_argument('-i', '--incremental', action='store_true',
+            help='skip files whose source, compiler version and options match the build manifest')
+    arg_parser.add_argument('--peephole', action='store_true',
+            help='rewrite wasteful VM instruction sequences before writing them')
+    arg_parser.add_argument('--fold-constants', action='store_true',
+            help='evaluate constant subexpressions at compile time')
+    arg_parser.add_argument('--pool-strings', choices=['class', 'program'],
+            help='build every distinct string literal once per class or per program and reuse it')
+    arg_parser.add_argument('--strength-reduce', action='store_true',
+            help='replace multiplication and division by suitable constants with inline code (implies --fold-constants)')
+    arg_parser.add_argument('--branch-conditions', action='store_true',
+            help='compile if and while conditions to a single conditional jump where the condition allows it')
+    arg_parser.add_argument('--array-access', action='store_true',
+            help='address constant array indices through that directly and reuse pointer 1 for the same array')
+    arg_parser.add_argument('--cse', action='store_true',
+            help='compute an expression that repeats within a basic block once and reuse it from a temp')
+    arg_parser.add_argument('--hoist-invariants', action='store_true',
+            help='compute expressions whose operands a while loop does not change once before the loop')
+    arg_parser.add_argument('--source-map', action='store_true',
+            help='write a <Class>.vm.map next to every .vm file that maps its instructions to Jack lines and columns')
+    arg_parser.add_argument('--eliminate-dead-code', action='store_true',
+            help='treat every directory as a program and remove the functions Sys.init, Main.main and the --root functions never call')
+    arg_parser.add_argument('--root', action='append', default=[], metavar='CLASS.FUNCTION',
+            help='extra function that --eliminate-dead-code keeps with everything it calls, can be repeated')
+    arg_parser.add_argument('--inline', action='store_true',
+            help='treat every directory as a program and replace calls to small functions that make no calls with their bodies')
+    arg_parser.add_argument('--inline-threshold', type=int, metavar='N',
+            help='largest function body in VM instructions that --inline copies (default 10)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+            help='number of worker processes for directory mode (0 uses every CPU core)')
+    arg_parser.add_argument('--stream', action='store_true',
+            help='lex sources lazily from a memory map instead of reading them whole, for very large files')
+
+    arg_parser.add_argument('--profile', metavar='FILE',
+            help='write scan/parse/emit times, per subroutine times and instruction counts, '
+                 'symbol table sizes and token counts of every compiled file to FILE')
+    # profiler.PROFILE_FORMATS, spelled out so that parsing the command line does not import the profiler
+    arg_parser.add_argument('--profile-format', choices=['json', 'pstats'], default='json',
+            help='json, or pstats for cProfile tools such as python -m pstats (default json)')
+
+    arg_parser.add_argument('--cost-report', action='store_true',
+            help='print the estimated Hack instructions and cycles of every compiled function, most expensive first')
+    arg_parser.add_argument('--cost-json', metavar='FILE', help='write the cost estimates to FILE as JSON')
+
+    arg_parser.add_argument('--asm', action='store_true',
+            help='translate every directory straight to one <Directory>.asm Hack assembly program')
+    arg_parser.add_argument('--keep-vm', action='store_true', help='with --asm, also write the .vm files')
+
+    arg_parser.add_argument('--daemon', action='store_true',
+            help='keep running, recompile changed files in the given directories and serve compile requests')
+    arg_parser.add_argument('--socket', help='Unix socket of the --daemon API (default /tmp/jack-compiler.sock)')
+    arg_parser.add_argument('--poll-interval', type=float, default=0.02,
+            help='seconds between directory scans in --daemon mode')
 
     args = arg_parser.parse_args()
-    jack_file_pattern = re.compile(r'^(.*?)([^/]+)\.jack$')
+    if args.inline and args.inline_threshold is None:
+        from inliner import DEFAULT_THRESHOLD
+        args.inline_threshold = DEFAULT_THRESHOLD
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    options = output_options(args)
+    # whole program passes, cost estimates and source maps work on the .vm files
+    keep_vm = args.keep_vm or bool(options['eliminate_dead_code'] or options['inline'] or args.cost_report
+                                   or args.cost_json or args.source_map)
+    # streaming, profiling and the assembly backend do not change the VM code, so they are kept out of the build manifest
+    compile_options = {**options, 'stream': args.stream, 'profile': args.profile is not None,
+                       'asm': args.asm, 'keep_vm': keep_vm}
+
+    if args.daemon:
+        from daemon import CompileDaemon, DEFAULT_SOCKET
+
+        if options['pool_strings'] == 'program' or options['eliminate_dead_code'] or options['inline'] or args.asm:
+            arg_parser.error('--pool-strings program, --eliminate-dead-code, --inline and --asm need a whole program build '
+                             'and do not work with --daemon')
+        # the daemon polls directories, a file or a missing path would never be compiled
+        for path in args.fileOrDirectory:
+            if not os.path.isdir(path):
+                arg_parser.error(f'--daemon watches directories, {path} is not a directory')
+        CompileDaemon(args.fileOrDirectory, functools.partial(main, options=compile_options),
+                      args.socket or DEFAULT_SOCKET, args.poll_interval).serve_forever()
+        sys.exit(0)
+
+    if (options['eliminate_dead_code'] or options['inline'] or args.asm) and args.incremental:
+        # rewritten .vm files depend on the other files of the program, e.g. the bodies they inlined
+        arg_parser.error('--eliminate-dead-code, --inline and --asm need a whole program build and do not work with --incremental')
+
+    all_paths = collect_paths(args.fileOrDirectory, args.recursive)
 
-    file_or_dir = args.fileOrDirectory
-    if jack_file_pattern.match(file_or_dir):
-        # Handle only one jack file
-        main(file_or_dir)
+    # outputs, build manifests and string pools live next to the sources of each directory
+    directories = {}
+    for file_path in all_paths:
+        directories.setdefault(os.path.dirname(os.path.abspath(file_path)), []).append(file_path)
 
+    start = time.perf_counter()
+    if args.incremental:
+        from build_cache import BuildCache
+
+        caches = {directory: BuildCache(directory, options) for directory in directories}
+        stale_paths = [file_path for directory, paths in directories.items()
+                       for file_path in paths if not caches[directory].is_fresh(file_path)]
     else:
-        # assume it is a directory and handle all the jack files in the directory
-        try:
-            main_path = os.path.join(os.getcwd(), file_or_dir)
-            all_files = os.listdir(main_path)
-        except FileNotFoundError:
+        stale_paths = all_paths
+
+    stats, pooled_strings, file_timings, profiles, hack_classes = compile_all(stale_paths, jobs, compile_options)
+
+    if args.incremental:
+        for directory, paths in directories.items():
+            for file_path in paths:
+                if file_path in pooled_strings:
+                    caches[directory].record(file_path, pooled_strings[file_path])
+                else:
+                    pooled_strings[file_path] = caches[directory].pooled_strings(file_path)
+            caches[directory].save()
+
+    string_pools = {}
+    if options['pool_strings'] == 'program':
+        from hack_writer import AsmSink
+        from string_pool import POOL_CLASS
+
+        for directory, paths in directories.items():
+            sink = AsmSink(POOL_CLASS) if args.asm and not keep_vm else None
+            finish_string_pool(directory, {file_path: pooled_strings[file_path] for file_path in paths}, stats, sink)
+            if sink is not None:
+                string_pools[directory] = sink.hack_class
+
+    inlined_sites = []
+    if options['inline']:
+        from inliner import inline_calls, report as inline_report
+    if options['eliminate_dead_code']:
+        from dead_code import eliminate_dead_functions
+    for directory, paths in directories.items():
+        vm_paths = [f'{os.path.splitext(file_path)[0]}.vm' for file_path in paths]
+        if options['pool_strings'] == 'program':
+            vm_paths.append(os.path.join(directory, f'{POOL_CLASS}.vm'))
+        # inline first, functions whose every call was inlined are then dead
+        if options['inline']:
+            inlined_sites += inline_calls(vm_paths, options['inline'], stats)
+        if options['eliminate_dead_code']:
+            if eliminate_dead_functions(vm_paths, options['eliminate_dead_code'], stats) is None:
+                print(f'Dead code: no root function in {directory}, kept every function', file=sys.stderr)
 
-            raise FileNotFoundError(
-                    "No such directory exists!: Provide a valid directory with .jack files to compile or a single .jack file"
-                    )
-        for file in all_files:
-            file_path = os.path.join(main_path, file)
-            main(file_path)
+    if args.asm:
+        for directory, paths in directories.items():
+            asm_path = link_program(directory, paths, hack_classes, string_pools.get(directory))
+            print(f'Hack assembly: wrote {asm_path}')
 
+    print_reports(stats, options)
+    if options['inline']:
+        print(inline_report(inlined_sites, stats))
+    if args.profile:
+        from profiler import write_profile
+        write_profile(args.profile, profiles, args.profile_format)
+    if args.cost_report or args.cost_json:
+        from cost_model import format_table, write_cost_json
 
+        costs = estimate_costs(all_paths)
+        if args.cost_report:
+            print(format_table(costs))
+        if args.cost_json:
+            write_cost_json(args.cost_json, costs)
+    if args.timings:
+        for file_path, file_timing in file_timings.items():
+            print(f'{file_timing*1000:9.2f} ms  {file_path}')
+    if args.incremental:
+        hits = sum(cache.hits for cache in caches.values())
+        misses = sum(cache.misses for cache in caches.values())
+        print(f'Incremental build: {hits} hits, {misses} misses in {(time.perf_counter() - start)*1000:.1f} ms')
@@ -0,0 +1,233 @@
+from __future__ import annotations
+from collections import Counter
+from typing import Iterable, List, Tuple, Union
+
+Instruction = Tuple[str, ...]
+
+class VMOptimizer:
+    """Rewrites VM code given as lines, e.g. 'push constant 0'.
+
+    Subclasses implement optimize_with_positions(), which also carries along
+    one source position per line so that source maps survive the rewrite.
+    """
+
+    def optimize(self, lines: List[str]) -> List[str]:
+        return self.optimize_with_positions(lines, [None] * len(lines))[0]
+
+    def optimize_with_positions(self, lines: List[str], positions: List) -> Tuple[List[str], List]:
+        raise NotImplementedError
+
+BOOLEAN_PRODUCERS = {('lt',), ('gt',), ('eq',)}
+
+class PeepholeRule:
+    """A rewrite of the last `size` instructions of the output.
+
+    rewrite() receives the window as a list of split instructions, e.g.
+    ('push', 'constant', '0'), and returns the replacement instructions or None
+    when the window does not match. A replacement must be shorter than the
+    window so that rewriting always terminates.
+    """
+
+    name = ''
+    size = 1
+
+    def rewrite(self, window: List[Instruction]) -> Union[List[Instruction], None]:
+        raise NotImplementedError
+
+class DoubleNegationRule(PeepholeRule):
+    """`not; not` and `neg; neg` are the identity."""
+
+    name = 'double-negation'
+    size = 2
+
+    def rewrite(self, window):
+        first, second = window
+        if first == second and first in (('not',), ('neg',)):
+            return []
+
+class ConstantBranchRule(PeepholeRule):
+    """`push constant 0; if-goto L` (if false) never jumps."""
+
+    name = 'constant-branch'
+    size = 2
+
+    def rewrite(self, window):
+        first, second = window
+        if first == ('push', 'constant', '0') and second[0] == 'if-goto':
+            return []
+
+class TrueBranchRule(PeepholeRule):
+    """`push constant 0; not; if-goto L` (if true) always jumps."""
+
+    name = 'true-branch'
+    size = 3
+
+    def rewrite(self, window):
+        first, second, third = window
+        if first == ('push', 'constant', '0') and second == ('not',) and third[0] == 'if-goto':
+            return [('goto', third[1])]
+
+class JumpToNextRule(PeepholeRule):
+    """`goto L; label L` falls through to L anyway."""
+
+    name = 'jump-to-next'
+    size = 2
+
+    def rewrite(self, window):
+        first, second = window
+        if first[0] == 'goto' and second[0] == 'label' and first[1] == second[1]:
+            return [second]
+
+class UnreachableCodeRule(PeepholeRule):
+    """Nothing after `goto` or `return` runs until the next label or function."""
+
+    name = 'unreachable'
+    size = 2
+
+    def rewrite(self, window):
+        first, second = window
+        if first[0] in ('goto', 'return') and second[0] not in ('label', 'function'):
+            return [first]
+
+class InvertedBranchRule(PeepholeRule):
+    """`lt; not; if-goto A; goto B; label A` becomes `lt; if-goto B; label A`.
+
+    Only valid when the negated value is a boolean (0 or -1), so the window has
+    to start with a comparison.
+    """
+
+    name = 'inverted-branch'
+    size = 5
+
+    def rewrite(self, window):
+        comparison, negation, branch, jump, label = window
+        if comparison in BOOLEAN_PRODUCERS and negation == ('not',) and branch[0] == 'if-goto' \
+                and jump[0] == 'goto' and label[0] == 'label' and branch[1] == label[1]:
+            return [comparison, ('if-goto', jump[1]), label]
+
+class StoreLoadRule(PeepholeRule):
+    """`push S i; pop S i` leaves everything as it was."""
+
+    name = 'store-load'
+    size = 2
+
+    def rewrite(self, window):
+        first, second = window
+        if first[0] == 'push' and second[0] == 'pop' and first[1:] == second[1:]:
+            return []
+
+class ArrayStoreTempRule(PeepholeRule):
+    """Array assignments park a simple right hand side in temp 0 while `pointer 1`
+    is set. When the value is a plain push that does not read through `that`,
+    it can be pushed after the pointer is set instead."""
+
+    name = 'array-store-temp'
+    size = 5
+
+    def rewrite(self, window):
+        value, park, set_pointer, unpark, store = window
+        if value[0] == 'push' and value[1] not in ('that', 'pointer', 'temp') \
+                and park == ('pop', 'temp', '0') and set_pointer == ('pop', 'pointer', '1') \
+                and unpark == ('push', 'temp', '0') and store == ('pop', 'that', '0'):
+            return [set_pointer, value, store]
+
+DEFAULT_RULES = [
+    DoubleNegationRule(),
+    ConstantBranchRule(),
+    TrueBranchRule(),
+    JumpToNextRule(),
+    UnreachableCodeRule(),
+    InvertedBranchRule(),
+    StoreLoadRule(),
+    ArrayStoreTempRule(),
+]
+
+class PeepholeOptimizer(VMOptimizer):
+    """Rewrites a VM instruction stream with a list of PeepholeRules.
+
+    Instructions are appended to the output one at a time and every rule is
+    tried on the tail of the output, so a rewrite can expose another match
+    further back.
+    """
+
+    def __init__(self, rules: Union[Iterable[PeepholeRule], None] = None):
+        self.__rules = list(DEFAULT_RULES if rules is None else rules)
+        self.stats = Counter()
+
+    def add_rule(self, rule: PeepholeRule) -> None:
+        self.__rules.append(rule)
+
+    def optimize_with_positions(self, lines: List[str], positions: List) -> Tuple[List[str], List]:
+        """Optimize lines and carry along one source position per line.
+
+        An instruction that survives a rewrite keeps its position, new
+        instructions take the position of the first instruction they replace.
+        """
+
+        output, output_positions = [], []
+        for line, position in zip(lines, positions):
+            self.__append(output, output_positions, tuple(line.split()), position)
+
+        self.stats['instructions_in'] += len(lines)
+        self.stats['instructions_out'] += len(output)
+        return [' '.join(instruction) for instruction in output], output_positions
+
+    def __append(self, output: List[Instruction], positions: List, instruction: Instruction, position) -> None:
+
+        output.append(instruction)
+        positions.append(position)
+        for rule in self.__rules:
+            if len(output) < rule.size:
+                continue
+            window = output[-rule.size:]
+            replacement = rule.rewrite(window)
+            if replacement is not None:
+                self.stats[rule.name] += 1
+                window_positions = positions[-rule.size:]
+                del output[-rule.size:]
+                del positions[-rule.size:]
+                for new_instruction in replacement:
+                    new_position = window_positions[window.index(new_instruction)] \
+                            if new_instruction in window else window_positions[0]
+                    self.__append(output, positions, new_instruction, new_position)
+                return
+
+class OptimizerPipeline(VMOptimizer):
+    """Runs several optimizers one after the other over the same code."""
+
+    def __init__(self, optimizers: Iterable):
+        self.__optimizers = list(optimizers)
+
+    @property
+    def stats(self) -> Counter:
+        return sum((optimizer.stats for optimizer in self.__optimizers), Counter())
+
+    def optimize_with_positions(self, lines: List[str], positions: List) -> Tuple[List[str], List]:
+        for optimizer in self.__optimizers:
+            lines, positions = optimizer.optimize_with_positions(lines, positions)
+        return lines, positions
+
+def create_optimizer(options: dict) -> Union[VMOptimizer, None]:
+    """The optimizer the options ask for, None when the code is written as compiled."""
+
+    optimizers = []
+    if options.get('hoist_invariants'):
+        from loop_invariants import LoopInvariantHoister
+        optimizers.append(LoopInvariantHoister())
+    if options.get('cse'):
+        from common_subexpressions import CommonSubexpressionEliminator
+        # on the code as compiled, the peephole rules then see its rewrites
+        optimizers.append(CommonSubexpressionEliminator())
+    if options.get('peephole'):
+        optimizers.append(PeepholeOptimizer())
+    if len(optimizers) > 1:
+        return OptimizerPipeline(optimizers)
+    return optimizers[0] if optimizers else None
+
+def report(stats: Counter) -> str:
+    removed = stats['instructions_in'] - stats['instructions_out']
+    percentage = removed / stats['instructions_in'] * 100 if stats['instructions_in'] else 0
+    # the stats of a run also hold the counters of the other passes
+    rule_names = {rule.name for rule in DEFAULT_RULES}
+    rules = ', '.join(f'{name} {count}' for name, count in sorted(stats.items()) if name in rule_names)
+    return f'Peephole: removed {removed} of {stats["instructions_in"]} VM instructions ({percentage:.1f}%){": " + rules if rules else ""}'
@@ -1,24 +1,71 @@
 from __future__ import annotations
-from scanner import Scanner
+from scanner import Scanner, Position
 from jack_token import TokenType
 from exceptions import KeywordExpectedException,\
         SymbolExpectedException,\
         IdentifierExpectedException,\
         SpecificKeywordExpectedException,\
-        SpecificSymbolExpectedException
-
-from typing import Tuple
+        SpecificSymbolExpectedException,\
+        UndefinedVariableException
+
+from collections import Counter
+import time
+from typing import List, Tuple, Union
+from constant_folding import fold_binary, fold_unary, TRUE, FALSE, MAX_CONSTANT
+from strength_reduction import multiply_sequence, divide_sequence
+from string_pool import write_string_construction, construction_size, pool_function_name
+from source_map import SourceMap
 from symbol_table import SymbolTable
-from vm_writer import VM_writer
+from variable import Variable
+from vm_writer import VM_writer, OutputSink
+from optimizer import PeepholeOptimizer
 
 class Parser:
     
-    def __init__(self, scanner: Scanner, className: str, full_path: str):
+    def __init__(self, scanner: Scanner, className: str, full_path: str, sink: Union[OutputSink, None] = None,
+                 optimizer: Union[PeepholeOptimizer, None] = None, options: Union[dict, None] = None):
+        options = options or {}
         self.__scanner = scanner
-        self.__vm_writer = VM_writer(className, full_path)
+        self.__symbol_table = SymbolTable()
+        # a source map needs a scanner created with positions=True
+        self.__source_map = options.get('source_map', False)
+        self.profile = None
+        if options.get('profile'):
+            from profiler import FileProfile
+            self.profile = FileProfile(full_path, className)
+        self.__vm_writer = VM_writer(className, full_path, sink, optimizer, self.__source_map,
+                                     count_instructions=self.profile is not None)
         self.__class_name = className
         self.__if_label_number = 0
         self.__while_label_number = 0
+        # strength reduction needs to know which operands are constant, so it implies folding
+        self.__strength_reduce = options.get('strength_reduce', False)
+        self.__fold_constants = options.get('fold_constants', False) or self.__strength_reduce
+        self.__pool_strings = options.get('pool_strings')
+        self.__branch_conditions = options.get('branch_conditions', False)
+        self.__array_access = options.get('array_access', False)
+        self.__string_slots = {}
+        self.__string_label_number = 0
+        self.pooled_strings = set()
+        self.stats = Counter()
+
+    @property
+    def source_map(self) -> Union[SourceMap, None]:
+        return self.__vm_writer.source_map
+
+    def __mark_position(self) -> Union[Position, None]:
+        """Attribute the following instructions to the current token and return its position."""
+        if not self.__source_map:
+            return None
+        position = self.__scanner.current_position()
+        self.__vm_writer.set_position(position)
+        return position
+
+    def __lookup_variable(self, identifier: str) -> Variable:
+        variable = self.__symbol_table.get_variable(identifier)
+        if variable is None:
+            raise UndefinedVariableException(f'Undefined variable {identifier}')
+        return variable
 
     """ LEXICAL ELEMENTS """
 
@@ -62,14 +109,42 @@ class Parser:
         if not (current_token.token_type is TokenType.STRING_CONSTANT):
             raise SymbolExpectedException(f'StringConstant expected: got {current_token.value} instead')
 
-        self.__vm_writer.write_push("constant", len(current_token.value))
-        self.__vm_writer.write_call("String.new", 1)
-        for char in current_token.value:
-            self.__vm_writer.write_push("constant", ord(char))
-            self.__vm_writer.write_call("String.appendChar", 2)
+        literal = current_token.value
+        if self.__pool_strings:
+            self.stats['pooled_string_sites'] += 1
+            self.stats['string_instructions_unpooled'] += construction_size(literal)
+
+        if self.__pool_strings == 'class':
+            self.__write_class_pooled_string(literal)
+
+        elif self.__pool_strings == 'program':
+            self.pooled_strings.add(literal)
+            self.__vm_writer.write_call(pool_function_name(literal), 0)
+
+        else:
+            write_string_construction(self.__vm_writer, literal)
 
         if self.__scanner.has_more_tokens(): self.__scanner.advance()
 
+    def __write_class_pooled_string(self, literal: str) -> None:
+        """Keep the literal in a hidden static and only build it when the static
+        is still null, so repeated executions reuse one String object."""
+
+        if literal not in self.__string_slots:
+            self.__string_slots[literal] = self.__symbol_table.allocate_static()
+            self.stats['pooled_string_literals'] += 1
+        slot = self.__string_slots[literal]
+
+        label = f'STRING_READY{self.__string_label_number}'
+        self.__string_label_number += 1
+
+        self.__vm_writer.write_push("static", slot)
+        self.__vm_writer.write_if(label)
+        write_string_construction(self.__vm_writer, literal)
+        self.__vm_writer.write_pop("static", slot)
+        self.__vm_writer.write_label(label)
+        self.__vm_writer.write_push("static", slot)
+
 
     def compileIdentifier(self) -> None:
 
@@ -84,20 +159,35 @@ class Parser:
 
     def compileClass(self) -> None:
 
-        self.compileKeyword(True, "class")
-        self.compileIdentifier()
-        self.compileSymbol(True, "{")
+        try:
+            self.compileKeyword(True, "class")
+            self.compileIdentifier()
+            self.compileSymbol(True, "{")
 
-        while self.__scanner.current_token().value in ['static', 'field']:
-            self.compileClassVarDec()
+            while self.__scanner.current_token().value in ['static', 'field']:
+                self.compileClassVarDec()
 
-        while self.__scanner.current_token().value in ['constructor', 'function', 'method']:
-            self.compileSubroutine()
+            while self.__scanner.current_token().value in ['constructor', 'function', 'method']:
+                self.compileSubroutine()
+
+            self.compileSymbol(True, '}')
+        except BaseException:
+            # a failed compile leaves the previous .vm file as it was
+            self.__vm_writer.discard()
+            raise
+
+        if self.profile is not None:
+            # statics include the hidden slots of pooled string literals
+            self.profile.statics = self.__symbol_table.get_total_statics()
+            self.profile.fields = self.__symbol_table.get_total_fields()
+            self.profile.tokens = self.__scanner.token_count()
+            start = time.perf_counter()
 
-        self.compileSymbol(True, '}')
-    
         self.__vm_writer.close()
 
+        if self.profile is not None:
+            self.profile.phases['emit'] = time.perf_counter() - start
+
     def compileClassVarDec(self) -> None:
 
         var_type = self.__scanner.current_token().value
@@ -109,13 +199,13 @@ class Parser:
         identifier = self.__scanner.current_token().value
         self.compileIdentifier()
 
-        SymbolTable.add(identifier, var_type, class_type)
+        self.__symbol_table.add(identifier, var_type, class_type)
 
         while self.__scanner.current_token().value == ',':
             self.compileSymbol(True,",")
             identifier = self.__scanner.current_token().value
             self.compileIdentifier()
-            SymbolTable.add(identifier, var_type , class_type)
+            self.__symbol_table.add(identifier, var_type , class_type)
 
         self.compileSymbol(True, ';')
 
@@ -134,14 +224,14 @@ class Parser:
             while self.__scanner.current_token().value == 'var':
                 self.compileVarDec()
 
-            self.__vm_writer.write_function(f'{self.__class_name}.{function_name}', SymbolTable.get_total_locals())
+            self.__vm_writer.write_function(f'{self.__class_name}.{function_name}', self.__symbol_table.get_total_locals())
             if subroutine_type == 'method':
                 self.__vm_writer.write_push("argument", 0)
                 self.__vm_writer.write_pop("pointer", 0)
 
             elif subroutine_type == 'constructor':
                 constructor = True
-                self.__vm_writer.write_push("constant", SymbolTable.get_total_fields())
+                self.__vm_writer.write_push("constant", self.__symbol_table.get_total_fields())
                 self.__vm_writer.write_call("Memory.alloc", 1)
                 self.__vm_writer.write_pop("pointer", 0)
 
@@ -149,10 +239,14 @@ class Parser:
             self.compileSymbol(True, '}')
 
         subroutine_type = self.__scanner.current_token().value 
+        position = self.__mark_position()
+        if self.profile is not None:
+            start, first_instruction = time.perf_counter(), self.__vm_writer.instruction_count()
+
         self.compileKeyword(True, "constructor", "function", "method")
 
         if subroutine_type == 'method':
-            SymbolTable.set_argument_counter_to_one()
+            self.__symbol_table.set_argument_counter_to_one()
 
         if self.__scanner.current_token().value == 'void':
             self.compileKeyword(True, "void")
@@ -167,7 +261,13 @@ class Parser:
         self.compileSymbol(True, ')')
 
         compileSubroutineBody()
-        SymbolTable.reset_subroutine_table()
+
+        if self.profile is not None:
+            self.profile.add_subroutine(f'{self.__class_name}.{function_name}', subroutine_type,
+                                        position[0] if position else None, time.perf_counter() - start,
+                                        self.__vm_writer.instruction_count() - first_instruction,
+                                        self.__symbol_table.get_total_arguments(), self.__symbol_table.get_total_locals())
+        self.__symbol_table.reset_subroutine_table()
 
     def compileParameterList(self) -> None:
 
@@ -180,7 +280,7 @@ class Parser:
             identifier = self.__scanner.current_token().value
             self.compileIdentifier()
 
-            SymbolTable.add(identifier, 'arg', var_type)
+            self.__symbol_table.add(identifier, 'arg', var_type)
 
             while self.__scanner.current_token().value == ',':
                 self.compileSymbol(True, ',')
@@ -191,7 +291,7 @@ class Parser:
                 identifier = self.__scanner.current_token().value
                 self.compileIdentifier()
 
-                SymbolTable.add(identifier, 'arg', var_type)
+                self.__symbol_table.add(identifier, 'arg', var_type)
 
     def compileVarDec(self) -> None:
         self.compileKeyword(True, 'var')
@@ -202,7 +302,7 @@ class Parser:
         current_token = self.__scanner.current_token()
         self.compileIdentifier()
 
-        SymbolTable.add(current_token.value, 'var', var_type)
+        self.__symbol_table.add(current_token.value, 'var', var_type)
 
         while self.__scanner.current_token().value == ',':
             self.compileSymbol(True, ',')
@@ -210,7 +310,7 @@ class Parser:
             current_token = self.__scanner.current_token()
             self.compileIdentifier()
 
-            SymbolTable.add(current_token.value, 'var', var_type)
+            self.__symbol_table.add(current_token.value, 'var', var_type)
 
         self.compileSymbol(True, ';')
 
@@ -221,6 +321,7 @@ class Parser:
 
         while value in ['let', 'if', 'while', 'return', 'do']:
 
+            self.__mark_position()
             if value == 'let':
                 self.compileLet()
             elif value == 'if':
@@ -247,7 +348,9 @@ class Parser:
         array_let = False
 
         self.compileKeyword(True, 'let')
-        variable = SymbolTable.get_variable(self.__scanner.current_token().value)
+        variable = self.__lookup_variable(self.__scanner.current_token().value)
+        # the store is attributed to the assigned variable
+        variable_position = self.__mark_position()
         self.compileIdentifier()
         
         if self.__scanner.current_token().value == '[':
@@ -255,15 +358,26 @@ class Parser:
 
 
             self.compileSymbol(True, '[')
-            self.compileExpression()
+            index = None
+            if self.__array_access:
+                index = self.__compileArrayIndex()
+            else:
+                self.compileExpression()
             self.compileSymbol(True, ']')
-            self.__vm_writer.write_push(variable.memory_segment, variable.index)
-            self.__vm_writer.write_arithmetic('+')
+            if index is None:
+                self.__vm_writer.write_push(variable.memory_segment, variable.index)
+                self.__vm_writer.write_arithmetic('+')
 
         self.compileSymbol(True, '=')
+        if array_let and self.__array_access:
+            self.__compileArrayStore(variable, index, variable_position)
+            self.compileSymbol(True, ';')
+            return
+
         self.compileExpression()
         self.compileSymbol(True, ';')
 
+        if self.__source_map: self.__vm_writer.set_position(variable_position)
         if array_let:
             self.__vm_writer.write_pop("temp", 0)
             self.__vm_writer.write_pop("pointer", 1)
@@ -273,10 +387,80 @@ class Parser:
         else:
             self.__vm_writer.write_pop(variable.memory_segment, variable.index)
 
+    def __compileArrayStore(self, variable: Variable, index: Union[int, None], position: Union[Position, None]) -> None:
+        """Compile the right hand side of `let a[index] = ...` and the store.
+        With a constant index the address is `that index` of a itself, without
+        one the address is already on the stack. The temp 0 round trip is only
+        needed when the right hand side could change pointer 1 or a."""
+
+        self.__vm_writer.begin_capture(in_place=True)
+        self.compileExpression()
+        value = self.__vm_writer.end_capture()
+        commands = [instruction.split() for instruction, _ in value]
+        calls = any(command[0] == 'call' for command in commands)
+
+        if index is not None and (not calls or variable.memory_segment in ('local', 'argument')):
+            # a callee cannot change a local or argument, reading a after the value is the same
+            self.__vm_writer.write_captured(value, in_place=True)
+            if self.__source_map: self.__vm_writer.set_position(position)
+            self.__point_that_to(variable)
+            self.__vm_writer.write_pop('that', index)
+            self.stats['constant_array_indices'] += 1
+            return
+
+        if index is not None:
+            self.__vm_writer.write_push('constant', index)
+            self.__vm_writer.write_push(variable.memory_segment, variable.index)
+            self.__vm_writer.write_arithmetic('+')
+
+        if calls or any(command[1:2] in (['pointer'], ['that']) for command in commands):
+            self.__vm_writer.write_captured(value, in_place=True)
+            if self.__source_map: self.__vm_writer.set_position(position)
+            self.__vm_writer.write_pop('temp', 0)
+            self.__vm_writer.write_pop('pointer', 1)
+            self.__vm_writer.write_push('temp', 0)
+            self.__vm_writer.write_pop('that', 0)
+        else:
+            if self.__source_map: self.__vm_writer.set_position(position)
+            self.__vm_writer.write_pop('pointer', 1)
+            self.__vm_writer.write_captured(value, in_place=True)
+            if self.__source_map: self.__vm_writer.set_position(position)
+            self.__vm_writer.write_pop('that', 0)
+            self.stats['array_stores_without_temp'] += 1
+
+    def __compileArrayIndex(self) -> Union[int, None]:
+        """Compile an array index. An index that is a constant the `that`
+        segment can take is returned instead of being pushed."""
+
+        self.__vm_writer.begin_capture(in_place=True)
+        value = self.__compileFoldableExpression()
+        index = self.__vm_writer.end_capture()
+        if value is None and len(index) == 1 and index[0][0].startswith('push constant '):
+            value, index = int(index[0][0].split()[2]), []
+
+        if not index and value is not None and value >= 0:
+            return value
+        self.__vm_writer.write_captured(index, in_place=True)
+        self.__write_constant(value)
+        return None
+
+    def __point_that_to(self, variable: Variable) -> None:
+        """Set pointer 1 to the array in variable, unless it already is."""
+        if self.__vm_writer.that_base == (variable.memory_segment, variable.index):
+            self.stats['reused_array_bases'] += 1
+            return
+        self.__vm_writer.write_push(variable.memory_segment, variable.index)
+        self.__vm_writer.write_pop('pointer', 1)
+        self.__vm_writer.set_that_base(variable.memory_segment, variable.index)
 
     def compileWhile(self) -> None:
         label_number = self.__while_label_number
         self.__while_label_number += 1
+
+        if self.__branch_conditions:
+            self.__compileRotatedWhile(label_number)
+            return
+
         self.__vm_writer.write_label(f'WHILE_EXP{label_number}')
         self.compileKeyword(True, 'while')
 
@@ -296,6 +480,47 @@ class Parser:
         self.__vm_writer.write_goto(f'WHILE_EXP{label_number}')
         self.__vm_writer.write_label(f'WHILE_END{label_number}')
 
+    def __compileRotatedWhile(self, label_number: int) -> None:
+        """With a boolean condition the test moves below the body, so every
+        iteration runs a single if-goto instead of not, if-goto and goto.
+        The loop leaves when the condition is not -1, like `not; if-goto`."""
+
+        self.compileKeyword(True, 'while')
+        self.compileSymbol(True, '(')
+        condition, value = self.__compileCondition()
+        self.compileSymbol(True, ')')
+
+        if value == TRUE:
+            self.__vm_writer.write_label(f'WHILE_EXP{label_number}')
+            self.__compileBlock()
+            self.__vm_writer.write_goto(f'WHILE_EXP{label_number}')
+            self.stats['branch_tests_removed'] += 1
+
+        elif value is None and self.__is_boolean(condition):
+            self.__vm_writer.write_goto(f'WHILE_EXP{label_number}')
+            self.__vm_writer.write_label(f'WHILE_BODY{label_number}')
+            self.__compileBlock()
+            self.__vm_writer.write_label(f'WHILE_EXP{label_number}')
+            self.__vm_writer.write_captured(condition)
+            self.__vm_writer.write_if(f'WHILE_BODY{label_number}')
+            self.stats['branch_loops_rotated'] += 1
+
+        elif value is not None:
+            # any other constant leaves the loop before the first iteration
+            self.__vm_writer.begin_capture()
+            self.__compileBlock()
+            self.__vm_writer.end_capture()
+            self.stats['branch_tests_removed'] += 1
+
+        else:
+            self.__vm_writer.write_label(f'WHILE_EXP{label_number}')
+            self.__vm_writer.write_captured(condition)
+            self.__vm_writer.write_arithmetic('~')
+            self.__vm_writer.write_if(f'WHILE_END{label_number}')
+            self.__compileBlock()
+            self.__vm_writer.write_goto(f'WHILE_EXP{label_number}')
+            self.__vm_writer.write_label(f'WHILE_END{label_number}')
+
     def compileReturn(self, constructor: False) -> None:
         self.compileKeyword(True, 'return')
 
@@ -320,6 +545,10 @@ class Parser:
         label_number = self.__if_label_number
         self.__if_label_number += 1
 
+        if self.__branch_conditions:
+            self.__compileBranchingIf(label_number)
+            return
+
         self.compileSymbol(True, '(')
         self.compileExpression()
 
@@ -348,11 +577,122 @@ class Parser:
         else:
             self.__vm_writer.write_label(f'IF_FALSE{label_number}')
 
+    def __compileBranchingIf(self, label_number: int) -> None:
+        """Compile an if with a single conditional jump. The then branch runs
+        when the condition is not 0, like `if-goto IF_TRUE`."""
+
+        self.compileSymbol(True, '(')
+        condition, value = self.__compileCondition()
+        self.compileSymbol(True, ')')
+
+        # the then branch is held back, an else branch is laid out first
+        self.__vm_writer.begin_capture()
+        self.__compileBlock()
+        then_branch = self.__vm_writer.end_capture()
+        has_else = self.__scanner.current_token().value == 'else'
+
+        if value is not None:
+            # only the branch that runs is kept
+            self.stats['branch_tests_removed'] += 1
+            if value != FALSE:
+                self.__vm_writer.write_captured(then_branch)
+            if has_else:
+                self.compileKeyword(True, 'else')
+                self.__vm_writer.begin_capture()
+                self.__compileBlock()
+                else_branch = self.__vm_writer.end_capture()
+                if value == FALSE:
+                    self.__vm_writer.write_captured(else_branch)
+
+        elif has_else:
+            self.__vm_writer.write_captured(condition)
+            self.__vm_writer.write_if(f'IF_TRUE{label_number}')
+            self.compileKeyword(True, 'else')
+            self.__compileBlock()
+            self.__vm_writer.write_goto(f'IF_END{label_number}')
+            self.__vm_writer.write_label(f'IF_TRUE{label_number}')
+            self.__vm_writer.write_captured(then_branch)
+            self.__vm_writer.write_label(f'IF_END{label_number}')
+            self.stats['branch_single_jumps'] += 1
+
+        elif self.__is_boolean(condition):
+            # jump over the then branch when the condition is 0
+            negated = self.__negated(condition)
+            self.__vm_writer.write_captured(negated if negated is not None else condition)
+            if negated is None:
+                self.__vm_writer.write_arithmetic('~')
+            self.__vm_writer.write_if(f'IF_FALSE{label_number}')
+            self.__vm_writer.write_captured(then_branch)
+            self.__vm_writer.write_label(f'IF_FALSE{label_number}')
+            self.stats['branch_single_jumps'] += 1
+            if negated is not None: self.stats['branch_conditions_inverted'] += 1
+
+        else:
+            self.__vm_writer.write_captured(condition)
+            self.__vm_writer.write_if(f'IF_TRUE{label_number}')
+            self.__vm_writer.write_goto(f'IF_FALSE{label_number}')
+            self.__vm_writer.write_label(f'IF_TRUE{label_number}')
+            self.__vm_writer.write_captured(then_branch)
+            self.__vm_writer.write_label(f'IF_FALSE{label_number}')
+
+    def __compileBlock(self) -> None:
+        self.compileSymbol(True, '{')
+        self.compileStatements()
+        self.compileSymbol(True, '}')
+
+    def __compileCondition(self) -> Tuple[List[Tuple[str, Union[Position, None]]], Union[int, None]]:
+        """Compile the condition of an if or while without writing it. Returns
+        the held back instructions and the value of a constant condition."""
+
+        self.__vm_writer.begin_capture()
+        value = self.__compileFoldableExpression()
+        condition = self.__vm_writer.end_capture()
+
+        commands = [instruction for instruction, _ in condition]
+        if commands == ['push constant 0\n']:
+            return [], FALSE
+        elif commands == ['push constant 0\n', 'not\n']:
+            return [], TRUE
+        return condition, value
+
+    @staticmethod
+    def __is_boolean(condition: List[Tuple[str, Union[Position, None]]]) -> bool:
+        """Whether the condition code always leaves 0 or -1 on the stack."""
+        commands = [instruction.split() for instruction, _ in condition]
+        while commands and commands[-1] == ['not']:
+            commands.pop()
+        return bool(commands) and commands[-1][0] in ('lt', 'gt', 'eq')
+
+    @staticmethod
+    def __negated(condition: List[Tuple[str, Union[Position, None]]]) \
+            -> Union[List[Tuple[str, Union[Position, None]]], None]:
+        """The boolean condition negated without an extra instruction, or None.
+        `b; not` drops the not, `x < c` becomes `x > c-1` and `x > c` becomes
+        `x < c+1`."""
+
+        last = condition[-1][0].split()
+        if last == ['not']:
+            return condition[:-1]
+        if len(condition) < 2 or last[0] not in ('lt', 'gt'):
+            return None
+
+        operand = condition[-2][0].split()
+        if operand[:2] != ['push', 'constant']:
+            return None
+        constant, position = int(operand[2]), condition[-2][1]
+        if last[0] == 'lt' and constant >= 1:
+            replacement = [(f'push constant {constant - 1}\n', position), ('gt\n', condition[-1][1])]
+        elif last[0] == 'gt' and constant < MAX_CONSTANT:
+            replacement = [(f'push constant {constant + 1}\n', position), ('lt\n', condition[-1][1])]
+        else:
+            return None
+        return condition[:-2] + replacement
 
     def compileSubroutineCall(self) -> None:
         
         basic_args = 0
         subroutine_name = self.__scanner.current_token().value
+        call_position = self.__mark_position()
         self.compileIdentifier()
 
         if self.__scanner.current_token().value == '.':
@@ -362,8 +702,8 @@ class Parser:
             method_name = self.__scanner.current_token().value
             self.compileIdentifier()
 
-            if SymbolTable.contains(subroutine_name):
-                variable = SymbolTable.get_variable(subroutine_name)
+            if self.__symbol_table.contains(subroutine_name):
+                variable = self.__symbol_table.get_variable(subroutine_name)
                 basic_args = 1
                 self.__vm_writer.write_push(variable.memory_segment, variable.index)
                 class_name = variable.class_name
@@ -380,6 +720,7 @@ class Parser:
         n_args = self.compileExpressionList()
         self.compileSymbol(True, ')')
 
+        if self.__source_map: self.__vm_writer.set_position(call_position)
         if same_class:
             self.__vm_writer.write_call(f'{self.__class_name}.{subroutine_name}', n_args+basic_args)
         else:
@@ -389,27 +730,126 @@ class Parser:
     """ EXPRESSIONS GRAMMAR """
 
     def compileExpression(self) -> None:
+        self.__write_constant(self.__compileFoldableExpression())
 
-        self.compileTerm()
+    def __compileFoldableExpression(self) -> Union[int, None]:
+        """Compile an expression. With constant folding, an all-constant prefix of
+        the expression is not emitted but returned as its folded value."""
+
+        value = self.compileTerm()
         while self.__scanner.current_token().value in ['+', '-', '*', '/', '&', '|', '<', '>', '=']:
             op_token = self.__scanner.current_token().value
+            op_position = self.__mark_position()
 
             self.compileSymbol()
-            self.compileTerm()
+            right_value = self.compileTerm()
+            if self.__source_map: self.__vm_writer.set_position(op_position)
+
+            if value is not None and right_value is not None:
+                folded = fold_binary(op_token, value, right_value)
+                if folded is not None:
+                    self.stats['folded_operations'] += 1
+                    if op_token in ('*', '/'): self.stats['folded_multiply_divide'] += 1
+                    value = folded
+                    continue
+                self.__write_constant(value)
+                self.__write_constant(right_value)
+                self.__vm_writer.write_arithmetic(op_token)
+
+            elif value is not None:
+                # the right term is already on the stack, the constant left term has no side effects
+                self.__write_constant_left_operand(op_token, value)
+
+            elif right_value is not None:
+                self.__write_constant_right_operand(op_token, right_value)
+
+            else:
+                self.__vm_writer.write_arithmetic(op_token)
+
+            value = None
+
+        return value
+
+    def __write_constant_right_operand(self, op_token: str, value: int) -> None:
+        """Finish `x op_token value` when x has already been pushed."""
+
+        sequence = None
+        if self.__strength_reduce and op_token == '*':
+            sequence = multiply_sequence(value)
+        elif self.__strength_reduce and op_token == '/':
+            sequence = divide_sequence(value)
+
+        if sequence is None:
+            self.__write_constant(value)
+            self.__vm_writer.write_arithmetic(op_token)
+            return
+
+        self.stats['strength_reduced_multiply' if op_token == '*' else 'strength_reduced_divide'] += 1
+        for operation in sequence:
+            if operation[0] == 'push':
+                self.__vm_writer.write_push(operation[1], operation[2])
+            elif operation[0] == 'pop':
+                self.__vm_writer.write_pop(operation[1], operation[2])
+            else:
+                self.__vm_writer.write_arithmetic(operation[1])
 
+    def __write_constant_left_operand(self, op_token: str, value: int) -> None:
+        """Finish `value op_token x` when x has already been pushed."""
+
+        if op_token in ('+', '*', '&', '|', '='):
+            self.__write_constant_right_operand(op_token, value)
+
+        elif op_token in ('<', '>'):
+            self.__write_constant(value)
+            self.__vm_writer.write_arithmetic('>' if op_token == '<' else '<')
+
+        elif op_token == '-':
+            self.__vm_writer.write_arithmetic('neg')
+            if value != 0:
+                self.__write_constant(value)
+                self.__vm_writer.write_arithmetic('+')
+
+        else:
+            self.__vm_writer.write_pop('temp', 0)
+            self.__write_constant(value)
+            self.__vm_writer.write_push('temp', 0)
             self.__vm_writer.write_arithmetic(op_token)
 
+    def __write_constant(self, value: Union[int, None]) -> None:
+        if value is None:
+            return
+
+        if value == TRUE:
+            self.__vm_writer.write_push('constant', 0)
+            self.__vm_writer.write_arithmetic('~')
+        elif value >= 0:
+            self.__vm_writer.write_push('constant', value)
+        elif value >= -MAX_CONSTANT:
+            self.__vm_writer.write_push('constant', -value)
+            self.__vm_writer.write_arithmetic('neg')
+        else:
+            self.__vm_writer.write_push('constant', MAX_CONSTANT)
+            self.__vm_writer.write_arithmetic('~')
+
+    def compileTerm(self) -> Union[int, None]:
+        """Compile a term. With constant folding a constant term is returned
+        as its value instead of being pushed."""
 
-    def compileTerm(self) -> None:
         token = self.__scanner.current_token()
+        self.__mark_position()
 
         if token.token_type is TokenType.INTEGER_CONSTANT:
             self.compileIntegerConstant()
+            if self.__fold_constants and int(token.value) <= MAX_CONSTANT:
+                return int(token.value)
             self.__vm_writer.write_push('constant', token.value)
 
         elif token.token_type is TokenType.KEYWORD:
             self.compileKeyword()
 
+            if self.__fold_constants and token.value in ['true', 'false', 'null']:
+                return TRUE if token.value == 'true' else FALSE
+
             if token.value in ['false', 'null']:
                 self.__vm_writer.write_push('constant', 0)
 
@@ -425,12 +865,16 @@ class Parser:
 
         elif token.value == '(':
             self.compileSymbol(True, '(')
-            self.compileExpression()
+            value = self.__compileFoldableExpression()
             self.compileSymbol(True, ')')
+            return value
 
         elif token.value in ['-', '~']:
             self.compileSymbol(True, token.value)
-            self.compileTerm()
+            value = self.compileTerm()
+            if value is not None:
+                self.stats['folded_operations'] += 1
+                return fold_unary(token.value, value)
             if token.value == '-':
                 self.__vm_writer.write_arithmetic('neg')
             else:
@@ -442,30 +886,38 @@ class Parser:
                 next_token = self.__scanner.next_token()
 
                 if next_token.value == '[':
-                    variable = SymbolTable.get_variable(token.value)
+                    variable = self.__lookup_variable(token.value)
                     self.compileIdentifier()
                     self.compileSymbol(True, '[')
-                    self.compileExpression()
+                    index = None
+                    if self.__array_access:
+                        index = self.__compileArrayIndex()
+                    else:
+                        self.compileExpression()
                     self.compileSymbol(True, ']')
 
-                    self.__vm_writer.write_push(variable.memory_segment, variable.index)
+                    if index is not None:
+                        self.__point_that_to(variable)
+                        self.__vm_writer.write_push('that', index)
+                        self.stats['constant_array_indices'] += 1
+                    else:
+                        self.__vm_writer.write_push(variable.memory_segment, variable.index)
 
-                    self.__vm_writer.write_arithmetic('+')
-                    self.__vm_writer.write_pop('pointer', 1)
-                    self.__vm_writer.write_push('that', 0)
+                        self.__vm_writer.write_arithmetic('+')
+                        self.__vm_writer.write_pop('pointer', 1)
+                        self.__vm_writer.write_push('that', 0)
 
                 elif next_token.value == '(' or next_token.value == '.':
                     self.compileSubroutineCall()
 
                 else:
+                    variable = self.__lookup_variable(token.value)
                     self.compileIdentifier()
 
-                    variable = SymbolTable.get_variable(token.value)
                     self.__vm_writer.write_push(variable.memory_segment, variable.index)
 
             else:
                 self.compileIdentifier()
- 
 
     def compileExpressionList(self) -> int:
 
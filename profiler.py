@@ -0,0 +1,81 @@
+"""Opt-in compiler instrumentation for --profile.
+
+A FileProfile is filled in while one .jack file compiles: wall time of the
+scan, parse and emit phases, the token count, class symbol table sizes and,
+for every subroutine, its compile time, VM instruction count and symbol table
+sizes. Without --profile no FileProfile exists and the compiler only pays for
+an `is not None` check per subroutine.
+
+write_profile() saves the profiles of a build either as JSON or as a
+marshalled pstats table, which `python -m pstats`, snakeviz and other cProfile
+tools can open. In the pstats table every file has a `compile Class` entry
+calling `scan`, `parse` and `emit`, and `parse` calls one entry per
+subroutine.
+"""
+from __future__ import annotations
+from typing import Dict, List, Union
+
+import json
+import marshal
+
+from vm_writer import write_file_atomically
+
+PROFILE_FORMATS = ['json', 'pstats']
+
+class FileProfile:
+
+    def __init__(self, path: str, class_name: str):
+        self.path = path
+        self.class_name = class_name
+        self.phases = {'scan': 0.0, 'parse': 0.0, 'emit': 0.0}
+        self.tokens = 0
+        self.statics = 0
+        self.fields = 0
+        self.subroutines = []
+
+    def add_subroutine(self, name: str, kind: str, line: Union[int, None], seconds: float,
+                       instructions: int, arguments: int, locals: int) -> None:
+        self.subroutines.append({'name': name, 'kind': kind, 'line': line, 'seconds': seconds,
+                                 'instructions': instructions, 'arguments': arguments, 'locals': locals})
+
+    def to_dict(self) -> Dict[str, object]:
+        return {'path': self.path, 'class': self.class_name, 'phases': self.phases, 'tokens': self.tokens,
+                'statics': self.statics, 'fields': self.fields, 'subroutines': self.subroutines}
+
+def totals(profiles: List[dict]) -> Dict[str, object]:
+    return {
+        'files': len(profiles),
+        'phases': {phase: sum(profile['phases'][phase] for profile in profiles) for phase in ('scan', 'parse', 'emit')},
+        'tokens': sum(profile['tokens'] for profile in profiles),
+        'subroutines': sum(len(profile['subroutines']) for profile in profiles),
+        'instructions': sum(subroutine['instructions'] for profile in profiles for subroutine in profile['subroutines']),
+    }
+
+def pstats_table(profiles: List[dict]) -> Dict[tuple, tuple]:
+    """Build the {(file, line, name): (cc, nc, tt, ct, callers)} table pstats loads."""
+
+    table = {}
+    for profile in profiles:
+        path, phases = profile['path'], profile['phases']
+        file_key = (path, 0, f'compile {profile["class"]}')
+        total = sum(phases.values())
+        table[file_key] = (1, 1, 0.0, total, {})
+
+        subroutine_time = sum(subroutine['seconds'] for subroutine in profile['subroutines'])
+        for phase, seconds in phases.items():
+            own_time = seconds - subroutine_time if phase == 'parse' else seconds
+            table[(path, 0, phase)] = (1, 1, max(own_time, 0.0), seconds, {file_key: (1, 1, max(own_time, 0.0), seconds)})
+
+        parse_key = (path, 0, 'parse')
+        for subroutine in profile['subroutines']:
+            seconds = subroutine['seconds']
+            table[(path, subroutine['line'] or 0, subroutine['name'])] = (1, 1, seconds, seconds,
+                                                                         {parse_key: (1, 1, seconds, seconds)})
+    return table
+
+def write_profile(path: str, profiles: List[dict], profile_format: str = 'json') -> None:
+
+    if profile_format == 'pstats':
+        write_file_atomically(path, marshal.dumps(pstats_table(profiles)))
+    else:
+        write_file_atomically(path, json.dumps({'totals': totals(profiles), 'files': profiles}, indent=1))
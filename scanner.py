@@ -1,99 +1,187 @@
 from __future__ import annotations
-from typing import List
+from typing import Iterator, List, Tuple, Union
 
-from jack_token import Token
-from exceptions import OutOfTokens
+from jack_token import Token, TokenBuffer
+from exceptions import OutOfTokens, UnterminatedStringException
 
+from array import array
+from bisect import bisect_right
+import mmap
 import re
 
-class Scanner:
-
-    def __init__(self, fileName: str):
-        
-        self.__current_token_index = 0
-
-        with open(fileName, 'r') as infile:
-            all_lines = infile.readlines()
+# 1 based (line, column) of a token in its source file
+Position = Tuple[int, int]
 
-        # remove comments and strip whitespaces 
-        cleaned_lines = self.__clean_jack_file(all_lines)
-        self.__tokens = self.__tokenize(cleaned_lines)
+# One pattern classifies the whole file buffer in a single pass: every match
+# skips the whitespace and comments in front of a token and captures the
+# string constant, symbol or word in the first group, or a stray double quote
+# in the second. Only trailing whitespace and comments match with both empty.
+TOKEN_REGEX = r'''
+    (?:\s+|//[^\n]*|/\*.*?(?:\*/|\Z))*
+    (?:("[^"\n]*"|[{}()\[\].,;+\-*/&|<>=~]|[^\s{}()\[\].,;+\-*/&|<>=~"]+)|(")|\Z)
+'''
 
-    def __tokenize(self, cleaned_lines: List[str])->List[str]:
-
-        all_tokens = []
-        empty_pattern = re.compile(r'\s')
+class Scanner:
 
-        for line in cleaned_lines:
+    __TOKEN_PATTERN = re.compile(TOKEN_REGEX, re.VERBOSE | re.DOTALL)
 
-            current_token = ''
-            current_index = 0
-            string_processing = False
+    def __init__(self, fileName: Union[str, None], compact: bool = False, positions: bool = False,
+                 source: Union[str, None] = None):
+        """Scan fileName, or the given source text without touching the disk."""
 
-            while current_index < len(line):
+        self.__current_token_index = 0
 
-                char = line[current_index]
+        if source is None:
+            with open(fileName, 'r') as infile:
+                source = infile.read()
 
-                if char == '"':
+        if positions:
+            self.__tokens = self.__tokenize_with_offsets(source, compact)
+            self.__line_starts = array('L', [0])
+            self.__line_starts.extend(match.end() for match in re.finditer('\n', source))
+        else:
+            self.__tokens = self.__tokenize(source, compact)
+            self.__offsets = None
 
-                    if string_processing:
-                        all_tokens.append(Token(current_token + '"'))
-                        current_token = ''
-                    else:
-                        current_token += char
+    def __tokenize(self, source: str, compact: bool) -> Union[List[Token], TokenBuffer]:
 
-                    string_processing = False if string_processing else True
+        # compact scanners keep their tokens in an array backed TokenBuffer
+        all_tokens = TokenBuffer() if compact else []
 
-                elif (char in Token.symbols or empty_pattern.match(char)) and not string_processing:
+        for raw_token, stray_quote in self.__TOKEN_PATTERN.findall(source):
+            if raw_token:
+                all_tokens.append(raw_token if compact else Token(raw_token))
+            elif stray_quote:
+                self.__raise_unterminated_string(source)
 
-                    if current_token != '': all_tokens.append(Token(current_token))
-                    if char in Token.symbols: all_tokens.append(Token(char))
+        return all_tokens
 
-                    current_token = ''
+    def __tokenize_with_offsets(self, source: str, compact: bool) -> Union[List[Token], TokenBuffer]:
 
-                else:
-                    current_token += char
+        # finditer is slower than findall, so token offsets are only recorded on request
+        all_tokens = TokenBuffer() if compact else []
+        self.__offsets = array('L')
 
-                current_index += 1
+        for match in self.__TOKEN_PATTERN.finditer(source):
+            raw_token, stray_quote = match.groups()
+            if raw_token:
+                all_tokens.append(raw_token if compact else Token(raw_token))
+                self.__offsets.append(match.start(1))
+            elif stray_quote:
+                self.__raise_unterminated_string(source)
 
         return all_tokens
 
-    def __clean_jack_file(self, lines: List[str]) -> List[str]:
+    def __raise_unterminated_string(self, source: str) -> None:
 
-        comment_pattern = re.compile(r'^(.*?)((/\*\*?|//).*)?$')
-        asterisk_comment_pattern = re.compile(r'/\*\*?.*')
+        for match in self.__TOKEN_PATTERN.finditer(source):
+            if match.group(2):
+                line_number = source.count('\n', 0, match.start(2)) + 1
+                raise UnterminatedStringException(f'Unterminated string constant on line {line_number}')
 
-        filtered_lines = []
-        line_index = 0
+    def current_token(self) -> Token:
+        return self.__tokens[self.__current_token_index]
 
-        while line_index < len(lines):
+    def current_position(self) -> Union[Position, None]:
+        """Line and column of the current token, None unless the scanner
+        was created with positions=True."""
+        if self.__offsets is None:
+            return None
+        offset = self.__offsets[self.__current_token_index]
+        line = bisect_right(self.__line_starts, offset)
+        return line, offset - self.__line_starts[line - 1] + 1
 
-            line = lines[line_index]
-            if comment_pattern.match(line.strip()):
-                necessary_tokens = comment_pattern.match(line.strip()).group(1)
-                if necessary_tokens != '': filtered_lines.append(necessary_tokens)
+    def next_token(self) -> Token:
+        if self.has_more_tokens(): return self.__tokens[self.__current_token_index+1]
+        else: raise OutOfTokens("Out of tokens")
 
-            if asterisk_comment_pattern.search(line.strip()):
-                while not lines[line_index].strip().endswith('*/'):
-                    line_index += 1
+    def advance(self) -> None:
+        if self.has_more_tokens():
+            self.__current_token_index += 1
+        else:
+            raise OutOfTokens("Out of tokens")
 
-            line_index += 1
+    def has_more_tokens(self) -> bool:
+        return self.__current_token_index < len(self.__tokens) -1
 
-        return filtered_lines
+    def token_count(self) -> int:
+        return len(self.__tokens)
+
+class StreamingScanner:
+    """Scanner with the same interface that lexes lazily.
+
+    The file is memory mapped and tokens are produced by a generator, so only
+    the current token and the one token lookahead the parser needs are alive
+    at any time, however large the source file is.
+    """
+
+    __TOKEN_PATTERN = re.compile(TOKEN_REGEX.encode(), re.VERBOSE | re.DOTALL)
+    __NON_ASCII_PATTERN = re.compile(rb'[\x80-\xff]')
+
+    def __init__(self, fileName: str, positions: bool = False):
+
+        self.__tokens = self.__tokenize(fileName, positions)
+        self.__current_token, self.__current_position = next(self.__tokens, (None, None))
+        self.__next_token, self.__next_position = next(self.__tokens, (None, None))
+        self.__tokens_read = (self.__current_token is not None) + (self.__next_token is not None)
+
+    def __tokenize(self, fileName: str, positions: bool) -> Iterator[Tuple[Token, Union[Position, None]]]:
+
+        with open(fileName, 'rb') as infile:
+            try:
+                buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                return
+
+            # lines are counted incrementally up to every token, tokens never contain newlines
+            line, line_start, counted_up_to = 1, 0, 0
+            position = None
+            ascii_only = not positions or self.__NON_ASCII_PATTERN.search(buffer) is None
+
+            with buffer:
+                for match in self.__TOKEN_PATTERN.finditer(buffer):
+                    raw_token, stray_quote = match.groups()
+                    if raw_token:
+                        if positions:
+                            start = match.start(1)
+                            newline = buffer.find(b'\n', counted_up_to, start)
+                            while newline != -1:
+                                line, line_start = line + 1, newline + 1
+                                newline = buffer.find(b'\n', line_start, start)
+                            counted_up_to = start
+                            column = start - line_start
+                            if not ascii_only:
+                                # columns count characters like Scanner, not the bytes of the UTF-8 text
+                                column = len(buffer[line_start:start].decode(errors='replace'))
+                            position = line, column + 1
+                        yield Token(raw_token.decode()), position
+                    elif stray_quote:
+                        line_number = buffer[:match.start(2)].count(b'\n') + 1
+                        raise UnterminatedStringException(f'Unterminated string constant on line {line_number}')
 
     def current_token(self) -> Token:
-        return self.__tokens[self.__current_token_index]
+        if self.__current_token is None: raise IndexError("No tokens")
+        return self.__current_token
+
+    def current_position(self) -> Union[Position, None]:
+        return self.__current_position
 
     def next_token(self) -> Token:
-        if self.has_more_tokens(): return self.__tokens[self.__current_token_index+1]
+        if self.has_more_tokens(): return self.__next_token
         else: raise OutOfTokens("Out of tokens")
 
     def advance(self) -> None:
         if self.has_more_tokens():
-            self.__current_token_index += 1
+            self.__current_token, self.__current_position = self.__next_token, self.__next_position
+            self.__next_token, self.__next_position = next(self.__tokens, (None, None))
+            self.__tokens_read += self.__next_token is not None
         else:
             raise OutOfTokens("Out of tokens")
 
     def has_more_tokens(self) -> bool:
-        return self.__current_token_index < len(self.__tokens) -1
+        return self.__next_token is not None
 
+    def token_count(self) -> int:
+        """Tokens read so far, the whole file once the parser reached the end."""
+        return self.__tokens_read
@@ -0,0 +1,106 @@
+"""Sidecar maps from .vm instructions back to the Jack source.
+
+A map is written next to the VM file as `<Class>.vm.map`:
+
+    {"version": 1, "file": "Main.vm", "source": "Main.jack",
+     "functions": [[1, "Main.main"], ...],
+     "mappings": [[1, 12, 5], [4, 13, 9], ...]}
+
+Every mapping is `[vm_line, jack_line, jack_column]` (all 1 based) and holds
+for the following VM lines up to the next mapping, so consecutive instructions
+from the same token share one entry. Mappings and functions are sorted by VM
+line and looked up with a binary search.
+
+Look up a VM line from the command line with `python source_map.py Main.vm.map 42`.
+"""
+from __future__ import annotations
+from bisect import bisect_right
+from typing import List, Tuple, Union
+
+import json
+import os
+import sys
+
+Position = Tuple[int, int]
+
+class SourceMap:
+
+    VERSION = 1
+
+    def __init__(self, vm_file: str, source: str, mappings: List[List[int]], functions: List[List]):
+        self.vm_file = vm_file
+        self.source = source
+        self.mappings = mappings
+        self.functions = functions
+        self.__mapping_lines = [mapping[0] for mapping in mappings]
+        self.__function_lines = [function[0] for function in functions]
+
+    @classmethod
+    def from_instructions(cls, vm_file: str, source: str, lines: List[str],
+                          positions: List[Union[Position, None]]) -> SourceMap:
+        mappings, functions = [], []
+        previous = None
+        for vm_line, (line, position) in enumerate(zip(lines, positions), 1):
+            if position is not None and position != previous:
+                mappings.append([vm_line, *position])
+                previous = position
+            if line.startswith('function '):
+                functions.append([vm_line, line.split()[1]])
+        return cls(vm_file, source, mappings, functions)
+
+    @classmethod
+    def load(cls, path: str) -> SourceMap:
+        with open(path, 'r') as infile:
+            data = json.load(infile)
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f'Unsupported source map version {data.get("version")} in {path}')
+        return cls(data['file'], data['source'], data['mappings'], data['functions'])
+
+    def to_json(self) -> str:
+        # one mapping per line keeps large maps diffable without costing much space
+        entries = ',\n'.join(json.dumps(mapping) for mapping in self.mappings)
+        return f'{{"version": {self.VERSION}, "file": {json.dumps(self.vm_file)}, ' \
+               f'"source": {json.dumps(self.source)},\n"functions": {json.dumps(self.functions)},\n' \
+               f'"mappings": [\n{entries}\n]}}\n'
+
+    def lookup(self, vm_line: int) -> Union[Tuple[str, int, int, Union[str, None]], None]:
+        """Return (source, line, column, function) for a 1 based VM line."""
+
+        index = bisect_right(self.__mapping_lines, vm_line) - 1
+        if index < 0:
+            return None
+        _, line, column = self.mappings[index]
+
+        function_index = bisect_right(self.__function_lines, vm_line) - 1
+        function = self.functions[function_index][1] if function_index >= 0 else None
+        return self.source, line, column, function
+
+def remap_source_map(map_path: str, lines: List[str], old_line_numbers: List[int]) -> None:
+    """Update the map at map_path after a pass rewrote its .vm file to lines,
+    where old_line_numbers[i] is the old VM line whose position lines[i] takes."""
+
+    if not os.path.exists(map_path):
+        return
+    old_map = SourceMap.load(map_path)
+    positions = []
+    for old_line in old_line_numbers:
+        found = old_map.lookup(old_line)
+        positions.append(found[1:3] if found is not None else None)
+
+    # imported here, vm_writer itself depends on this module
+    from vm_writer import write_file_atomically
+    write_file_atomically(map_path, SourceMap.from_instructions(old_map.vm_file, old_map.source, lines, positions).to_json())
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('usage: python source_map.py <File.vm.map> <vm line>...', file=sys.stderr)
+        sys.exit(2)
+
+    source_map = SourceMap.load(sys.argv[1])
+    for vm_line in sys.argv[2:]:
+        found = source_map.lookup(int(vm_line))
+        if found is None:
+            print(f'{source_map.vm_file}:{vm_line}: no source position')
+        else:
+            source, line, column, function = found
+            print(f'{source_map.vm_file}:{vm_line}: {source}:{line}:{column} in {function}')
@@ -0,0 +1,73 @@
+from __future__ import annotations
+from typing import List, Tuple, Union
+
+from constant_folding import WORD_MASK, MAX_CONSTANT
+from cost_model import ARITHMETIC_COSTS, CALL_COST, OS_CYCLES, POP_COSTS, PUSH_COSTS
+
+Operation = Tuple
+
+# Scratch temps for the expansions. temp 0 is left to let/do statements.
+DOUBLING_TEMP = 1
+MULTIPLICAND_TEMP = 2
+
+# Hack instructions of the operations used by the expansions
+INSTRUCTION_COSTS = {
+    ('push', 'temp'): PUSH_COSTS['temp'],
+    ('pop', 'temp'): POP_COSTS['temp'],
+    ('push', 'constant'): PUSH_COSTS['constant'],
+    ('arithmetic', '+'): ARITHMETIC_COSTS['add'],
+    ('arithmetic', 'neg'): ARITHMETIC_COSTS['neg'],
+}
+
+# push constant + call Math.multiply 2 + the OS shift-and-add loop over 16 bits
+MULTIPLY_CALL_COST = PUSH_COSTS['constant'] + CALL_COST + OS_CYCLES['Math.multiply']
+
+def sequence_cost(sequence: List[Operation]) -> int:
+    return sum(INSTRUCTION_COSTS[operation[:2]] for operation in sequence)
+
+def _doubling() -> List[Operation]:
+    # the VM has no dup, so the value takes a round trip through a temp
+    return [('pop', 'temp', DOUBLING_TEMP), ('push', 'temp', DOUBLING_TEMP),
+            ('push', 'temp', DOUBLING_TEMP), ('arithmetic', '+')]
+
+def _unsigned_multiply(multiplier: int) -> List[Operation]:
+    """Multiply the value on top of the stack by 0 <= multiplier <= 0xFFFF."""
+
+    if multiplier == 0:
+        return [('pop', 'temp', DOUBLING_TEMP), ('push', 'constant', 0)]
+
+    bits = bin(multiplier)[3:]
+    if '1' not in bits:
+        return _doubling() * len(bits)
+
+    # left to right binary method: double for every bit, add x for every set bit
+    sequence = [('pop', 'temp', MULTIPLICAND_TEMP), ('push', 'temp', MULTIPLICAND_TEMP)]
+    for bit in bits:
+        sequence += _doubling()
+        if bit == '1':
+            sequence += [('push', 'temp', MULTIPLICAND_TEMP), ('arithmetic', '+')]
+    return sequence
+
+def multiply_sequence(multiplier: int) -> Union[List[Operation], None]:
+    """Inline replacement for `push constant multiplier; call Math.multiply 2`,
+    or None when the OS call is cheaper."""
+
+    # 16 bit products only depend on the multiplier modulo 2^16
+    candidates = [_unsigned_multiply(multiplier & WORD_MASK)]
+    if -MAX_CONSTANT <= multiplier < 0:
+        candidates.append(_unsigned_multiply(-multiplier) + [('arithmetic', 'neg')])
+
+    best = min(candidates, key=sequence_cost)
+    return best if sequence_cost(best) < MULTIPLY_CALL_COST else None
+
+def divide_sequence(divisor: int) -> Union[List[Operation], None]:
+    """Inline replacement for `push constant divisor; call Math.divide 2`.
+
+    Math.divide truncates towards zero and the VM has no shifts, so only
+    division by 1 and -1 has a cheaper inline form.
+    """
+    if divisor == 1:
+        return []
+    elif divisor == -1:
+        return [('arithmetic', 'neg')]
+    return None
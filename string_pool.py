@@ -0,0 +1,45 @@
+from __future__ import annotations
+from typing import Iterable, Union
+
+import os
+
+from vm_writer import VM_writer, OutputSink
+
+POOL_CLASS = 'StringPool'
+
+def write_string_construction(vm_writer: VM_writer, literal: str) -> None:
+    vm_writer.write_push("constant", len(literal))
+    vm_writer.write_call("String.new", 1)
+    for char in literal:
+        vm_writer.write_push("constant", ord(char))
+        vm_writer.write_call("String.appendChar", 2)
+
+def construction_size(literal: str) -> int:
+    """Number of VM instructions write_string_construction emits."""
+    return 2 * len(literal) + 2
+
+def pool_function_name(literal: str) -> str:
+    import hashlib
+
+    # derived from the literal itself so every class, and every worker process,
+    # agrees on the name without coordination
+    return f'{POOL_CLASS}.s{hashlib.sha1(literal.encode()).hexdigest()[:12]}'
+
+def write_string_pool(directory: str, literals: Iterable[str], sink: Union[OutputSink, None] = None) -> None:
+    """Write the StringPool class used by program wide pooling. Every literal
+    gets a function that builds the string on its first call and returns the
+    same object afterwards."""
+
+    vm_writer = VM_writer(POOL_CLASS, os.path.join(directory, f'{POOL_CLASS}.jack'), sink)
+
+    for index, literal in enumerate(sorted(set(literals))):
+        vm_writer.write_function(pool_function_name(literal), 0)
+        vm_writer.write_push('static', index)
+        vm_writer.write_if('READY')
+        write_string_construction(vm_writer, literal)
+        vm_writer.write_pop('static', index)
+        vm_writer.write_label('READY')
+        vm_writer.write_push('static', index)
+        vm_writer.write_return()
+
+    vm_writer.close()
@@ -3,72 +3,76 @@ from typing import Union
 from variable import Variable, VariableType
 
 class SymbolTable:
+    """Scopes of the class being compiled. Every Parser owns its table, so
+    parsers never share state, and static indices start at 0 in every class
+    instead of continuing from the classes compiled before."""
 
-    __STATIC_COUNTER = 0
-    __FIELD_COUNTER = 0
-    __ARGUMENT_COUNTER = 0
-    __LOCAL_COUNTER = 0
+    def __init__(self):
+        self.reset_class_table()
 
-    __IDENTIFIER_TO_VAR_CLASS_MAPPING = {}
-    __IDENTIFIER_TO_VAR_SUBROUTINE_MAPPING = {}
-
-    @classmethod
-    def get_variable(cls, identifier: str) -> Union[Variable, None]:
-        if identifier in cls.__IDENTIFIER_TO_VAR_SUBROUTINE_MAPPING:
-            return cls.__IDENTIFIER_TO_VAR_SUBROUTINE_MAPPING[identifier]
+    def get_variable(self, identifier: str) -> Union[Variable, None]:
+        if identifier in self.__identifier_to_var_subroutine_mapping:
+            return self.__identifier_to_var_subroutine_mapping[identifier]
         else:
-            return cls.__IDENTIFIER_TO_VAR_CLASS_MAPPING.get(identifier)
+            return self.__identifier_to_var_class_mapping.get(identifier)
 
-    @classmethod
-    def contains(cls, identifier: str) -> True:
-        return True if (identifier in cls.__IDENTIFIER_TO_VAR_SUBROUTINE_MAPPING \
-                or identifier in cls.__IDENTIFIER_TO_VAR_CLASS_MAPPING) else False
+    def contains(self, identifier: str) -> True:
+        return True if (identifier in self.__identifier_to_var_subroutine_mapping \
+                or identifier in self.__identifier_to_var_class_mapping) else False
 
-    @classmethod
-    def add(cls, identifier: str, var_type: str, class_name: str) -> None:
+    def add(self, identifier: str, var_type: str, class_name: str) -> None:
         variable = Variable(identifier, var_type, class_name)
 
         if variable.type is VariableType.static:
-            variable.index = cls.__STATIC_COUNTER
-            cls.__STATIC_COUNTER += 1
-            cls.__IDENTIFIER_TO_VAR_CLASS_MAPPING[identifier] = variable
+            variable.index = self.__static_counter
+            self.__static_counter += 1
+            self.__identifier_to_var_class_mapping[identifier] = variable
 
         elif variable.type is VariableType.field:
-            variable.index = cls.__FIELD_COUNTER
-            cls.__FIELD_COUNTER += 1
-            cls.__IDENTIFIER_TO_VAR_CLASS_MAPPING[identifier] = variable
+            variable.index = self.__field_counter
+            self.__field_counter += 1
+            self.__identifier_to_var_class_mapping[identifier] = variable
 
         elif variable.type is VariableType.local:
-            variable.index = cls.__LOCAL_COUNTER
-            cls.__LOCAL_COUNTER += 1
-            cls.__IDENTIFIER_TO_VAR_SUBROUTINE_MAPPING[identifier] = variable
+            variable.index = self.__local_counter
+            self.__local_counter += 1
+            self.__identifier_to_var_subroutine_mapping[identifier] = variable
 
         elif variable.type is VariableType.argument:
-            variable.index = cls.__ARGUMENT_COUNTER
-            cls.__ARGUMENT_COUNTER += 1
-            cls.__IDENTIFIER_TO_VAR_SUBROUTINE_MAPPING[identifier] = variable
-
-    @classmethod
-    def reset_subroutine_table(cls):
-        cls.__ARGUMENT_COUNTER = 0
-        cls.__LOCAL_COUNTER = 0
-        cls.__IDENTIFIER_TO_VAR_SUBROUTINE_MAPPING = {}
-
-    @classmethod
-    def reset_class_table(cls):
-        cls.reset_subroutine_table()
-        cls.__FIELD_COUNTER = 0
-        cls.__IDENTIFIER_TO_VAR_CLASS_MAPPING = {}
+            variable.index = self.__argument_counter
+            self.__argument_counter += 1
+            self.__identifier_to_var_subroutine_mapping[identifier] = variable
+
+    def reset_subroutine_table(self):
+        self.__argument_counter = 0
+        self.__local_counter = 0
+        self.__identifier_to_var_subroutine_mapping = {}
+
+    def reset_class_table(self):
+        self.reset_subroutine_table()
+        # statics are numbered per class, the VM translator gives every file its own static segment
+        self.__static_counter = 0
+        self.__field_counter = 0
+        self.__identifier_to_var_class_mapping = {}
     
     # Necessary for object methods
-    @classmethod
-    def set_argument_counter_to_one(cls):
-        cls.__ARGUMENT_COUNTER = 1
+    def set_argument_counter_to_one(self):
+        self.__argument_counter = 1
+
+    # Hidden statics, e.g. for pooled string literals
+    def allocate_static(self) -> int:
+        index = self.__static_counter
+        self.__static_counter += 1
+        return index
+
+    def get_total_fields(self):
+        return self.__field_counter
+
+    def get_total_arguments(self):
+        return self.__argument_counter
 
-    @classmethod
-    def get_total_fields(cls):
-        return cls.__FIELD_COUNTER
+    def get_total_statics(self):
+        return self.__static_counter
 
-    @classmethod
-    def get_total_locals(cls):
-        return cls.__LOCAL_COUNTER
+    def get_total_locals(self):
+        return self.__local_counter
@@ -0,0 +1,39 @@
+"""Helpers shared by the tests: compile Jack source in memory and run it on
+the VM emulator with the stubbed OS."""
+from __future__ import annotations
+from typing import List
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiler import compile_source
+from vm_emulator import VMEmulator
+
+def compile_vm(source: str, **options) -> List[str]:
+    result = compile_source(source, options=options)
+    assert result.ok, result.diagnostics
+    return result.vm.splitlines()
+
+def run_program(*sources: str, **options) -> int:
+    """Compile the classes of a program and return what Main.main returns."""
+
+    classes = []
+    for source in sources:
+        result = compile_source(source, options=options)
+        assert result.ok, result.diagnostics
+        classes.append((result.class_name, result.vm.splitlines()))
+    result = VMEmulator(classes).run(max_instructions=1_000_000)
+    assert result.finished
+    return result.return_value
+
+@pytest.fixture(name='compile_vm')
+def compile_vm_fixture():
+    return compile_vm
+
+@pytest.fixture(name='run_program')
+def run_program_fixture():
+    return run_program
@@ -0,0 +1,63 @@
+import pytest
+
+MAIN = '''
+class Main {
+    static Array s, t;
+    static int k;
+
+    function int swap() {
+        var Array old;
+        let old = s;
+        let s = t;
+        let t = old;
+        let k = k + 1;
+        return s[k] + 100;
+    }
+
+    function int main() {
+        var Array a, b, c;
+        var int i, sum;
+        let s = Array.new(4);
+        let t = Array.new(4);
+        let a = s;
+        let b = t;
+        let k = 1;
+        let b[2] = 7;
+        let a[3] = 9;
+        let s[k] = Main.swap();
+        let s[0] = Main.swap();
+        let a[2] = a[3] + a[1];
+        let c = a;
+        while (i < 4) {
+            let sum = sum + c[0] + (a[i] * (i + 1)) + b[i];
+            if (i = 1) { let c = b; }
+            let i = i + 1;
+        }
+        return sum + a[1] + a[1] + b[0];
+    }
+}
+'''
+OPTIONS = [{'array_access': True}, {'array_access': True, 'peephole': True, 'fold_constants': True},
+           {'array_access': True, 'branch_conditions': True}]
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_array_access_keeps_program_behavior(run_program, options):
+    assert run_program(MAIN) == run_program(MAIN, **options) == 1255
+
+def test_stores_of_calls_keep_the_temp_0_ordering(compile_vm):
+    lines = compile_vm(MAIN, array_access=True)
+    # index and array are evaluated before the call, the call may change both and pointer 1
+    for index in (i for i, line in enumerate(lines) if line == 'call Main.swap 0'):
+        assert lines[index + 1:index + 5] == ['pop temp 0', 'pop pointer 1', 'push temp 0', 'pop that 0']
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_pointer_1_is_set_after_every_label_jump_and_call(compile_vm, options):
+    lines = compile_vm(MAIN, **options)
+    for index, line in enumerate(lines):
+        if ' that ' not in f'{line} ':
+            continue
+        for previous in reversed(lines[:index]):
+            if previous == 'pop pointer 1':
+                break
+            assert previous.split()[0] not in ('label', 'goto', 'if-goto', 'call', 'function', 'return'), \
+                f'line {index + 1}: {line} after {previous}'
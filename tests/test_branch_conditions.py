@@ -0,0 +1,56 @@
+import pytest
+
+VALUES = [-32768, -32767, -1, 0, 1, 5, 32766, 32767]
+IF_MAIN = 'class Main {{ function int main() {{ var int x, r; let x = {x}; if ({condition}) {{ let r = 1; }} return r; }} }}'
+OPTIONS = [{'branch_conditions': True}, {'branch_conditions': True, 'fold_constants': True}]
+
+@pytest.mark.parametrize('condition, holds', [
+    ('x < 1', lambda x: x < 1),
+    ('x < 0', lambda x: x < 0),
+    ('x < 32767', lambda x: x < 32767),
+    ('x > 32766', lambda x: x > 32766),
+    ('x > 32767', lambda x: False),
+    ('x > -1', lambda x: x > -1),
+    ('x < (-32767 - 1)', lambda x: False),
+    ('x > (-32767 - 1)', lambda x: x > -32768),
+    ('~(x = 5)', lambda x: x != 5),
+    ('~(x < 1)', lambda x: x >= 1),
+])
+@pytest.mark.parametrize('options', OPTIONS)
+def test_inverted_comparisons_keep_their_meaning(run_program, condition, holds, options):
+    for x in VALUES:
+        expected = 1 if holds(x) else 0
+        source = IF_MAIN.format(x=x, condition=condition)
+        assert run_program(source) == expected, f'x = {x}'
+        assert run_program(source, **options) == expected, f'x = {x}'
+
+def test_comparisons_are_inverted_without_a_not(compile_vm):
+    lines = compile_vm(IF_MAIN.format(x=0, condition='x < 1'), branch_conditions=True)
+    assert lines[lines.index('push local 0') + 1:][:3] == ['push constant 0', 'gt', 'if-goto IF_FALSE0']
+
+    # x > 32767 would need x < 32768, which is not a constant
+    lines = compile_vm(IF_MAIN.format(x=0, condition='x > 32767'), branch_conditions=True)
+    assert lines[lines.index('push local 0') + 1:][:4] == ['push constant 32767', 'gt', 'not', 'if-goto IF_FALSE0']
+
+def test_constant_conditions_lose_their_test(run_program, compile_vm):
+    source = '''class Main { function int main() { var int i;
+        if (false) { return 111; }
+        if (true) { let i = 2; } else { return 333; }
+        while (false) { return 444; }
+        while (true) { let i = i + 1; if (i > 9) { return i; } }
+    } }'''
+    lines = compile_vm(source, branch_conditions=True)
+    assert not any(line in ('push constant 111', 'push constant 333', 'push constant 444') for line in lines)
+    # only the if in the loop body is left with a test
+    assert [line for line in lines if line.startswith('if-goto')] == ['if-goto IF_FALSE2']
+    assert run_program(source) == run_program(source, branch_conditions=True) == 10
+
+@pytest.mark.parametrize('n', [-1, 0, 1, 3])
+def test_loops_on_integers_exit_like_not_if_goto(run_program, n):
+    # `not; if-goto WHILE_END` only keeps looping while the condition is -1
+    source = f'''class Main {{ function int main() {{ var int n, count; let n = {n};
+        while (n) {{ let n = n + 1; let count = count + 1; if (count > 5) {{ return -count; }} }}
+        while (1) {{ let count = count + 100; }}
+        return count; }} }}'''
+    for options in OPTIONS:
+        assert run_program(source, **options) == run_program(source)
@@ -0,0 +1,77 @@
+import pytest
+
+from common_subexpressions import CommonSubexpressionEliminator
+from compiler import compile_source
+
+LOCALS = ['push local 0', 'push constant 3', 'call Math.multiply 2']
+FIELDS = ['push this 0', 'push static 1', 'add', 'push constant 3', 'call Math.multiply 2']
+ARRAY = ['push local 2', 'push local 0', 'add', 'pop pointer 1', 'push that 0', 'push constant 3',
+         'call Math.multiply 2']
+
+def reuses(expression, between) -> bool:
+    """Whether the second of two copies of expression is replaced by a temp."""
+    lines = ['function Main.f 3', *expression, 'pop local 1', *between, *expression, 'pop local 2',
+             'push constant 0', 'return']
+    output = CommonSubexpressionEliminator().optimize(lines)
+    if 'push temp 3' not in output:
+        return False
+    assert output.count(expression[-1]) == 1
+    return True
+
+@pytest.mark.parametrize('expression', [LOCALS, FIELDS, ARRAY])
+def test_repeated_expressions_are_reused(expression):
+    assert reuses(expression, [])
+    # a store to a variable the expression does not read changes nothing
+    assert reuses(expression, ['push constant 1', 'pop local 1'])
+
+@pytest.mark.parametrize('expression', [LOCALS, ARRAY])
+def test_a_store_to_an_operand_ends_the_reuse(expression):
+    assert not reuses(expression, ['push constant 1', 'pop local 0'])
+
+@pytest.mark.parametrize('store', [
+    ['push constant 1', 'pop static 0'],
+    ['push constant 1', 'pop this 0'],
+    ['push local 1', 'pop pointer 1', 'push constant 1', 'pop that 0'],
+], ids=['static', 'field', 'array'])
+@pytest.mark.parametrize('expression', [FIELDS, ARRAY], ids=['fields', 'array'])
+def test_memory_stores_end_the_reuse_of_memory_reads(expression, store):
+    assert not reuses(expression, store)
+    assert reuses(LOCALS, store)
+
+@pytest.mark.parametrize('call', [
+    ['call Main.g 0', 'pop temp 0'],
+    ['push local 1', 'call Output.printInt 1', 'pop temp 0'],
+    ['push constant 4', 'push constant 5', 'call Math.divide 2', 'pop local 2'],
+])
+def test_no_temp_is_live_across_a_call(call):
+    # callees and inlined bodies may use every temp, pure or not
+    assert not reuses(LOCALS, call)
+
+def test_labels_end_the_block():
+    assert not reuses(LOCALS, ['label L0'])
+    assert not reuses(LOCALS, ['goto L0', 'label L0'])
+
+def test_cse_keeps_program_behavior(run_program):
+    source = '''
+    class Main {
+        static int s;
+        function int main() {
+            var Array a;
+            var int x, y, r;
+            let a = Array.new(3);
+            let x = 7;
+            let y = 5;
+            let s = 2;
+            let a[1] = 3;
+            let r = ((x * y) + a[1]) * ((x * y) + a[1]);
+            let a[1] = a[1] + (x * y);
+            let r = r + ((x * y) + a[1]) + (s * x) + (s * x);
+            let s = s + 1;
+            let r = r + (s * x) + ((x * y) - 1);
+            let x = x + 1;
+            return r + (x * y) + (x * y);
+        }
+    }'''
+    result = compile_source(source, options={'cse': True})
+    assert result.stats['cse_expressions'] > 0
+    assert run_program(source) == run_program(source, cse=True) == run_program(source, cse=True, peephole=True)
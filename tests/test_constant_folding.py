@@ -0,0 +1,35 @@
+import pytest
+
+from constant_folding import fold_binary, fold_unary
+
+MAIN = 'class Main {{ function int main() {{ var int x; let x = {x}; return {expression}; }} }}'
+
+@pytest.mark.parametrize('expression, expected', [
+    ('32767 + 1', -32768),
+    ('-32767 - 1', -32768),
+    ('300 * 300', 24464),
+    ('-(-32767 - 1)', -32768),
+    ('7 / -2', -3),
+])
+def test_folding_wraps_like_the_vm(run_program, compile_vm, expression, expected):
+    source = MAIN.format(x=0, expression=expression)
+    assert run_program(source) == expected
+    assert run_program(source, fold_constants=True) == expected
+    # the whole expression became one constant
+    assert not any(line.split()[0] in ('add', 'sub', 'call') for line in compile_vm(source, fold_constants=True))
+
+def test_only_a_constant_prefix_is_folded(run_program, compile_vm):
+    source = MAIN.format(x=32767, expression='x + 2 + 3')
+    lines = compile_vm(source, fold_constants=True)
+    # (x + 2) + 3 is not rewritten as x + 5
+    assert 'push constant 2' in lines and 'push constant 3' in lines
+    assert 'push constant 5' not in lines
+    assert run_program(source, fold_constants=True) == run_program(source) == -32764
+
+    lines = compile_vm(MAIN.format(x=0, expression='2 + 3 + x'), fold_constants=True)
+    assert 'push constant 5' in lines
+
+def test_division_by_zero_is_left_to_the_runtime():
+    assert fold_binary('/', 1, 0) is None
+    assert fold_binary('*', 256, 256) == 0
+    assert fold_unary('-', -32768) == -32768
@@ -0,0 +1,59 @@
+from collections import Counter
+
+from compiler import compile_source
+from dead_code import DEFAULT_ROOTS, eliminate_dead_functions
+from vm_emulator import VMEmulator
+
+SYS = 'class Sys { function void init() { do Memory.init(); do Main.main(); return; } }'
+MEMORY = '''
+class Memory {
+    static int free;
+    function void init() { let free = 2048; return; }
+    function int alloc(int size) { let free = free + size; return free - size; }
+    function void deAlloc(int block) { return; }
+}
+'''
+MAIN = '''
+class Main {
+    function int main() { return Memory.alloc(3) + Memory.alloc(2); }
+    function int unused() { return Main.alsoUnused(); }
+    function int alsoUnused() { return 1; }
+}
+'''
+
+def build(directory, *sources):
+    paths = []
+    for source in sources:
+        result = compile_source(source)
+        path = directory / f'{result.class_name}.vm'
+        path.write_text(result.vm)
+        paths.append(str(path))
+    return paths
+
+def functions(directory):
+    return sorted(line.split()[1] for path in directory.glob('*.vm')
+                  for line in path.read_text().splitlines() if line.startswith('function '))
+
+def test_programs_with_their_own_os_boot_from_sys_init(tmp_path):
+    paths = build(tmp_path, SYS, MEMORY, MAIN)
+    stats = Counter()
+    dead = eliminate_dead_functions(paths, DEFAULT_ROOTS, stats)
+    assert dead == ['Main.alsoUnused', 'Main.unused', 'Memory.deAlloc']
+    assert functions(tmp_path) == ['Main.main', 'Memory.alloc', 'Memory.init', 'Sys.init']
+    assert (stats['dead_functions'], stats['live_functions']) == (3, 4)
+    assert VMEmulator.from_directory(str(tmp_path)).run().finished
+
+def test_programs_on_the_stubbed_os_start_at_main(tmp_path):
+    paths = build(tmp_path, MAIN)
+    assert eliminate_dead_functions(paths, DEFAULT_ROOTS, Counter()) == ['Main.alsoUnused', 'Main.unused']
+    assert functions(tmp_path) == ['Main.main']
+    assert VMEmulator.from_directory(str(tmp_path)).run().finished
+
+def test_extra_roots_keep_their_callees(tmp_path):
+    paths = build(tmp_path, MAIN)
+    assert eliminate_dead_functions(paths, DEFAULT_ROOTS + ['Main.unused'], Counter()) == []
+
+def test_nothing_is_removed_without_a_defined_root(tmp_path):
+    paths = build(tmp_path, MEMORY)
+    assert eliminate_dead_functions(paths, DEFAULT_ROOTS, Counter()) is None
+    assert functions(tmp_path) == ['Memory.alloc', 'Memory.deAlloc', 'Memory.init']
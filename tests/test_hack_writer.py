@@ -0,0 +1,120 @@
+import pytest
+
+from compiler import compile_source
+from hack_writer import AsmProgram, translate_class
+from vm_emulator import VMEmulator
+
+PREDEFINED = {'SP': 0, 'LCL': 1, 'ARG': 2, 'THIS': 3, 'THAT': 4, 'SCREEN': 16384, 'KBD': 24576,
+              **{f'R{register}': register for register in range(16)}}
+JUMPS = {'JGT': lambda value: value > 0, 'JEQ': lambda value: value == 0, 'JGE': lambda value: value >= 0,
+         'JLT': lambda value: value < 0, 'JNE': lambda value: value != 0, 'JLE': lambda value: value <= 0,
+         'JMP': lambda value: True}
+
+def assemble(asm: str):
+    """Decode Hack assembly into (kind, ...) tuples and the label addresses."""
+
+    lines = [line.split('//')[0].strip() for line in asm.splitlines()]
+    lines = [line for line in lines if line]
+    labels, program = {}, []
+    for line in lines:
+        if line.startswith('('):
+            labels[line[1:-1]] = len(program)
+        else:
+            program.append(line)
+
+    symbols, variables, decoded, comps = {**PREDEFINED, **labels}, 0, [], {}
+    for line in program:
+        if line.startswith('@'):
+            value = line[1:]
+            if not value.isdigit() and value not in symbols:
+                symbols[value], variables = 16 + variables, variables + 1
+            decoded.append(('A', int(value) if value.isdigit() else symbols[value]))
+            continue
+        dest, _, rest = line.rpartition('=') if '=' in line else ('', '', line)
+        comp, _, jump = rest.partition(';')
+        if comp not in comps:
+            comps[comp] = eval(f'lambda A, D, M: {comp.replace("!", "~")}')
+        decoded.append(('C', dest, comps[comp], JUMPS.get(jump)))
+    return decoded, labels
+
+def run_asm(asm: str, max_steps: int = 1_000_000) -> int:
+    """Run until the bootstrap's halt loop and return what the entry function returned."""
+
+    program, labels = assemble(asm)
+    ram = [0] * 32768
+    a = d = pc = 0
+    for _ in range(max_steps):
+        if pc == labels['$HALT']:
+            # the entry function was called with no arguments, its return value replaced ARG at 256
+            value = ram[256]
+            return value - 0x10000 if value & 0x8000 else value
+        instruction = program[pc]
+        if instruction[0] == 'A':
+            a, pc = instruction[1], pc + 1
+            continue
+        _, dest, comp, jump = instruction
+        value = comp(a, d, ram[a] if a < 32768 else 0) & 0xFFFF
+        if 'M' in dest:
+            ram[a] = value
+        signed = value - 0x10000 if value & 0x8000 else value
+        pc = a if jump is not None and jump(signed) else pc + 1
+        if 'A' in dest:
+            a = value
+        if 'D' in dest:
+            d = value
+    raise AssertionError('the program did not halt')
+
+def literal(value: int) -> str:
+    return str(value) if value >= 0 else f'-{-value - 1} - 1'
+
+def run_both(source: str, **options):
+    result = compile_source(source, options=options)
+    assert result.ok, result.diagnostics
+    program = AsmProgram()
+    program.add(translate_class(result.class_name, result.vm))
+    assert program.undefined_functions() == []
+    emulated = VMEmulator([(result.class_name, result.vm.splitlines())]).run(max_instructions=1_000_000)
+    return run_asm(program.to_asm()), emulated.return_value
+
+VALUES = [-32768, -32767, -1, 0, 1, 32766, 32767]
+IF_MAIN = '''class Main {{ function int main() {{ var int a, b, r;
+    let a = {a}; let b = {b};
+    if ({condition}) {{ let r = 1; }}
+    return r; }} }}'''
+OPTIONS = [{}, {'branch_conditions': True}, {'peephole': True}]
+
+def test_repro_greater_than_across_signs():
+    source = IF_MAIN.format(a=32767, b='-1', condition='a > b')
+    assert run_both(source) == (1, 1)
+    assert run_both(source, branch_conditions=True) == (1, 1)
+
+@pytest.mark.parametrize('options', OPTIONS)
+@pytest.mark.parametrize('condition', ['a > b', 'a < b', 'a = b', '~(a > b)', '~(a < b)', 'a > 0', 'a < 0'])
+def test_branches_on_comparisons_match_the_vm(condition, options):
+    for a in VALUES:
+        for b in VALUES:
+            source = IF_MAIN.format(a=literal(a), b=literal(b), condition=condition)
+            asm_value, vm_value = run_both(source, **options)
+            assert asm_value == vm_value, (a, b)
+
+@pytest.mark.parametrize('expression', ['a > b', 'a < b', 'a = b', '(a > b) + (a < b)'])
+def test_comparison_values_match_the_vm(expression):
+    for a in VALUES:
+        for b in VALUES:
+            source = (f'class Main {{ function int main() {{ var int a, b; let a = {literal(a)}; '
+                      f'let b = {literal(b)}; return {expression}; }} }}')
+            asm_value, vm_value = run_both(source)
+            assert asm_value == vm_value, (a, b)
+
+def test_calls_and_loops_match_the_vm():
+    source = '''
+    class Main {
+        function int fib(int n) { if (n < 2) { return n; } return Main.fib(n - 1) + Main.fib(n - 2); }
+        function int main() {
+            var int i, sum;
+            while (i < 12) { let sum = sum + Main.fib(i); let i = i + 1; }
+            return sum - (32767 - 2) - 3;
+        }
+    }'''
+    asm_value, vm_value = run_both(source)
+    assert asm_value == vm_value == 232 - 32765 - 3
@@ -0,0 +1,77 @@
+from collections import Counter
+
+import pytest
+
+from compiler import compile_source
+from inliner import DEFAULT_THRESHOLD, inline_calls
+from vm_emulator import VMEmulator
+
+POINT = '''
+class Point {
+    field int x, y;
+    static int count;
+    constructor Point new(int ax, int ay) { let x = ax; let y = ay; let count = count + 1; return this; }
+    method int getX() { return x; }
+    method int getY() { return y; }
+    method void setY(int value) { let y = value; return; }
+    method int scaled() { return getX() * Point.count(); }
+    function int count() { return count; }
+    function int max(int a, int b) { if (a > b) { return a; } return b; }
+    function int middle(int a, int b, int c) { return b; }
+}
+'''
+
+MAIN = '''
+class Main {
+    function int main() {
+        var Point p, q;
+        var Array a;
+        let a = Array.new(3);
+        let a[1] = 5;
+        let p = Point.new(3, 4);
+        let q = Point.new(10, 20);
+        do p.setY(a[1] + q.getX());
+        let a[2] = q.getY();
+        return (p.getY() * 100) + (Point.max(p.getX(), q.getX()) * 10) + Point.count() + a[2]
+               + Point.middle(1, 2, 3) + p.scaled();
+    }
+}
+'''
+
+@pytest.fixture
+def program(tmp_path):
+    for source in (POINT, MAIN):
+        result = compile_source(source)
+        (tmp_path / f'{result.class_name}.vm').write_text(result.vm)
+    return tmp_path
+
+def run(directory) -> int:
+    result = VMEmulator.from_directory(str(directory)).run(max_instructions=1_000_000)
+    assert result.finished
+    return result.return_value
+
+def inline(directory, threshold: int = DEFAULT_THRESHOLD) -> set:
+    return set(inline_calls(sorted(str(path) for path in directory.glob('*.vm')), threshold, Counter()))
+
+def test_inlined_program_behaves_the_same(program):
+    assert run(program) == 1630
+    sites = inline(program)
+    assert run(program) == 1630
+
+    assert {('Main.main', 'Point.getX'), ('Main.main', 'Point.setY'), ('Main.main', 'Point.middle')} <= sites
+    # statics keep their meaning only within their own class
+    assert ('Point.scaled', 'Point.count') in sites
+    assert ('Main.main', 'Point.count') not in sites
+    # functions that make calls are never inlined
+    assert not any(callee in ('Point.new', 'Point.scaled') for _, callee in sites)
+    assert 'call Point.getX 1' not in (program / 'Main.vm').read_text()
+
+def test_bodies_with_several_returns_jump_to_their_end(program):
+    sites = inline(program, threshold=20)
+    assert ('Main.main', 'Point.max') in sites
+    main = (program / 'Main.vm').read_text().splitlines()
+    labels = [line.split()[1] for line in main if line.startswith('label ')]
+    assert any(label.startswith('RETURN_INLINE') for label in labels)
+    # the callee's own labels get the same suffix, so two inlined copies never clash
+    assert all('_INLINE' in label for label in labels)
+    assert run(program) == 1630
@@ -0,0 +1,81 @@
+import pytest
+
+from compiler import compile_source
+
+MAIN = '''
+class Main {{
+    static int s, t;
+    field int f, g;
+
+    constructor Main new() {{ let f = 4; return this; }}
+
+    method int loop(int w, int d, Array a) {{
+        var int i, r, q;
+        while (i < 10) {{
+            let r = r + ({expression});
+            {statement}
+            let i = i + 1;
+        }}
+        return r;
+    }}
+
+    function int main() {{
+        var Main m;
+        var Array a;
+        let a = Array.new(3);
+        let a[2] = 6;
+        let s = 5;
+        let m = Main.new();
+        return m.loop(3, {divisor}, a);
+    }}
+}}
+'''
+OPTIONS = [{}, {'branch_conditions': True}, {'branch_conditions': True, 'peephole': True, 'cse': True}]
+
+def hoisted(expression: str, statement: str = '', divisor: int = 2, **options) -> bool:
+    """Whether the OS call of expression moved in front of the loop."""
+
+    source = MAIN.format(expression=expression, statement=statement, divisor=divisor)
+    result = compile_source(source, options={'hoist_invariants': True, **options})
+    assert result.ok, result.diagnostics
+    lines = result.vm.splitlines()
+    function = lines[next(index for index, line in enumerate(lines) if line.startswith('function Main.loop ')):]
+    before_loop = function[:next(index for index, line in enumerate(function)
+                                 if line.split()[0] in ('label', 'goto'))]
+    return any(line.startswith('call Math.') for line in before_loop)
+
+def behaves_the_same(run_program, expression: str, statement: str = '', divisor: int = 2) -> None:
+    source = MAIN.format(expression=expression, statement=statement, divisor=divisor)
+    expected = run_program(source)
+    for options in OPTIONS:
+        assert run_program(source, hoist_invariants=True, **options) == expected, options
+
+@pytest.mark.parametrize('options', OPTIONS)
+@pytest.mark.parametrize('expression', ['w * 3', '(w + d) * 3', 'w / 7', 'f * 3', 's * 3'])
+def test_invariant_expressions_are_hoisted(run_program, expression, options):
+    assert hoisted(expression, **options)
+    behaves_the_same(run_program, expression)
+
+@pytest.mark.parametrize('expression', ['i * 3', 'a[2] * 3', 'w / d', 'w / 0'])
+def test_unsafe_or_changing_expressions_stay_in_the_loop(run_program, expression):
+    assert not hoisted(expression)
+    if expression != 'w / 0':
+        behaves_the_same(run_program, expression)
+
+def test_division_by_a_variable_that_is_zero_is_not_run_early(run_program):
+    # the loop body never runs, so neither may the division
+    source = MAIN.format(expression='w / d', statement='', divisor=0).replace('while (i < 10)', 'while (i < 0)')
+    assert run_program(source, hoist_invariants=True) == run_program(source) == 0
+
+@pytest.mark.parametrize('statement', [
+    'let t = i;', 'let g = i;', 'let a[0] = i;', 'let q = Math.max(i, 1);', 'do Main.new();',
+], ids=['static', 'field', 'array', 'os_call', 'call'])
+@pytest.mark.parametrize('expression', ['f * 3', 's * 3'])
+def test_memory_reads_stay_when_the_loop_stores_or_calls(run_program, expression, statement):
+    assert not hoisted(expression, statement)
+    assert hoisted('w * 3', statement)
+    behaves_the_same(run_program, expression, statement)
+
+def test_pure_calls_do_not_count_as_memory_stores():
+    assert hoisted('s * 3', 'let q = Math.multiply(i, 2);')
+    assert hoisted('f * 3', 'let q = Math.divide(i, 2);')
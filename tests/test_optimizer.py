@@ -0,0 +1,52 @@
+import pytest
+
+from compiler import compile_source
+from optimizer import ArrayStoreTempRule, ConstantBranchRule, DoubleNegationRule, InvertedBranchRule, \
+        JumpToNextRule, PeepholeOptimizer, StoreLoadRule, TrueBranchRule, UnreachableCodeRule
+
+MAIN = 'class Main {{ function int main() {{ var int x, y; var Array a; {statements} }} }}'
+
+@pytest.mark.parametrize('rule, statements', [
+    ('double-negation', 'let x = 6; return ~(~x) + (-(-x));'),
+    ('constant-branch', 'let x = 3; if (false) { let x = 4; } return x;'),
+    ('true-branch', 'let x = 3; if (true) { let x = 4; } return x;'),
+    ('jump-to-next', 'let x = 3; if (true) { let x = 4; } return x;'),
+    ('unreachable', 'let x = 3; if (x > 2) { return 1; } else { return 2; }'),
+    ('inverted-branch', 'let x = 3; if (~(x < 5)) { let x = 9; } return x;'),
+    ('store-load', 'let x = 3; let x = x; return x;'),
+    ('array-store-temp', 'let a = Array.new(2); let x = 7; let a[1] = x; return a[1];'),
+])
+def test_every_rule_rewrites_compiled_code(run_program, compile_vm, rule, statements):
+    source = MAIN.format(statements=statements)
+    result = compile_source(source, options={'peephole': True})
+    assert result.stats[rule] > 0
+    assert len(result.vm.splitlines()) < len(compile_vm(source))
+    assert run_program(source, peephole=True) == run_program(source)
+
+@pytest.mark.parametrize('rule, lines', [
+    (DoubleNegationRule(), ['not', 'neg']),
+    (ConstantBranchRule(), ['push constant 1', 'if-goto L0']),
+    (TrueBranchRule(), ['push constant 1', 'not', 'if-goto L0']),
+    (JumpToNextRule(), ['goto L0', 'label L1']),
+    (UnreachableCodeRule(), ['return', 'label L0']),
+    (UnreachableCodeRule(), ['goto L0', 'function Main.f 0']),
+    # only a comparison is known to be 0 or -1, `not` of any other value is not its negation
+    (InvertedBranchRule(), ['add', 'not', 'if-goto L0', 'goto L1', 'label L0']),
+    (InvertedBranchRule(), ['lt', 'not', 'if-goto L0', 'goto L1', 'label L2']),
+    (StoreLoadRule(), ['push local 0', 'pop local 1']),
+    (StoreLoadRule(), ['push local 0', 'pop argument 0']),
+    # the value would be read through the pointer the store just set
+    (ArrayStoreTempRule(), ['push that 0', 'pop temp 0', 'pop pointer 1', 'push temp 0', 'pop that 0']),
+    (ArrayStoreTempRule(), ['push local 0', 'pop temp 0', 'pop pointer 1', 'push temp 0', 'pop that 1']),
+])
+def test_rules_leave_other_code_alone(rule, lines):
+    assert rule.rewrite([tuple(line.split()) for line in lines]) is None
+    assert PeepholeOptimizer([rule]).optimize(lines) == lines
+
+def test_array_copies_keep_their_temp(run_program, compile_vm):
+    source = MAIN.format(statements='let a = Array.new(2); let a[0] = 5; let a[1] = a[0]; return a[1];')
+    lines = compile_vm(source, peephole=True)
+    # only the store of the constant loses its temp
+    assert compile_source(source, options={'peephole': True}).stats['array-store-temp'] == 1
+    assert lines.count('push temp 0') == 1
+    assert run_program(source, peephole=True) == run_program(source) == 5
@@ -0,0 +1,66 @@
+import mmap
+
+import pytest
+
+from exceptions import UnterminatedStringException
+from scanner import Scanner, StreamingScanner
+
+SOURCE = '''// a line comment
+class Main { /* a block
+comment */ field int x; /** doc */
+    function void main() {
+        var String s;
+        let s = "a string // not a comment";
+        let s = "/* nor this */";
+        do Output.printInt(x+1-2*3/4&5|6<7>8=~9);   // trailing
+        return;
+    }
+}'''
+
+def tokens(scanner):
+    result = []
+    while scanner.token_count():
+        result.append((scanner.current_token(), scanner.current_position()))
+        if not scanner.has_more_tokens():
+            break
+        scanner.advance()
+    return result
+
+def scan_both(tmp_path, source):
+    path = tmp_path / 'Main.jack'
+    path.write_bytes(source.encode())
+    expected = tokens(Scanner(str(path), positions=True))
+    assert tokens(Scanner(None, positions=True, source=source)) == expected
+    assert [token for token, _ in tokens(Scanner(str(path)))] == [token for token, _ in expected]
+    return expected, tokens(StreamingScanner(str(path), positions=True))
+
+def test_streaming_scanner_matches_scanner(tmp_path):
+    expected, streamed = scan_both(tmp_path, SOURCE)
+    assert streamed == expected
+    assert (expected[0][0].value, expected[0][1]) == ('class', (2, 1))
+    values = [token.value for token, _ in expected]
+    assert 'a string // not a comment' in values and '/* nor this */' in values
+    assert 'doc' not in values and 'trailing' not in values
+
+@pytest.mark.parametrize('padding', range(mmap.PAGESIZE - 40, mmap.PAGESIZE + 8, 3))
+def test_tokens_across_page_boundaries(tmp_path, padding):
+    # every kind of lexeme ends up straddling the page boundary for some padding
+    source = ' ' * padding + SOURCE + '\n' + '/' * 2 + ' end' + '\n' * 3
+    expected, streamed = scan_both(tmp_path, source)
+    assert streamed == expected
+
+def test_streaming_scanner_counts_columns_in_characters(tmp_path):
+    expected, streamed = scan_both(tmp_path, 'class Main { // café\n let s = "été"; x }')
+    assert streamed == expected
+
+@pytest.mark.parametrize('source', ['', '   \n', '// only a comment', 'class /* never closed'])
+def test_empty_and_unterminated_input(tmp_path, source):
+    expected, streamed = scan_both(tmp_path, source)
+    assert streamed == expected
+
+def test_unterminated_strings_fail_on_the_same_line(tmp_path):
+    path = tmp_path / 'Main.jack'
+    path.write_text('class Main {\n let s = "open;\n}')
+    for make in (lambda: Scanner(str(path)), lambda: tokens(StreamingScanner(str(path)))):
+        with pytest.raises(UnterminatedStringException, match='line 2'):
+            make()
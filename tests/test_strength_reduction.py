@@ -0,0 +1,22 @@
+import pytest
+
+from strength_reduction import divide_sequence
+
+VALUES = [-32768, -32767, -300, -1, 0, 1, 7, 300, 32767]
+MAIN = 'class Main {{ function int main() {{ var int x; let x = {x}; return {expression}; }} }}'
+
+@pytest.mark.parametrize('expression', [
+    'x * -1', 'x * 0', 'x * 1', 'x * 2', 'x * 3', 'x * 10', 'x * -3', 'x * 16', 'x * 12345', 'x * 21845', 'x * (-32767 - 1)',
+    '-1 * x', '0 * x', '5 * x', 'x / 1', 'x / -1',
+])
+def test_reduced_operations_match_the_os_call(run_program, compile_vm, expression):
+    lines = compile_vm(MAIN.format(x=0, expression=expression), strength_reduce=True)
+    assert not any(line.startswith('call Math.') for line in lines)
+    for x in VALUES:
+        source = MAIN.format(x=x, expression=expression)
+        assert run_program(source, strength_reduce=True) == run_program(source), f'x = {x}'
+
+def test_division_by_other_constants_keeps_the_os_call(compile_vm):
+    assert divide_sequence(2) is None
+    lines = compile_vm(MAIN.format(x=0, expression='x / 2'), strength_reduce=True)
+    assert 'call Math.divide 2' in lines
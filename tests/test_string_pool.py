@@ -0,0 +1,66 @@
+import pytest
+
+from compiler import compile_source
+from string_pool import POOL_CLASS, write_string_pool
+from vm_emulator import VMEmulator
+from vm_writer import MemorySink
+
+MAIN = '''
+class Main {
+    function int main() {
+        var int i, length;
+        var String s;
+        while (i < 3) {
+            do Output.printString("hi ");
+            let s = "loop";
+            let length = length + s.length();
+            do Output.printInt(i);
+            let i = i + 1;
+        }
+        do Helper.greet();
+        do Output.printString("");
+        return length;
+    }
+}
+'''
+HELPER = '''
+class Helper {
+    function void greet() {
+        do Output.printString("hi ");
+        do Output.printString("there");
+        return;
+    }
+}
+'''
+
+def run(pool_strings):
+    classes, literals = [], set()
+    for source in (MAIN, HELPER):
+        result = compile_source(source, options={'pool_strings': pool_strings})
+        assert result.ok, result.diagnostics
+        classes.append((result.class_name, result.vm.splitlines()))
+        literals.update(result.pooled_strings)
+    if pool_strings == 'program':
+        sink = MemorySink()
+        write_string_pool('.', literals, sink)
+        classes.append((POOL_CLASS, sink.getvalue().splitlines()))
+    return VMEmulator(classes).run(max_instructions=1_000_000), classes
+
+@pytest.mark.parametrize('pool_strings', ['class', 'program'])
+def test_pooled_strings_print_the_same(pool_strings):
+    expected, _ = run(None)
+    assert expected.output == 'hi 0hi 1hi 2hi there'
+    result, _ = run(pool_strings)
+    assert result.same_behavior(expected)
+    assert result.output == expected.output and result.return_value == 12
+
+    assert expected.calls['String.new'] == 9
+    # every literal is built once, in each class that uses it or once for the whole program
+    assert result.calls['String.new'] == (5 if pool_strings == 'class' else 4)
+
+def test_program_pool_shares_literals_across_classes():
+    _, classes = run('program')
+    pool = dict(classes)[POOL_CLASS]
+    # "hi " is used by both classes and built by one pool function
+    assert sum(line.startswith('function ') for line in pool) == 4
+    assert pool.count('push constant 3') == 1
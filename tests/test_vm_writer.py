@@ -0,0 +1,18 @@
+import pytest
+
+import main
+from exceptions import UndefinedVariableException
+
+@pytest.mark.parametrize('options', [{}, {'stream': True}, {'peephole': True, 'source_map': True}])
+def test_file_output_is_replaced_only_by_a_finished_compile(tmp_path, options):
+    jack_path = tmp_path / 'Main.jack'
+    jack_path.write_text('class Main { function int main() { return 1; } }')
+    main.main(str(jack_path), options)
+    compiled = (tmp_path / 'Main.vm').read_text()
+    assert compiled.startswith('function Main.main 0\n')
+
+    jack_path.write_text('class Main { function int main() { let x = 1; return x; } }')
+    with pytest.raises(UndefinedVariableException):
+        main.main(str(jack_path), options)
+    assert (tmp_path / 'Main.vm').read_text() == compiled
+    assert not list(tmp_path.glob('*.tmp'))
@@ -0,0 +1,601 @@
+"""Headless VM emulator for benchmarking and checking the compiled programs.
+
+    emulator = VMEmulator.from_directory('sampleFiles/Pong')
+    result = emulator.run(max_instructions=50_000_000)
+    print(result.instructions, result.cycles, result.peak_stack)
+
+The .vm files are decoded once into parallel lists of small integer opcodes
+and operands with labels, statics and call targets already resolved, so the
+interpreter loop does no string handling. The Jack OS is stubbed in Python
+(Math, Memory, Array, String, Output, Screen, Keyboard, Sys) unless the
+program links in its own OS .vm files. Nothing is drawn: Screen calls only
+show up in the trace, Output text is collected, Keyboard returns scripted
+keys and input lines.
+
+A run counts the VM instructions it executed (labels are not instructions),
+their estimated Hack cycles from cost_model, including the estimated cycles of
+every OS routine called, the calls of every function and the peak stack depth
+in words. Counters are updated once per jump, call and return rather than per
+instruction, using prefix sums over the straight line code in between. The
+peak stack takes frames and locals as they are at every call and the operand
+stack of a function at the deepest point of any path through it.
+
+The trace lists the Output and Screen calls with their arguments, so two
+builds of the same program behave the same when their return value and trace
+match:
+
+    python vm_emulator.py path/to/Directory [--compare path/to/Other]
+"""
+from __future__ import annotations
+from collections import Counter
+from typing import Iterable, List, Tuple, Union
+
+import argparse
+import os
+import sys
+
+from constant_folding import fold_binary, to_word
+from cost_model import command_cost, os_cycles
+from exceptions import VMRuntimeError
+
+STACK_BASE = 256
+STATIC_BASE = 16
+TEMP_BASE = 5
+HEAP_BASE = 2048
+HEAP_END = 16384
+RAM_SIZE = 32768
+
+# returned by the entry function's frame, ends the run
+END_OF_PROGRAM = -1
+
+(PUSH_CONSTANT, PUSH_LOCAL, PUSH_ARGUMENT, PUSH_THIS, PUSH_THAT, PUSH_RAM, PUSH_POINTER_THIS, PUSH_POINTER_THAT,
+ POP_LOCAL, POP_ARGUMENT, POP_THIS, POP_THAT, POP_RAM, POP_POINTER_THIS, POP_POINTER_THAT,
+ ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT,
+ GOTO, IF_GOTO, FUNCTION, CALL, CALL_OS, RETURN) = range(30)
+
+PUSH_OPCODES = {'constant': PUSH_CONSTANT, 'local': PUSH_LOCAL, 'argument': PUSH_ARGUMENT,
+                'this': PUSH_THIS, 'that': PUSH_THAT, 'temp': PUSH_RAM, 'static': PUSH_RAM}
+POP_OPCODES = {'local': POP_LOCAL, 'argument': POP_ARGUMENT, 'this': POP_THIS, 'that': POP_THAT,
+               'temp': POP_RAM, 'static': POP_RAM}
+ARITHMETIC_OPCODES = {'add': ADD, 'sub': SUB, 'neg': NEG, 'eq': EQ, 'gt': GT, 'lt': LT, 'and': AND, 'or': OR, 'not': NOT}
+# change of the stack depth caused by every opcode, calls are handled separately
+STACK_EFFECTS = {**{opcode: 1 for opcode in range(PUSH_CONSTANT, PUSH_POINTER_THAT + 1)},
+                 **{opcode: -1 for opcode in range(POP_LOCAL, POP_POINTER_THAT + 1)},
+                 **{opcode: -1 for opcode in (ADD, SUB, EQ, GT, LT, AND, OR)},
+                 NEG: 0, NOT: 0, GOTO: 0, IF_GOTO: -1, FUNCTION: 0, RETURN: 0}
+
+NEWLINE, BACKSPACE, DOUBLE_QUOTE = 128, 129, 34
+TRACED_CLASSES = ('Output', 'Screen')
+
+class RunResult:
+
+    def __init__(self, return_value: Union[int, None], finished: bool, instructions: int, cycles: int,
+                 calls: Counter, peak_stack: int, output: str, trace: List[Tuple]):
+        self.return_value = return_value
+        self.finished = finished
+        self.instructions = instructions
+        self.cycles = cycles
+        self.calls = calls
+        self.peak_stack = peak_stack
+        self.output = output
+        self.trace = trace
+
+    def same_behavior(self, other: RunResult) -> bool:
+        return (self.finished, self.return_value, self.trace) == (other.finished, other.return_value, other.trace)
+
+    def to_dict(self) -> dict:
+        return {'return_value': self.return_value, 'finished': self.finished, 'instructions': self.instructions,
+                'cycles': self.cycles, 'peak_stack': self.peak_stack, 'calls': dict(sorted(self.calls.items()))}
+
+class DecodedProgram:
+    """VM code of a program as parallel opcode and operand lists."""
+
+    def __init__(self, classes: Iterable[Tuple[str, List[str]]]):
+        self.opcodes, self.operands, self.nargs = [], [], []
+        self.names = []
+        self.functions = {}
+        self.costs = []
+        self.max_depths = {}
+
+        statics = {}
+        pending_targets = []
+        labels = {}
+        function = None
+        for class_name, lines in classes:
+            for line in lines:
+                instruction = line.split()
+                if not instruction or instruction[0].startswith('//'):
+                    continue
+                command = instruction[0]
+
+                if command == 'label':
+                    labels[(function, instruction[1])] = len(self.opcodes)
+                    continue
+                if command == 'function':
+                    function = instruction[1]
+                    self.functions[function] = len(self.opcodes)
+                    self.__append(FUNCTION, int(instruction[2]), instruction)
+                elif command in ('push', 'pop'):
+                    segment, index = instruction[1], int(instruction[2])
+                    if segment == 'pointer':
+                        opcode = (PUSH_POINTER_THIS if index == 0 else PUSH_POINTER_THAT) if command == 'push' \
+                                else (POP_POINTER_THIS if index == 0 else POP_POINTER_THAT)
+                    else:
+                        opcode = (PUSH_OPCODES if command == 'push' else POP_OPCODES)[segment]
+                    if segment == 'temp':
+                        index += TEMP_BASE
+                    elif segment == 'static':
+                        index = statics.setdefault((class_name, index), STATIC_BASE + len(statics))
+                        if index >= STACK_BASE:
+                            raise VMRuntimeError(f'The program has more than {STACK_BASE - STATIC_BASE} statics')
+                    self.__append(opcode, index, instruction)
+                elif command in ARITHMETIC_OPCODES:
+                    self.__append(ARITHMETIC_OPCODES[command], 0, instruction)
+                elif command in ('goto', 'if-goto'):
+                    pending_targets.append((len(self.opcodes), function, instruction[1], False))
+                    self.__append(GOTO if command == 'goto' else IF_GOTO, 0, instruction)
+                elif command == 'call':
+                    pending_targets.append((len(self.opcodes), function, instruction[1], True))
+                    self.__append(CALL, 0, instruction, int(instruction[2]), instruction[1])
+                elif command == 'return':
+                    self.__append(RETURN, 0, instruction)
+                else:
+                    raise VMRuntimeError(f'Unknown VM command in {class_name}: {line.strip()}')
+
+        for index, function, target, is_call in pending_targets:
+            if not is_call:
+                if (function, target) not in labels:
+                    raise VMRuntimeError(f'Undefined label {target} in {function}')
+                self.operands[index] = labels[(function, target)]
+            elif target in self.functions:
+                self.operands[index] = self.functions[target]
+            else:
+                # not part of the program, the stub is looked up when the call runs
+                self.opcodes[index] = CALL_OS
+
+        # prefix sums, the cost of the straight line code between two pcs is one subtraction
+        self.cost_prefix = [0]
+        for cost in self.costs:
+            self.cost_prefix.append(self.cost_prefix[-1] + cost)
+        for name, start in self.functions.items():
+            self.max_depths[start] = self.__max_depth(start)
+
+    def __append(self, opcode: int, operand: int, instruction: List[str], nargs: int = 0, name: str = '') -> None:
+        self.opcodes.append(opcode)
+        self.operands.append(operand)
+        self.nargs.append(nargs)
+        self.names.append(name)
+        self.costs.append(command_cost(tuple(instruction)))
+
+    def __max_depth(self, start: int) -> int:
+        """Deepest operand stack of a function above its locals, over every path."""
+
+        depths = {start + 1: 0}
+        pending = [start + 1]
+        deepest = 0
+        while pending:
+            pc = pending.pop()
+            depth = depths[pc]
+            while pc < len(self.opcodes) and self.opcodes[pc] != FUNCTION:
+                opcode = self.opcodes[pc]
+                # a call replaces its arguments with the return value, the frame counts towards the callee
+                depth += 1 - self.nargs[pc] if opcode in (CALL, CALL_OS) else STACK_EFFECTS[opcode]
+                deepest = max(deepest, depth)
+                if opcode in (GOTO, IF_GOTO) and self.operands[pc] not in depths:
+                    depths[self.operands[pc]] = depth
+                    pending.append(self.operands[pc])
+                if opcode in (GOTO, RETURN):
+                    break
+                pc += 1
+                if pc in depths:
+                    break
+                depths[pc] = depth
+        return deepest
+
+class OperatingSystem:
+    """Python stubs of the Jack OS that work on the emulator's RAM."""
+
+    def __init__(self, ram: List[int], keys: Iterable[int], inputs: Iterable[str]):
+        self.ram = ram
+        self.keys = iter(keys)
+        self.inputs = iter(inputs)
+        self.output = []
+        self.trace = []
+        self.halted = False
+        self.__free_pointer = HEAP_BASE
+        self.__free_blocks = {}
+
+        self.stubs = {
+            'Math.multiply': lambda x, y: fold_binary('*', x, y),
+            'Math.divide': self.divide,
+            'Math.min': min, 'Math.max': max,
+            'Math.abs': lambda x: to_word(abs(x)),
+            'Math.sqrt': self.sqrt,
+            'Memory.alloc': self.alloc, 'Memory.deAlloc': self.dealloc,
+            'Memory.peek': lambda address: self.ram[address],
+            'Memory.poke': self.poke,
+            'Array.new': self.alloc, 'Array.dispose': self.dealloc,
+            'String.new': self.new_string, 'String.dispose': self.dealloc,
+            'String.length': lambda string: self.ram[string + 1],
+            'String.charAt': self.char_at, 'String.setCharAt': self.set_char_at,
+            'String.appendChar': self.append_char, 'String.eraseLastChar': self.erase_last_char,
+            'String.intValue': self.int_value, 'String.setInt': self.set_int,
+            'String.newLine': lambda: NEWLINE, 'String.backSpace': lambda: BACKSPACE,
+            'String.doubleQuote': lambda: DOUBLE_QUOTE,
+            'Output.printChar': self.print_char, 'Output.printString': self.print_string,
+            'Output.printInt': lambda value: self.print_text(str(value)),
+            'Output.println': lambda: self.print_text('\n'),
+            'Output.backSpace': lambda: self.print_char(BACKSPACE),
+            'Output.moveCursor': lambda row, column: 0,
+            'Screen.clearScreen': lambda: 0, 'Screen.setColor': lambda color: 0,
+            'Screen.drawPixel': lambda x, y: 0, 'Screen.drawLine': lambda x1, y1, x2, y2: 0,
+            'Screen.drawRectangle': lambda x1, y1, x2, y2: 0, 'Screen.drawCircle': lambda x, y, r: 0,
+            'Keyboard.keyPressed': lambda: next(self.keys, 0),
+            'Keyboard.readChar': lambda: next(self.keys, 0),
+            'Keyboard.readLine': self.read_line, 'Keyboard.readInt': self.read_int,
+            'Sys.halt': self.halt, 'Sys.wait': lambda duration: 0, 'Sys.error': self.error,
+        }
+
+    def call(self, name: str, arguments: List[int]) -> int:
+        stub = self.stubs.get(name)
+        if stub is None:
+            raise VMRuntimeError(f'Call to undefined function {name}')
+        if name.split('.')[0] in TRACED_CLASSES:
+            # strings are traced by their text, their address depends on the allocation order
+            self.trace.append((name, self.string_text(arguments[0])) if name == 'Output.printString'
+                              else (name, *arguments))
+        result = stub(*arguments)
+        return 0 if result is None else result
+
+    def error(self, code: int) -> None:
+        raise VMRuntimeError(f'Sys.error {code}')
+
+    def halt(self) -> None:
+        self.halted = True
+
+    def divide(self, x: int, y: int) -> int:
+        if y == 0:
+            self.error(3)
+        return fold_binary('/', x, y)
+
+    def sqrt(self, x: int) -> int:
+        if x < 0:
+            self.error(4)
+        root = 0
+        while (root + 1) * (root + 1) <= x:
+            root += 1
+        return root
+
+    def alloc(self, size: int) -> int:
+        if size <= 0:
+            self.error(5)
+        blocks = self.__free_blocks.get(size)
+        if blocks:
+            return blocks.pop()
+        block = self.__free_pointer + 1
+        if block + size > HEAP_END:
+            self.error(6)
+        # the size is kept in front of the block like the OS does
+        self.ram[block - 1] = size
+        self.__free_pointer = block + size
+        return block
+
+    def dealloc(self, block: int) -> None:
+        self.__free_blocks.setdefault(self.ram[block - 1], []).append(block)
+
+    def poke(self, address: int, value: int) -> None:
+        self.ram[address] = value
+
+    # a String is [capacity, length, characters...]
+    def new_string(self, capacity: int) -> int:
+        if capacity < 0:
+            self.error(14)
+        string = self.alloc(capacity + 2)
+        self.ram[string], self.ram[string + 1] = capacity, 0
+        return string
+
+    def char_at(self, string: int, index: int) -> int:
+        if not 0 <= index < self.ram[string + 1]:
+            self.error(15)
+        return self.ram[string + 2 + index]
+
+    def set_char_at(self, string: int, index: int, char: int) -> None:
+        if not 0 <= index < self.ram[string + 1]:
+            self.error(16)
+        self.ram[string + 2 + index] = char
+
+    def append_char(self, string: int, char: int) -> int:
+        length = self.ram[string + 1]
+        if length >= self.ram[string]:
+            self.error(17)
+        self.ram[string + 2 + length] = char
+        self.ram[string + 1] = length + 1
+        return string
+
+    def erase_last_char(self, string: int) -> None:
+        if self.ram[string + 1] == 0:
+            self.error(18)
+        self.ram[string + 1] -= 1
+
+    def int_value(self, string: int) -> int:
+        text = self.string_text(string)
+        digits = text[1:] if text.startswith('-') else text
+        value = 0
+        for digit in digits:
+            if not digit.isdigit():
+                break
+            value = value * 10 + int(digit)
+        return to_word(-value if text.startswith('-') else value)
+
+    def set_int(self, string: int, value: int) -> None:
+        text = str(value)
+        if len(text) > self.ram[string]:
+            self.error(19)
+        for index, char in enumerate(text):
+            self.ram[string + 2 + index] = ord(char)
+        self.ram[string + 1] = len(text)
+
+    def string_text(self, string: int) -> str:
+        length = self.ram[string + 1]
+        return ''.join(chr(char) for char in self.ram[string + 2:string + 2 + length])
+
+    def print_text(self, text: str) -> None:
+        self.output.append(text)
+
+    def print_char(self, char: int) -> None:
+        if char == NEWLINE:
+            self.output.append('\n')
+        elif char == BACKSPACE:
+            self.output.append('\b')
+        else:
+            self.output.append(chr(char))
+
+    def print_string(self, string: int) -> None:
+        self.output.append(self.string_text(string))
+
+    def read_line(self, message: int) -> int:
+        self.print_string(message)
+        line = next(self.inputs, None)
+        if line is None:
+            raise VMRuntimeError('Keyboard.readLine: no more input lines')
+        self.print_text(f'{line}\n')
+        string = self.new_string(len(line))
+        for char in line:
+            self.append_char(string, ord(char))
+        return string
+
+    def read_int(self, message: int) -> int:
+        string = self.read_line(message)
+        value = self.int_value(string)
+        self.dealloc(string)
+        return value
+
+class VMEmulator:
+
+    def __init__(self, classes: Iterable[Tuple[str, List[str]]]):
+        self.program = DecodedProgram(classes)
+
+    @classmethod
+    def from_files(cls, vm_paths: Iterable[str]) -> VMEmulator:
+        classes = []
+        for vm_path in vm_paths:
+            with open(vm_path, 'r') as infile:
+                classes.append((os.path.splitext(os.path.basename(vm_path))[0], infile.read().splitlines()))
+        return cls(classes)
+
+    @classmethod
+    def from_directory(cls, directory: str) -> VMEmulator:
+        return cls.from_files(sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.vm')))
+
+    def run(self, max_instructions: Union[int, None] = None, keys: Iterable[int] = (),
+            inputs: Iterable[str] = ()) -> RunResult:
+        """Run the program from Sys.init, or Main.main when the OS is stubbed,
+        until it returns, calls Sys.halt or has run max_instructions."""
+
+        program = self.program
+        entry = 'Sys.init' if 'Sys.init' in program.functions else 'Main.main'
+        if entry not in program.functions:
+            raise VMRuntimeError('The program defines neither Sys.init nor Main.main')
+
+        ram = [0] * RAM_SIZE
+        system = OperatingSystem(ram, keys, inputs)
+        opcodes, operands, nargs, names = program.opcodes, program.operands, program.nargs, program.names
+        cost_prefix, max_depths = program.cost_prefix, program.max_depths
+        limit = max_instructions if max_instructions is not None else float('inf')
+
+        # the entry function is called by a frame that returns to END_OF_PROGRAM
+        ram[STACK_BASE:STACK_BASE + 5] = [END_OF_PROGRAM, 0, 0, 0, 0]
+        sp = STACK_BASE + 5
+        lcl, arg, this, that = sp, STACK_BASE, 0, 0
+        pc = program.functions[entry]
+
+        call_counts = [0] * len(opcodes)
+        call_counts[pc] = 1
+        os_calls = Counter()
+        executed = cycles = 0
+        peak = 0
+        # the straight line code since segment_start is counted at the next jump
+        segment_start = pc
+        return_value, finished = None, False
+
+        while True:
+            opcode = opcodes[pc]
+            operand = operands[pc]
+            pc += 1
+
+            if opcode == PUSH_LOCAL:
+                ram[sp] = ram[lcl + operand]
+                sp += 1
+            elif opcode == PUSH_CONSTANT:
+                ram[sp] = operand
+                sp += 1
+            elif opcode == PUSH_ARGUMENT:
+                ram[sp] = ram[arg + operand]
+                sp += 1
+            elif opcode == POP_LOCAL:
+                sp -= 1
+                ram[lcl + operand] = ram[sp]
+            elif opcode == PUSH_THIS:
+                ram[sp] = ram[this + operand]
+                sp += 1
+            elif opcode == ADD:
+                sp -= 1
+                ram[sp - 1] = ((ram[sp - 1] + ram[sp] + 32768) & 0xFFFF) - 32768
+            elif opcode == IF_GOTO:
+                sp -= 1
+                executed += pc - segment_start
+                cycles += cost_prefix[pc] - cost_prefix[segment_start]
+                if ram[sp]:
+                    pc = operand
+                segment_start = pc
+                if executed >= limit:
+                    break
+            elif opcode == GOTO:
+                executed += pc - segment_start
+                cycles += cost_prefix[pc] - cost_prefix[segment_start]
+                pc = segment_start = operand
+                if executed >= limit:
+                    break
+            elif opcode == PUSH_RAM:
+                ram[sp] = ram[operand]
+                sp += 1
+            elif opcode == POP_RAM:
+                sp -= 1
+                ram[operand] = ram[sp]
+            elif opcode == PUSH_THAT:
+                ram[sp] = ram[that + operand]
+                sp += 1
+            elif opcode == POP_THIS:
+                sp -= 1
+                ram[this + operand] = ram[sp]
+            elif opcode == POP_THAT:
+                sp -= 1
+                ram[that + operand] = ram[sp]
+            elif opcode == POP_POINTER_THAT:
+                sp -= 1
+                that = ram[sp]
+            elif opcode == POP_POINTER_THIS:
+                sp -= 1
+                this = ram[sp]
+            elif opcode == PUSH_POINTER_THIS:
+                ram[sp] = this
+                sp += 1
+            elif opcode == PUSH_POINTER_THAT:
+                ram[sp] = that
+                sp += 1
+            elif opcode == SUB:
+                sp -= 1
+                ram[sp - 1] = ((ram[sp - 1] - ram[sp] + 32768) & 0xFFFF) - 32768
+            elif opcode == LT:
+                sp -= 1
+                ram[sp - 1] = -1 if ram[sp - 1] < ram[sp] else 0
+            elif opcode == GT:
+                sp -= 1
+                ram[sp - 1] = -1 if ram[sp - 1] > ram[sp] else 0
+            elif opcode == EQ:
+                sp -= 1
+                ram[sp - 1] = -1 if ram[sp - 1] == ram[sp] else 0
+            elif opcode == NOT:
+                ram[sp - 1] = ~ram[sp - 1]
+            elif opcode == NEG:
+                ram[sp - 1] = ((32768 - ram[sp - 1]) & 0xFFFF) - 32768
+            elif opcode == AND:
+                sp -= 1
+                ram[sp - 1] &= ram[sp]
+            elif opcode == OR:
+                sp -= 1
+                ram[sp - 1] |= ram[sp]
+            elif opcode == POP_ARGUMENT:
+                sp -= 1
+                ram[arg + operand] = ram[sp]
+            elif opcode == CALL:
+                executed += pc - segment_start
+                cycles += cost_prefix[pc] - cost_prefix[segment_start]
+                ram[sp:sp + 5] = [pc, lcl, arg, this, that]
+                arg = sp - nargs[pc - 1]
+                sp += 5
+                lcl = sp
+                pc = segment_start = operand
+                call_counts[pc] += 1
+                if executed >= limit:
+                    break
+            elif opcode == FUNCTION:
+                ram[sp:sp + operand] = [0] * operand
+                sp += operand
+                depth = sp + max_depths[pc - 1]
+                if depth > peak:
+                    peak = depth
+            elif opcode == RETURN:
+                executed += pc - segment_start
+                cycles += cost_prefix[pc] - cost_prefix[segment_start]
+                value = ram[sp - 1]
+                frame = lcl
+                return_address = ram[frame - 5]
+                ram[arg] = value
+                sp = arg + 1
+                lcl, arg, this, that = ram[frame - 4], ram[frame - 3], ram[frame - 2], ram[frame - 1]
+                if return_address == END_OF_PROGRAM:
+                    return_value, finished = value, True
+                    break
+                pc = segment_start = return_address
+            elif opcode == CALL_OS:
+                name = names[pc - 1]
+                count = nargs[pc - 1]
+                os_calls[name] += 1
+                cycles += os_cycles(name)
+                # the stub runs with its arguments still counted as stack
+                peak = max(peak, sp)
+                value = system.call(name, ram[sp - count:sp])
+                sp -= count
+                ram[sp] = value
+                sp += 1
+                if system.halted:
+                    executed += pc - segment_start
+                    cycles += cost_prefix[pc] - cost_prefix[segment_start]
+                    finished = True
+                    break
+
+        calls = Counter({function: call_counts[start] for function, start in program.functions.items() if call_counts[start]})
+        calls.update(os_calls)
+        return RunResult(return_value, finished, executed, cycles, calls, peak - STACK_BASE if peak else 0,
+                         ''.join(system.output), system.trace)
+
+def format_result(name: str, result: RunResult) -> str:
+    status = f'returned {result.return_value}' if result.return_value is not None \
+            else 'halted' if result.finished else 'stopped at the instruction limit'
+    return f'{name}: {status}, {result.instructions} VM instructions, about {result.cycles} Hack cycles, ' \
+           f'{sum(result.calls.values())} calls, peak stack {result.peak_stack} words'
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Run the .vm files of a directory headless and count what they do.')
+    arg_parser.add_argument('directory', help='directory with the .vm files of a program')
+    arg_parser.add_argument('--compare', metavar='DIRECTORY',
+            help='also run another build of the program, e.g. without optimizations, and check it behaves the same')
+    arg_parser.add_argument('--max-instructions', type=int, default=100_000_000)
+    arg_parser.add_argument('--key', type=int, action='append', default=[],
+            help='key code Keyboard.keyPressed returns, one call per --key, 0 afterwards')
+    arg_parser.add_argument('--input', action='append', default=[], help='line Keyboard.readLine and readInt return')
+    arg_parser.add_argument('--calls', action='store_true', help='print the calls of every function')
+    args = arg_parser.parse_args()
+
+    builds = [args.directory] + ([args.compare] if args.compare else [])
+    results = []
+    for directory in builds:
+        try:
+            result = VMEmulator.from_directory(directory).run(args.max_instructions, args.key, args.input)
+        except VMRuntimeError as error:
+            print(f'{directory}: {error}', file=sys.stderr)
+            sys.exit(1)
+        results.append(result)
+        print(format_result(directory, result))
+        if args.calls:
+            for function, count in result.calls.most_common():
+                print(f'  {count:>10}  {function}')
+
+    if args.compare:
+        result, other = results
+        print(f'{args.directory} runs {result.instructions - other.instructions:+} VM instructions '
+              f'and {result.cycles - other.cycles:+} cycles compared to {args.compare}')
+        if not result.same_behavior(other):
+            print(f'MISMATCH: {args.directory} and {args.compare} return or draw and print different things', file=sys.stderr)
+            sys.exit(1)
@@ -1,6 +1,69 @@
 from __future__ import annotations
+from typing import List, Tuple, Union
 
 import os
+import tempfile
+
+from optimizer import PeepholeOptimizer
+from source_map import Position, SourceMap
+
+# bytes a FileSink collects before each write call, a few of them cover a typical class
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+class OutputSink:
+    """Destination for the VM text produced by VM_writer."""
+
+    def write(self, text: str) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def discard(self) -> None:
+        """Drop the output of a compile that failed."""
+        pass
+
+class FileSink(OutputSink):
+    """Streams every write through a large buffer to a temporary file next to
+    the output, which is renamed over the output on close. Memory use stays
+    bounded by the buffer however large the output is."""
+
+    def __init__(self, path: str):
+        self.__path = path
+        file_descriptor, self.__temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        self.__output_file = os.fdopen(file_descriptor, 'w', buffering=OUTPUT_BUFFER_SIZE)
+        self.write = self.__output_file.write
+
+    def close(self) -> None:
+        self.__output_file.close()
+        replace_file(self.__temporary_path, self.__path)
+
+    def discard(self) -> None:
+        self.__output_file.close()
+        os.remove(self.__temporary_path)
+
+class MemorySink(OutputSink):
+    """Collects the output without touching the disk."""
+
+    def __init__(self):
+        self.__chunks = []
+        self.write = self.__chunks.append
+
+    def getvalue(self) -> str:
+        return ''.join(self.__chunks)
+
+def replace_file(temporary_path: str, path: str) -> None:
+    # mkstemp creates files readable only by the owner, give them the usual permissions
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temporary_path, 0o666 & ~umask)
+    os.replace(temporary_path, path)
+
+def write_file_atomically(path: str, text: Union[str, bytes]) -> None:
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(file_descriptor, 'wb' if isinstance(text, bytes) else 'w') as outfile:
+        outfile.write(text)
+    replace_file(temporary_path, path)
 
 class VM_writer:
 
@@ -18,36 +81,158 @@ class VM_writer:
             'neg': 'neg',
     }
 
-    def __init__(self, filename: str, full_path: str):
+    def __init__(self, filename: str, full_path: str, sink: Union[OutputSink, None] = None,
+                 optimizer: Union[PeepholeOptimizer, None] = None, source_map: bool = False,
+                 count_instructions: bool = False):
         self.__filename = filename
-        self.__output_file = open(os.path.join(os.path.dirname(full_path), f'{filename}.vm'), 'w')
+        self.__full_path = full_path
+        self.__sink = sink if sink is not None else FileSink(os.path.join(os.path.dirname(full_path), f'{filename}.vm'))
+        self.__optimizer = optimizer
+        self.source_map = None
+
+        # with an optimizer the instructions are collected and rewritten on close,
+        # counting them also collects them so the default path stays a plain sink write
+        self.__instructions = []
+        self.__collected = optimizer is not None or source_map or count_instructions
+        self.__write = self.__instructions.append if self.__collected else self.__sink.write
+
+        # with a source map every instruction is collected with the position set when it was written
+        self.__mapped = source_map
+        self.__position = None
+        self.__positions = []
+        if source_map:
+            self.__write = self.__write_mapped
+
+        # nested captures hold back instructions for the parser to reorder
+        self.__captures = []
+        self.__uncaptured_write = self.__write
+
+        # the variable `pointer 1` was last set from, while that still holds
+        self.__that_base = None
+
+    @property
+    def sink(self) -> OutputSink:
+        return self.__sink
+
+    def instruction_count(self) -> Union[int, None]:
+        """Instructions written so far, before any peephole rewrites. None
+        unless the writer collects its instructions."""
+        return len(self.__instructions) if self.__collected else None
+
+    def set_position(self, position: Union[Position, None]) -> None:
+        """Attribute the following instructions to a Jack source position."""
+        self.__position = position
+
+    def __write_mapped(self, instruction: str) -> None:
+        self.__instructions.append(instruction)
+        self.__positions.append(self.__position)
+
+    @property
+    def that_base(self) -> Union[Tuple[str, int], None]:
+        """(segment, index) of the variable `pointer 1` holds, or None when
+        that is not known at this point of the code."""
+        return self.__that_base
+
+    def set_that_base(self, memorySegment: str, index: int) -> None:
+        """Record that the last `pop pointer 1` set pointer 1 to this variable.
+        The record is dropped at every label, jump, call and return and at
+        every write that could change pointer 1 or the variable. Callees and
+        inlined bodies are free to use pointer 1, so it never survives a call."""
+        self.__that_base = (memorySegment, index)
+
+    def begin_capture(self, in_place: bool = False) -> None:
+        """Hold back the following instructions until end_capture() returns them.
+        An in place capture is written back right after, before anything else,
+        so what is known about pointer 1 carries through it."""
+        self.__captures.append(([], in_place))
+        self.__write = self.__write_captured
+        if not in_place:
+            self.__that_base = None
+
+    def __write_captured(self, instruction: str) -> None:
+        self.__captures[-1][0].append((instruction, self.__position))
+
+    def end_capture(self) -> List[Tuple[str, Union[Position, None]]]:
+        captured, in_place = self.__captures.pop()
+        if not self.__captures:
+            self.__write = self.__uncaptured_write
+        if not in_place:
+            self.__that_base = None
+        return captured
+
+    def write_captured(self, captured: List[Tuple[str, Union[Position, None]]], in_place: bool = False) -> None:
+        """Write instructions returned by end_capture() with their original positions."""
+        position = self.__position
+        for instruction, self.__position in captured:
+            self.__write(instruction)
+        self.__position = position
+        if not in_place:
+            self.__that_base = None
 
     def write_push(self, memorySegment: str, index: int) -> None:
-        self.__output_file.write(f'push {memorySegment} {index}\n')
+        self.__write(f'push {memorySegment} {index}\n')
 
     def write_pop(self, memorySegment: str, index: int) -> None:
-        self.__output_file.write(f'pop {memorySegment} {index}\n')
+        if self.__that_base is not None and (memorySegment == 'pointer' or (memorySegment, index) == self.__that_base
+                                             or memorySegment in ('this', 'that', 'static') and self.__that_base[0] in ('this', 'static')):
+            # fields and statics could be reached through that as well
+            self.__that_base = None
+        self.__write(f'pop {memorySegment} {index}\n')
 
     def write_arithmetic(self, command : str) -> None:
-        self.__output_file.write(f'{self.__operand_to_command_mapping[command]}\n')
+        if command in ('*', '/'):
+            self.__that_base = None
+        self.__write(f'{self.__operand_to_command_mapping[command]}\n')
 
     def write_label(self, label:str) -> None:
-        self.__output_file.write(f'label {label}\n')
+        self.__that_base = None
+        self.__write(f'label {label}\n')
 
     def write_goto(self, label: str) -> None:
-        self.__output_file.write(f'goto {label}\n')
+        self.__that_base = None
+        self.__write(f'goto {label}\n')
 
     def write_if(self, label: str) -> None:
-        self.__output_file.write(f'if-goto {label}\n')
+        self.__that_base = None
+        self.__write(f'if-goto {label}\n')
 
     def write_function(self, func_name: str, nlocals: int) -> None:
-        self.__output_file.write(f'function {func_name} {nlocals}\n')
+        self.__that_base = None
+        self.__write(f'function {func_name} {nlocals}\n')
 
     def write_call(self, func_name: str, nargs: int) -> None:
-        self.__output_file.write(f'call {func_name} {nargs}\n')
+        self.__that_base = None
+        self.__write(f'call {func_name} {nargs}\n')
 
     def write_return(self)-> None:
-        self.__output_file.write('return\n')
+        self.__that_base = None
+        self.__write('return\n')
 
     def close(self) -> None:
-        self.__output_file.close()
+        if self.__mapped:
+            lines, positions = ''.join(self.__instructions).splitlines(), self.__positions
+            if self.__optimizer is not None:
+                lines, positions = self.__optimizer.optimize_with_positions(lines, positions)
+            if lines:
+                self.__sink.write('\n'.join(lines) + '\n')
+            self.__write_source_map(lines, positions)
+        elif self.__optimizer is not None:
+            lines = self.__optimizer.optimize(''.join(self.__instructions).splitlines())
+            if lines:
+                self.__sink.write('\n'.join(lines) + '\n')
+        elif self.__collected:
+            self.__sink.write(''.join(self.__instructions))
+        self.__sink.close()
+
+    def discard(self) -> None:
+        """Drop everything written, the output file is left as it was."""
+        self.__sink.discard()
+
+    def __write_source_map(self, lines: List[str], positions: List[Union[Position, None]]) -> None:
+
+        self.source_map = SourceMap.from_instructions(f'{self.__filename}.vm', os.path.basename(self.__full_path),
+                                                      lines, positions)
+        # in memory compiles keep the map on the writer only
+        if not isinstance(self.__sink, MemorySink):
+            map_path = os.path.join(os.path.dirname(self.__full_path), f'{self.__filename}.vm.map')
+            write_file_atomically(map_path, self.source_map.to_json())